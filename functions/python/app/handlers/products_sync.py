@@ -1,37 +1,223 @@
+import concurrent.futures
 import logging
 import json
+import os
+import threading
 import time
+import zlib
+from datetime import datetime, timezone
+from typing import Callable
 
 from firebase_functions.firestore_fn import (
     Event,
     DocumentSnapshot,
 )
-from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.publisher.futures import Future
 from google.api_core.exceptions import DeadlineExceeded
-from pydantic import BaseModel
 from app.models.product import (
     FirestoreProduct,
+    FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+)
+from app.services.firestore import get_fn_event_type, try_acquire_lease, FN_EVENT_TYPE
+from app.services.product.firestore import (
+    PRODUCT_404,
+    BatchWriteResult,
+    delete_products_by_ids,
+    get_product_read_cache_stats,
+    get_products_by_ids,
+    invalidate_cached_products,
+    is_product_read_cache_enabled,
+    upsert_products_by_ids,
+)
+from app.services.product import (
+    get_another_model_from_product,
+    get_another_models_from_products,
+)
+from app.services.product.content_hash import (
+    elide_unchanged_writes,
+    get_content_hash_stats,
+    invalidate_content_hashes,
+    is_content_hash_enabled,
+    record_written_documents,
+)
+from app.services.product.changes import (
+    get_change_filter_stats,
+    has_relevant_changes,
+    is_change_filter_enabled,
+    record_change_filter_result,
+)
+from app.services.product.bulk_messages import (
+    TriggerMessage,
+    decode_bulk_messages,
+    encode_bulk_message,
+    is_carry_state_enabled,
+)
+from app.services.product.sync_lag import (
+    get_oldest_write_time,
+    record_synced_lag,
+    reset_sync_staleness,
+    set_sync_staleness,
+)
+from app.metrics import (
+    PIPELINE_STAGE,
+    log_metrics,
+    maybe_log_metrics,
+    record_batch_size,
+    record_stage,
+    record_stage_errors,
+    set_gauge,
+    timed_stage,
+)
+from app.services.throttling import (
+    AdaptiveBatchSize,
+    Debouncer,
+    HeldLease,
+    TokenBucketRateLimiter,
 )
-from app.services.firestore import get_fn_event_type, FN_EVENT_TYPE
-from app.services.product.firestore import delete_product_by_id, get_product_by_id, upsert_product_by_id
-from app.services.product import get_another_model_from_product
 from app.services.pubsub import (
+    AckManager,
     get_or_create_subscription,
     get_or_create_topic,
     get_pubsub_publisher_client,
     get_pubsub_subscriber_client,
+    invalidate_provisioned_path_on_not_found,
+    provision_pubsub_resources,
+    register_pubsub_shutdown_hook,
 )
 
 _logger = logging.getLogger(__name__)
 
 
-class TriggerMessage(BaseModel):
-    product_id: str
-    event_type: FN_EVENT_TYPE
+# The final message for a product in a pull, with the ack_ids of every message
+# that was coalesced into it
+BulkMessage = tuple[TriggerMessage, list[str]]
 
 
 BULK_TOPIC_NAME="bulk-products"
 TRIGGER_TOPIC_NAME="trigger-products"
+BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS = 120
+
+
+# Number of messages to pull in the first request, tuned per batch afterwards
+BULK_INITIAL_BATCH_SIZE = 40
+
+# Lives as long as the instance, so warm invocations start from the tuned size
+_bulk_batch_size = AdaptiveBatchSize(
+    initial_size=BULK_INITIAL_BATCH_SIZE,
+    min_size=int(os.environ.get("BULK_MIN_BATCH_SIZE", "10")),
+    max_size=int(os.environ.get("BULK_MAX_BATCH_SIZE", "1000")),
+    target_latency_sec=float(os.environ.get("BULK_BATCH_TARGET_LATENCY_SEC", "5")),
+)
+
+
+# Caps the writes this instance sends to other_product_model. The rate is cut in
+# half when Firestore pushes back and recovers additively up to the configured one.
+# Total load is this rate times max_instances of products_sync_bulk.
+_other_product_model_write_limiter = TokenBucketRateLimiter(
+    rate_per_sec=float(os.environ.get("OTHER_PRODUCT_MODEL_WRITE_OPS_PER_SEC", "500")),
+    burst=int(os.environ.get("OTHER_PRODUCT_MODEL_WRITE_BURST", "500")),
+    min_rate_per_sec=float(
+        os.environ.get("OTHER_PRODUCT_MODEL_WRITE_MIN_OPS_PER_SEC", "10")
+    ),
+)
+
+
+def get_bulk_batch_size() -> AdaptiveBatchSize:
+    return _bulk_batch_size
+
+
+def get_other_product_model_write_limiter() -> TokenBucketRateLimiter:
+    return _other_product_model_write_limiter
+
+
+def get_bulk_shards() -> int:
+    return max(1, int(os.environ.get("BULK_SHARDS", "4")))
+
+
+def get_bulk_read_concurrency() -> int:
+    return max(1, int(os.environ.get("BULK_READ_CONCURRENCY", "4")))
+
+
+def get_bulk_write_concurrency() -> int:
+    return max(1, int(os.environ.get("BULK_WRITE_CONCURRENCY", "2")))
+
+
+def get_bulk_ack_concurrency() -> int:
+    return max(1, int(os.environ.get("BULK_ACK_CONCURRENCY", "4")))
+
+
+# Per stage limits shared by all shards. Transforms are CPU bound and run on the
+# shard threads without a limit of their own.
+_bulk_read_semaphore = threading.BoundedSemaphore(get_bulk_read_concurrency())
+_bulk_write_semaphore = threading.BoundedSemaphore(get_bulk_write_concurrency())
+
+# Created on first use and kept for the life of the instance
+_bulk_shard_executor: concurrent.futures.ThreadPoolExecutor | None = None
+_bulk_prefetch_executor: concurrent.futures.ThreadPoolExecutor | None = None
+_bulk_executors_lock = threading.Lock()
+
+
+def get_bulk_shard_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _bulk_shard_executor
+    with _bulk_executors_lock:
+        if _bulk_shard_executor is None:
+            _bulk_shard_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=get_bulk_shards(), thread_name_prefix="bulk-shard"
+            )
+        return _bulk_shard_executor
+
+
+def get_bulk_prefetch_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _bulk_prefetch_executor
+    with _bulk_executors_lock:
+        if _bulk_prefetch_executor is None:
+            _bulk_prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="bulk-prefetch"
+            )
+        return _bulk_prefetch_executor
+
+
+def is_bulk_drain_enabled() -> bool:
+    return os.environ.get("BULK_DRAIN_ENABLED", "true") == "true"
+
+
+def get_bulk_drain_time_budget() -> float:
+    # Stay well below the function timeout_sec=300
+    return float(os.environ.get("BULK_DRAIN_TIME_BUDGET_SEC", "240"))
+
+
+def get_bulk_ack_sub_batch_size() -> int:
+    # Products synced and acked together inside one pulled batch
+    return int(os.environ.get("BULK_ACK_SUB_BATCH_SIZE", "100"))
+
+
+def get_bulk_nack_delay() -> int:
+    # Seconds before a failed message is redelivered. A few seconds keeps a failing
+    # message from being pulled again straight away by the same drain loop.
+    return int(os.environ.get("BULK_NACK_DELAY_SEC", "10"))
+
+
+def get_trigger_debounce_window() -> float:
+    # 0 publishes a trigger for every event
+    return float(os.environ.get("TRIGGER_DEBOUNCE_WINDOW_SEC", "1"))
+
+
+def is_trigger_fire_and_forget() -> bool:
+    return os.environ.get("TRIGGER_PUBLISH_FIRE_AND_FORGET") == "true"
+
+
+def get_publish_deadline() -> float:
+    return float(os.environ.get("PUBLISH_DEADLINE_SEC", "30"))
+
+
+def provision_products_sync_resources() -> None:
+    """Create the sync topics and subscription, meant to run once at deploy time."""
+
+    provision_pubsub_resources(
+        [BULK_TOPIC_NAME, TRIGGER_TOPIC_NAME],
+        [(BULK_TOPIC_NAME, True, BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS)],
+    )
 
 ###################################################################################
 ############################# FIRESTORE HANDLER ###################################
@@ -64,64 +250,216 @@ def get_product_from_event(
     return product
 
 
-def products_sync_handler(event: Event[DocumentSnapshot]) -> None:
+def get_document_update_time(
+    event: Event[DocumentSnapshot], event_type: FN_EVENT_TYPE
+) -> datetime | None:
+    snapshot = event.data.before if event_type == FN_EVENT_TYPE.DELETE else event.data.after
+    return getattr(snapshot, "update_time", None)
+
+
+def _log_publish_result(
+    future: Future,
+    topic_path: str,
+    description: str,
+    event_id: str | None = None,
+    ordering_key: str | None = None,
+    started_at: float | None = None,
+) -> None:
+    try:
+        message_id = future.result()
+        if started_at is not None:
+            record_stage(PIPELINE_STAGE.PUBLISH, time.monotonic() - started_at)
+        _logger.info(f"Published {description}: {message_id} event.id={event_id}")
+    except Exception as e:
+        record_stage_errors(PIPELINE_STAGE.PUBLISH)
+        invalidate_provisioned_path_on_not_found(topic_path, e)
+        _logger.error(f"Error publishing {description}: {str(e)} event.id={event_id}")
+
+        # A failed publish pauses its ordering key on the pooled publisher,
+        # later messages for the product would fail until it is resumed
+        if ordering_key:
+            get_pubsub_publisher_client(True).resume_publish(topic_path, ordering_key)
+
+
+def publish_trigger_message() -> Future:
+    """
+    Publish a trigger without waiting for it, the result is logged from a callback.
+
+    Raises:
+        When the publish can't even be started, so it is not taken for a debounce
+    """
+
+    publisher = get_pubsub_publisher_client(True)
+    trigger_topic_path = get_or_create_topic(publisher, TRIGGER_TOPIC_NAME)
+
+    started_at = time.monotonic()
+    try:
+        trigger_future = publisher.publish(
+            trigger_topic_path, data=json.dumps({"trigger_it": True}).encode("utf-8")
+        )
+    except Exception:
+        record_stage_errors(PIPELINE_STAGE.PUBLISH)
+        raise
+
+    trigger_future.add_done_callback(
+        lambda future: _log_publish_result(
+            future,
+            trigger_topic_path,
+            "trigger message for bulk sync function",
+            started_at=started_at,
+        )
+    )
+
+    return trigger_future
+
+
+def _acquire_trigger_lease() -> HeldLease | None:
+    return try_acquire_lease(TRIGGER_TOPIC_NAME, get_trigger_debounce_window())
+
+
+# Publishes at most one trigger per window from this instance, plus a trailing one
+# after the last event of a burst, from one of the invocations inside the window. With TRIGGER_DEBOUNCE_SHARED_LEASE=true instances
+# also coalesce with each other through a lease document in Firestore.
+_trigger_debouncer = Debouncer(
+    publish_trigger_message,
+    window_sec=get_trigger_debounce_window(),
+    acquire_lease=(
+        _acquire_trigger_lease
+        if os.environ.get("TRIGGER_DEBOUNCE_SHARED_LEASE") == "true"
+        else None
+    ),
+)
+register_pubsub_shutdown_hook(_trigger_debouncer.flush)
+
+
+def trigger_bulk_sync() -> Future | None:
+    """
+    Returns:
+        The trigger's publish future, None when another invocation's trigger
+        covers this event
+
+    Raises:
+        When this call had to publish the trigger and it failed
+    """
+
+    return _trigger_debouncer.trigger()
+
+
+def get_bulk_message_from_event(
+    event: Event[DocumentSnapshot],
+) -> TriggerMessage | None:
+    """
+    Build the bulk message for a product write.
+
+    Returns:
+        The message, or None when nothing other_product_model depends on changed
+    """
+
     # Get the data from the event
     event_type = get_fn_event_type(event)
     product = get_product_from_event(event, event_type)
 
-    # Create the pubsub stuff
-    publisher = get_pubsub_publisher_client(True)
-    bulk_topic_path = get_or_create_topic(
-        publisher, BULK_TOPIC_NAME
-    )
-    trigger_topic_path = get_or_create_topic(
-        publisher, TRIGGER_TOPIC_NAME
-    )
+    # Skip both publishes when nothing other_product_model depends on has changed
+    if is_change_filter_enabled():
+        relevant = has_relevant_changes(
+            event_type,
+            event.data.before.to_dict() if event.data.before else None,
+            event.data.after.to_dict() if event.data.after else None,
+        )
+        record_change_filter_result(relevant)
+        if not relevant:
+            _logger.info(
+                f"Suppressed event without relevant changes product_id={product.id} event.id={event.id} stats={get_change_filter_stats()}"
+            )
+            return None
 
     # Create the message payload
     message_payload = TriggerMessage(
         product_id=product.id,
         event_type=event_type,
+        update_time=get_document_update_time(event, event_type),
+        event_time=getattr(event, "time", None),
+    )
+
+    # In carry-state mode the bulk handler writes this snapshot without reading the product again
+    if event_type != FN_EVENT_TYPE.DELETE and is_carry_state_enabled():
+        try:
+            message_payload.snapshot = get_another_model_from_product(product)
+        except Exception as e:
+            _logger.error(f"Error transforming product {product.id}, sending a reference: {e}")
+
+    return message_payload
+
+
+def products_sync_handler(event: Event[DocumentSnapshot]) -> None:
+    message_payload = get_bulk_message_from_event(event)
+    if message_payload is None:
+        return
+
+    # Create the pubsub stuff
+    publisher = get_pubsub_publisher_client(True)
+    bulk_topic_path = get_or_create_topic(
+        publisher, BULK_TOPIC_NAME
     )
 
     # Send the payload to the bulk topic
     # Here is where we store our messages to be processed by the bulk function
+    futures: list[Future] = []
+    data, attributes = encode_bulk_message(message_payload)
+    started_at = time.monotonic()
     try:
         future = publisher.publish(
             bulk_topic_path,
-            data=json.dumps({"data": message_payload.model_dump()}).encode("utf-8"),
+            data=data,
             ordering_key=message_payload.product_id,
+            **attributes,
         )
-        message_id = future.result()
-        _logger.info(
-            f"Published product to bulk sync topic: {message_id} event.id={event.id}"
+        future.add_done_callback(
+            lambda future: _log_publish_result(
+                future,
+                bulk_topic_path,
+                "product to bulk sync topic",
+                event.id,
+                message_payload.product_id,
+                started_at,
+            )
         )
+        futures.append(future)
     except Exception as e:
+        record_stage_errors(PIPELINE_STAGE.PUBLISH)
         _logger.error(f"Error publishing to bulk topic: {str(e)} event.id={event.id}")
 
     # Publish trigger message
     # This is how we trigger the bulk processing function to be called.
-    # This will bombard the products_sync_bulk function with more messages than needed,
-    # probably resulting in 429s and retrys, but it's the only way I can think of to trigger the function
+    # Publishing one trigger per event bombards the products_sync_bulk function with more messages
+    # than needed, resulting in 429s and retrys, but it's the only way I can think of to trigger the function
     # when the firestore document is updated without having to provision an ever running cloud run instance.
-    # Since it is triggered immediately, the bulk function will be called immediately so it is also the
-    # fastest way to trigger the function and sync the data.
-    # The only downside is that it will bombard the bulk function with more messages than needed, so we will get 429s in the logs.
+    # Since the bulk function drains the whole subscription, one trigger per window is enough: the first event
+    # of a burst triggers immediately and the rest are folded into one trailing trigger after the last event.
+    # A debounced invocation waits for the end of the window so the trailing trigger is published while it
+    # still runs, Cloud Functions throttles the CPU of instances between requests.
     try:
-        trigger_future = publisher.publish(
-            trigger_topic_path, data=json.dumps({"trigger_it": True}).encode("utf-8")
-        )
-        trigger_message_id = trigger_future.result()
-        _logger.info(
-            f"Published trigger message for bulk sync function: {trigger_message_id} event.id={event.id}"
-        )
+        trigger_future = trigger_bulk_sync()
     except Exception as e:
+        _logger.error(f"Error publishing to trigger topic: {str(e)} event.id={event.id}")
+    else:
+        if trigger_future is None:
+            _logger.info(f"Debounced trigger message event.id={event.id}")
+        elif not is_trigger_fire_and_forget():
+            futures.append(trigger_future)
+
+    # Both publishes are in flight at the same time, wait for them together.
+    # In fire and forget mode the trigger is flushed with the publisher on shutdown.
+    _, not_done = concurrent.futures.wait(futures, timeout=get_publish_deadline())
+    if not_done:
         _logger.error(
-            f"Error publishing to trigger topic: {str(e)} event.id={event.id}"
+            f"Timed out waiting for {len(not_done)} / {len(futures)} publishes event.id={event.id}"
         )
 
-    publisher.stop()
-    del publisher
+    # The publisher is pooled and shared across invocations, it is flushed
+    # on instance shutdown instead of being stopped here.
+
+    maybe_log_metrics()
 
     # _logger.info(f"Published message to topic: {message_id} event.id={event.id}")
 
@@ -135,13 +473,99 @@ def products_sync_handler(event: Event[DocumentSnapshot]) -> None:
 ###################################################################################
 
 
+def _get_newest_message(
+    previous: TriggerMessage | None, message: TriggerMessage
+) -> TriggerMessage:
+    if previous is None or FN_EVENT_TYPE.DELETE in (previous.event_type, message.event_type):
+        return message
+
+    # Two upserts. A reference only message means the product gets read, which is
+    # always the newest version, otherwise keep the newest carried snapshot.
+    if previous.snapshot is None or message.snapshot is None:
+        return message.model_copy(update={"snapshot": None})
+
+    if (
+        previous.update_time is not None
+        and message.update_time is not None
+        and previous.update_time > message.update_time
+    ):
+        return previous
+
+    return message
+
+
+def _coalesce_message(
+    previous: TriggerMessage | None, message: TriggerMessage
+) -> TriggerMessage:
+    newest = _get_newest_message(previous, message)
+    if previous is None:
+        return newest
+
+    # The lag of the coalesced writes is measured from the oldest one
+    write_times = [
+        write_time
+        for write_time in map(get_oldest_write_time, (previous, message))
+        if write_time is not None
+    ]
+    return newest.model_copy(
+        update={"oldest_write_time": min(write_times) if write_times else None}
+    )
+
+
+def coalesce_bulk_messages(
+    messages: list[tuple[TriggerMessage, str]],
+) -> list[BulkMessage]:
+    """
+    Reduce a pull to a single final action per product, last write wins.
+
+    Messages must be in arrival order, which the ordered subscription keeps per
+    product_id. Between upserts carrying a snapshot, the newest update_time wins.
+    Every ack_id is kept so that all the messages get acknowledged, and the
+    oldest write time so that its lag is measured from the first write.
+    """
+
+    coalesced: dict[str, BulkMessage] = {}
+    for message, ack_id in messages:
+        previous, ack_ids = coalesced.pop(message.product_id, (None, []))
+        ack_ids.append(ack_id)
+        coalesced[message.product_id] = (_coalesce_message(previous, message), ack_ids)
+
+    return list(coalesced.values())
+
+
+def split_bulk_messages(
+    messages: list[tuple[TriggerMessage, str]],
+) -> tuple[
+    list[BulkMessage],
+    list[BulkMessage],
+]:
+    res_upsert, res_delete = [], []
+
+    # Several writes of the same product collapse into its last one, so a product
+    # is read and written once per pull and a trailing delete wins over upserts
+    for msg, ack_ids in coalesce_bulk_messages(messages):
+        if msg.event_type == FN_EVENT_TYPE.DELETE:
+            res_delete.append((msg, ack_ids))
+        else:
+            res_upsert.append((msg, ack_ids))
+
+    if len(messages) > len(res_upsert) + len(res_delete):
+        _logger.info(
+            f"Coalesced {len(messages)} messages into {len(res_upsert) + len(res_delete)} products"
+        )
+
+    return res_upsert, res_delete
+
+
 def get_product_to_bulk_topic_messages(
-    subscriber: pubsub_v1.SubscriberClient, subscription_path: str, num_messages: int
+    ack_manager: AckManager, num_messages: int
 ) -> tuple[
-    list[tuple[TriggerMessage, str]],
-    list[tuple[TriggerMessage, str]],
+    list[BulkMessage],
+    list[BulkMessage],
 ]:
     res_upsert, res_delete = [], []
+    subscriber = ack_manager.subscriber
+    subscription_path = ack_manager.subscription_path
 
     start_pulling_time = time.time()
     try:
@@ -149,12 +573,22 @@ def get_product_to_bulk_topic_messages(
             request={"subscription": subscription_path, "max_messages": num_messages},
             timeout=30,
         )
+        record_stage(
+            PIPELINE_STAGE.PULL,
+            time.time() - start_pulling_time,
+            len(response.received_messages),
+        )
+        record_batch_size("pull", len(response.received_messages))
     except DeadlineExceeded:
+        record_stage(PIPELINE_STAGE.PULL, time.time() - start_pulling_time, 0)
+        reset_sync_staleness()
         _logger.info(
             f"No messages available. Took {time.time() - start_pulling_time} seconds."
         )
         return [], []
     except Exception as e:
+        record_stage(PIPELINE_STAGE.PULL, time.time() - start_pulling_time, 0, errors=1)
+        invalidate_provisioned_path_on_not_found(subscription_path, e)
         _logger.error(
             f"Error pulling messages from subscription: {e}. Took {time.time() - start_pulling_time} seconds."
         )
@@ -162,150 +596,544 @@ def get_product_to_bulk_topic_messages(
 
     if len(response.received_messages) == 0:
         _logger.info("No messages available.")
+        reset_sync_staleness()
         return res_upsert, res_delete
     else:
         _logger.info(
             f"Pulled {len(response.received_messages)} / {num_messages} messages from subscription: {subscription_path}"
         )
 
-    for received_message in response.received_messages:
+    # Keep the leases alive until every message is acked or nacked
+    ack_manager.track(
+        [received_message.ack_id for received_message in response.received_messages]
+    )
+
+    start_decoding_time = time.monotonic()
+    messages, poison_ack_ids = decode_bulk_messages(
+        [
+            (received_message.message, received_message.ack_id)
+            for received_message in response.received_messages
+        ],
+        datetime.now(timezone.utc),
+    )
+    record_stage(
+        PIPELINE_STAGE.DECODE,
+        time.monotonic() - start_decoding_time,
+        len(response.received_messages),
+        errors=len(poison_ack_ids),
+    )
+
+    # Sent together with the next batch of acks
+    ack_manager.ack(poison_ack_ids)
+
+    return split_bulk_messages(messages)
+
+
+def get_ack_ids_by_product_id(messages: list[BulkMessage]) -> dict[str, list[str]]:
+    return {message.product_id: ack_ids for message, ack_ids in messages}
+
+
+def get_done_ack_ids(
+    done_product_ids: list[str], ack_ids_by_product_id: dict[str, list[str]]
+) -> list[str]:
+    return [
+        ack_id
+        for product_id in done_product_ids
+        for ack_id in ack_ids_by_product_id.get(product_id, [])
+    ]
+
+
+def get_products_to_read(
+    upsert_messages: list[BulkMessage],
+) -> tuple[dict[str, dict], dict[str, datetime | None]]:
+    """
+    Split upsert messages into the documents they carry and the products to read.
+
+    Returns:
+        (other_product_model documents from message snapshots, the oldest
+        acceptable cached version of every product that has to be read)
+    """
+
+    another_model_products: dict[str, dict] = {
+        message.product_id: message.snapshot
+        for message, _ in upsert_messages
+        if message.snapshot is not None
+    }
+    # A cached product is only used when it is at least as new as the message,
+    # which carries the newest update_time of the coalesced ones
+    min_update_times = {
+        message.product_id: message.update_time
+        for message, _ in upsert_messages
+        if message.product_id not in another_model_products
+    }
+
+    return another_model_products, min_update_times
+
+
+def record_read_products(missing_ids: list[str], invalid_ids: list[str]) -> list[str]:
+    """
+    Returns:
+        The product ids that are done without a write, retrying won't fix them
+    """
+
+    invalidate_cached_products(missing_ids)
+    for product_id in missing_ids:
+        _logger.error(
+            f"Error getting product from firestore {product_id}: "
+            + PRODUCT_404 % (product_id, FIRESTORE_PRODUCTS_COLLECTION_NAME)
+        )
+
+    # An invalid document is done like a transform error
+    return missing_ids + invalid_ids
+
+
+def get_product_writes(
+    fs_products: dict[str, FirestoreProduct], another_model_products: dict[str, dict]
+) -> tuple[dict[str, dict], list[str]]:
+    """
+    Transform the read products and skip the documents that are already up to date.
+
+    Returns:
+        (other_product_model documents to write, product ids that are done without
+        a write because they can't be transformed or are unchanged)
+    """
+
+    done_product_ids: list[str] = []
+
+    # Create other_product_model product for each product
+    start_transforming_time = time.monotonic()
+    transformed_products, transform_errors = get_another_models_from_products(
+        fs_products
+    )
+    record_stage(
+        PIPELINE_STAGE.TRANSFORM,
+        time.monotonic() - start_transforming_time,
+        len(fs_products),
+        errors=len(transform_errors),
+    )
+    another_model_products = {**another_model_products, **transformed_products}
+    for product_id, e in transform_errors.items():
+        _logger.error(f"Error transforming product {product_id}: {e}")
+        done_product_ids.append(product_id)
+
+    # Skip the products that are already up to date in other_product_model
+    if len(another_model_products) > 0 and is_content_hash_enabled():
+        another_model_products, elided_ids = elide_unchanged_writes(
+            another_model_products, OTHER_PRODUCT_MODEL_COLLECTION_NAME
+        )
+        done_product_ids.extend(elided_ids)
+        if elided_ids:
+            _logger.info(
+                f"Elided {len(elided_ids)} unchanged writes to the other collection. stats={get_content_hash_stats()}"
+            )
+
+    return another_model_products, done_product_ids
+
+
+def record_upserted_products(
+    another_model_products: dict[str, dict],
+    write_result: BatchWriteResult,
+    duration_sec: float,
+) -> list[str]:
+    """
+    Returns:
+        The product ids that were written
+    """
+
+    record_stage(
+        PIPELINE_STAGE.WRITE,
+        duration_sec,
+        len(another_model_products),
+        errors=len(write_result.errors),
+    )
+    record_batch_size("write", len(another_model_products))
+    record_written_documents(
+        another_model_products,
+        write_result.succeeded_ids,
+        OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+    )
+    _logger.info(
+        f"Upserted {len(write_result.succeeded_ids)} / {len(another_model_products)} products to the other collection"
+    )
+
+    return write_result.succeeded_ids
+
+
+def get_products_to_delete(delete_messages: list[BulkMessage]) -> dict[str, list[str]]:
+    """
+    Returns:
+        The ack_ids of the messages by product id to delete
+    """
+
+    ack_ids_by_product_id = get_ack_ids_by_product_id(delete_messages)
+
+    # Forget the cached state first, a failed delete must not leave a stale one behind
+    invalidate_cached_products(list(ack_ids_by_product_id.keys()))
+    invalidate_content_hashes(
+        list(ack_ids_by_product_id.keys()), OTHER_PRODUCT_MODEL_COLLECTION_NAME
+    )
+
+    return ack_ids_by_product_id
+
+
+def record_deleted_products(
+    ack_ids_by_product_id: dict[str, list[str]],
+    delete_result: BatchWriteResult,
+    duration_sec: float,
+) -> list[str]:
+    """
+    Returns:
+        The ack_ids of the messages whose document is deleted
+    """
+
+    record_stage(
+        PIPELINE_STAGE.DELETE,
+        duration_sec,
+        len(ack_ids_by_product_id),
+        errors=len(delete_result.errors),
+    )
+    if delete_result.errors:
+        _logger.error(
+            f"Error deleting documents {list(delete_result.errors.keys())} from other_product_model"
+        )
+
+    return get_done_ack_ids(delete_result.succeeded_ids, ack_ids_by_product_id)
+
+
+def upsert_other_product_models(
+    upsert_messages: list[BulkMessage],
+) -> list[str]:
+    """
+    Read, transform and write the products of upsert messages in bulk.
+
+    Messages that carry a snapshot are written as they are, only the rest is read.
+
+    Returns:
+        The ack_ids of the messages that are done: written, or not worth retrying
+        because the product no longer exists or can't be transformed.
+    """
+
+    ack_ids_by_product_id = get_ack_ids_by_product_id(upsert_messages)
+    another_model_products, min_update_times = get_products_to_read(upsert_messages)
+
+    # Get the products from firestore for the whole pull at once
+    product_ids = list(min_update_times)
+    fs_products: dict[str, FirestoreProduct] = {}
+    done_product_ids: list[str] = []
+    if len(product_ids) > 0:
         try:
-            msg_data = json.loads(received_message.message.data.decode("utf-8"))
-            msg = TriggerMessage(**msg_data.get("data", {}))
-            if msg.event_type == FN_EVENT_TYPE.DELETE:
-                res_delete.append((msg, received_message.ack_id))
-            else:
-                res_upsert.append((msg, received_message.ack_id))
+            with _bulk_read_semaphore, timed_stage(
+                PIPELINE_STAGE.READ, len(product_ids)
+            ):
+                fs_products, missing_ids, invalid_ids = get_products_by_ids(
+                    product_ids, min_update_times=min_update_times
+                )
+            done_product_ids.extend(record_read_products(missing_ids, invalid_ids))
         except Exception as e:
-            _logger.error(
-                f"Error parsing event in products_sync_bulk_handler: {e}. Message: {received_message.message.data.decode('utf-8')}"
+            _logger.error(f"Error getting products from firestore {product_ids}: {e}")
+
+    another_model_products, skipped_ids = get_product_writes(
+        fs_products, another_model_products
+    )
+    done_product_ids.extend(skipped_ids)
+
+    # Upsert the products to other_product_model
+    if len(another_model_products) > 0:
+        with _bulk_write_semaphore:
+            start_writing_time = time.monotonic()
+            write_result = upsert_products_by_ids(
+                another_model_products,
+                OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+                rate_limiter=_other_product_model_write_limiter,
             )
-            subscriber.acknowledge(
-                request={
-                    "subscription": subscription_path,
-                    "ack_ids": [received_message.ack_id],
-                }
+        done_product_ids.extend(
+            record_upserted_products(
+                another_model_products,
+                write_result,
+                time.monotonic() - start_writing_time,
             )
+        )
 
-    return res_upsert, res_delete
+    return get_done_ack_ids(done_product_ids, ack_ids_by_product_id)
 
 
-def products_sync_bulk_handler(event: Event[DocumentSnapshot]) -> None:
-    subscriber = get_pubsub_subscriber_client()
-    subscription_path = get_or_create_subscription(
-        BULK_TOPIC_NAME, True, 120
-    )
+def delete_other_product_models(
+    delete_messages: list[BulkMessage],
+) -> list[str]:
+    """
+    Delete the products of delete messages in bulk.
 
-    # Number of messages to pull in one request
-    NUM_MESSAGES = 40
+    Returns:
+        The ack_ids of the messages whose document is deleted
+    """
 
-    start_time = time.time()
+    ack_ids_by_product_id = get_products_to_delete(delete_messages)
 
-    upsert_messages, delete_messages = get_product_to_bulk_topic_messages(
-        subscriber, subscription_path, NUM_MESSAGES
+    # Failed batches fall back to one by one deletes inside delete_products_by_ids,
+    # only for the chunk that failed
+    with _bulk_write_semaphore:
+        start_deleting_time = time.monotonic()
+        delete_result = delete_products_by_ids(
+            list(ack_ids_by_product_id.keys()),
+            OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+            rate_limiter=_other_product_model_write_limiter,
+        )
+
+    return record_deleted_products(
+        ack_ids_by_product_id, delete_result, time.monotonic() - start_deleting_time
     )
-    
+
+
+def sync_bulk_messages(
+    upsert_messages: list[BulkMessage],
+    delete_messages: list[BulkMessage],
+) -> list[str]:
+    """
+    Sync coalesced bulk messages to other_product_model.
+
+    Shared by the pull based handler and the StreamingPull worker, which only
+    differ in how they acknowledge.
+
+    Returns:
+        The ack_ids of the messages that are done
+    """
+
+    ack_ids: list[str] = []
+    record_batch_size("upsert", len(upsert_messages))
+    record_batch_size("delete", len(delete_messages))
+
     # Upsert products
     if len(upsert_messages) > 0:
-        # Get the products from firestore for each message
-        fs_products: list[tuple[FirestoreProduct, bool, bool]] = []
-        for message in upsert_messages:
-            try:
-                fs_products.append(
-                    get_product_by_id(message[0].product_id)
-                )
-            except Exception as e:
-                _logger.error(
-                    f"Error getting product from firestore {message[0].product_id}: {e}"
-                )
-                continue
-
-        # Create other_product_model product for each product
-        another_model_products: list[FirestoreProduct, dict] = []
-        for product in fs_products:
-            try:
-                another_model_products.append(
-                    (
-                        product,
-                        get_another_model_from_product(product)
-                    )
-                )
-            except Exception as e:
-                continue
-
-        # Upsert the products to other_product_model
-        if len(another_model_products) > 0:
-            # Adding it to firestore one by one to make the test simpler
-            for product, another_model_product in another_model_products:
-                upsert_product_by_id(
-                    another_model_product["id"],
-                    another_model_product,
-                    "other_product_model"
-                )
-            _logger.info(f"Upserted {len(another_model_products)} products to the other collection")
-
-        # Ack the messages
-        subscriber.acknowledge(
-            request={
-                "subscription": subscription_path,
-                "ack_ids": [message[1] for message in upsert_messages],
-            }
+        upsert_ack_ids = upsert_other_product_models(upsert_messages)
+        ack_ids.extend(upsert_ack_ids)
+        _logger.info(
+            f"Synced {len(upsert_ack_ids)} messages for {len(upsert_messages)} products to the other collection"
         )
 
-        _logger.info(f"Acknowledged {len(upsert_messages)} products to the other collection")
-
     # Delete products
     if len(delete_messages) > 0:
-        document_ids = [message[0].product_id for message in delete_messages]
+        delete_ack_ids = delete_other_product_models(delete_messages)
+        ack_ids.extend(delete_ack_ids)
+        _logger.info(
+            f"Deleted {len(delete_ack_ids)} messages for {len(delete_messages)} products from other_product_model"
+        )
+
+    return ack_ids
+
+
+def shard_bulk_messages(
+    messages: list[BulkMessage], num_shards: int
+) -> list[list[BulkMessage]]:
+    """
+    Split messages by product_id, the ordering key they were published with, so
+    all messages of a product always land in the same shard.
+    """
+
+    shards: list[list[BulkMessage]] = [[] for _ in range(num_shards)]
+    for message in messages:
+        # crc32 rather than hash(), which is salted per process
+        shard = zlib.crc32(message[0].product_id.encode("utf-8")) % num_shards
+        shards[shard].append(message)
+    return shards
+
+
+def _sync_bulk_shard(
+    upsert_messages: list[BulkMessage],
+    delete_messages: list[BulkMessage],
+    on_synced: Callable[[list[str], list[str]], None],
+) -> float | None:
+    """
+    Runs the shard's sub-batches one after the other, on_synced gets the
+    (done, failed) ack_ids of each one as soon as it is synced.
+
+    Returns:
+        The worst write -> commit lag of the shard
+    """
+
+    worst_lag_sec: float | None = None
+    sub_batch_size = get_bulk_ack_sub_batch_size()
+    for i in range(0, max(len(upsert_messages), len(delete_messages)), sub_batch_size):
+        upsert_chunk = upsert_messages[i : i + sub_batch_size]
+        delete_chunk = delete_messages[i : i + sub_batch_size]
+        chunk_ack_ids = [
+            ack_id
+            for _, message_ack_ids in upsert_chunk + delete_chunk
+            for ack_id in message_ack_ids
+        ]
+
         try:
-            # Deleting it from firestore to make the test simpler
-            for document_id in document_ids:
-                delete_product_by_id(
-                    document_id,
-                    "other_product_model"
-                )
-            _logger.info(
-                f"Deleting {len(delete_messages)} products from other_product_model"
-            )
+            done_ack_ids = set(sync_bulk_messages(upsert_chunk, delete_chunk))
         except Exception as e:
-            # We are trying to delete one by one because the bulk delete has failed
-            # This is a workaround to avoid the function to fail and not delete the other products
-            # This fallback should not ever happen in production, but it's a good fallback to avoid the function to fail and not delete the other products
-            # Also, sometimes when developing locally this might happen so this makes sure that the function does not fail and deletes the products it can
-            _logger.error(
-                f"Error deleting documents {document_ids}: {e}. Trying one by one."
+            _logger.error(f"Error syncing bulk sub-batch: {e}")
+            done_ack_ids = set()
+        lag_sec = record_synced_lag(upsert_chunk + delete_chunk, done_ack_ids)
+        if lag_sec is not None:
+            worst_lag_sec = max(lag_sec, worst_lag_sec or 0.0)
+
+        on_synced(
+            [ack_id for ack_id in chunk_ack_ids if ack_id in done_ack_ids],
+            [ack_id for ack_id in chunk_ack_ids if ack_id not in done_ack_ids],
+        )
+
+    return worst_lag_sec
+
+
+def sync_bulk_messages_in_shards(
+    upsert_messages: list[BulkMessage],
+    delete_messages: list[BulkMessage],
+    on_synced: Callable[[list[str], list[str]], None],
+) -> None:
+    """
+    Sync coalesced bulk messages on the shard pool, different products in parallel.
+
+    Args:
+        on_synced: Called from the shard threads with the (done, failed) ack_ids
+            of every synced sub-batch
+    """
+
+    num_shards = get_bulk_shards()
+    upsert_shards = shard_bulk_messages(upsert_messages, num_shards)
+    delete_shards = shard_bulk_messages(delete_messages, num_shards)
+
+    executor = get_bulk_shard_executor()
+    futures = [
+        executor.submit(_sync_bulk_shard, upsert_shard, delete_shard, on_synced)
+        for upsert_shard, delete_shard in zip(upsert_shards, delete_shards)
+        if upsert_shard or delete_shard
+    ]
+    set_sync_staleness(
+        [future.result() for future in concurrent.futures.as_completed(futures)]
+    )
+
+
+def count_bulk_messages(
+    upsert_messages: list[BulkMessage], delete_messages: list[BulkMessage]
+) -> int:
+    return sum(
+        len(message_ack_ids) for _, message_ack_ids in upsert_messages + delete_messages
+    )
+
+
+def sync_pulled_bulk_batch(
+    ack_manager: AckManager,
+    upsert_messages: list[BulkMessage],
+    delete_messages: list[BulkMessage],
+) -> None:
+    """
+    Sync a pulled batch to other_product_model.
+
+    Sub-batches are acked as soon as they commit, failed messages are nacked right
+    away so they are redelivered sooner.
+    """
+
+    def on_synced(done_ack_ids: list[str], failed_ack_ids: list[str]) -> None:
+        ack_manager.ack(done_ack_ids)
+        ack_manager.nack(failed_ack_ids)
+        ack_manager.flush()
+
+    sync_bulk_messages_in_shards(upsert_messages, delete_messages, on_synced)
+
+
+def sync_bulk_batch(ack_manager: AckManager, num_messages: int) -> int:
+    """
+    Pull one batch from the bulk subscription and sync it to other_product_model.
+
+    Returns:
+        The number of messages that were pulled
+    """
+
+    upsert_messages, delete_messages = get_product_to_bulk_topic_messages(
+        ack_manager, num_messages
+    )
+    sync_pulled_bulk_batch(ack_manager, upsert_messages, delete_messages)
+
+    return count_bulk_messages(upsert_messages, delete_messages)
+
+
+def products_sync_bulk_handler(event: Event[DocumentSnapshot]) -> None:
+    subscriber = get_pubsub_subscriber_client()
+    subscription_path = get_or_create_subscription(
+        BULK_TOPIC_NAME, True, BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS
+    )
+
+    start_time = time.time()
+    deadline = start_time + get_bulk_drain_time_budget()
+    drain_enabled = is_bulk_drain_enabled()
+
+    ack_manager = AckManager(
+        subscriber,
+        subscription_path,
+        BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS,
+        nack_delay_seconds=get_bulk_nack_delay(),
+    )
+
+    # Keep pulling until the subscription is empty or the time budget runs out,
+    # instead of returning after the first batch. The next batch is pulled while
+    # the current one syncs; its leases are extended by the ack manager meanwhile.
+    # Batches are still synced one after the other, so a product's messages are
+    # never synced out of order.
+    num_batches, num_messages = 0, 0
+    batch_latency = 0.0
+    with ack_manager:
+        batch_start_time = time.time()
+        batch = get_product_to_bulk_topic_messages(ack_manager, _bulk_batch_size.value)
+        while True:
+            pulled = count_bulk_messages(*batch)
+            if pulled == 0:
+                break
+
+            # Leave room for one more batch as slow as the last one
+            prefetch = drain_enabled and time.time() + 2 * batch_latency <= deadline
+            next_batch_future = (
+                get_bulk_prefetch_executor().submit(
+                    get_product_to_bulk_topic_messages,
+                    ack_manager,
+                    _bulk_batch_size.value,
+                )
+                if prefetch
+                else None
             )
 
-            for document_id in document_ids:
-                try:
+            sync_pulled_bulk_batch(ack_manager, *batch)
+            batch_latency = time.time() - batch_start_time
+
+            num_batches += 1
+            num_messages += pulled
+            _bulk_batch_size.record(pulled, batch_latency)
+
+            if next_batch_future is None:
+                if drain_enabled:
                     _logger.info(
-                        f"Deleting document {document_id} in bulk fallback one by one"
-                    )
-                    
-                    # Deleting it from firestore to make the test simpler
-                    delete_product_by_id(
-                        document_id,
-                        "other_product_model"
-                    )
-                except Exception as e:
-                    _logger.error(
-                        f"Error deleting document {document_id} in one by one fallback after bulk delete failed: {e}"
+                        f"Drain time budget exhausted after {num_batches} batches, the next trigger continues"
                     )
+                break
 
-        subscriber.acknowledge(
-            request={
-                "subscription": subscription_path,
-                "ack_ids": [message[1] for message in delete_messages],
-            }
-        )
+            batch_start_time = time.time()
+            batch = next_batch_future.result()
 
-        _logger.info(
-            f"Deleted and acknowledged {len(delete_messages)} products from other_product_model"
-        )
+    record_bulk_handler_run(
+        "Products to other_product_model bulk handler",
+        time.time() - start_time,
+        num_batches,
+        num_messages,
+    )
+
+
+def record_bulk_handler_run(
+    description: str, elapsed_sec: float, num_batches: int, num_messages: int
+) -> None:
+    """Log the summary of a bulk handler run and its metrics."""
 
-    end_time = time.time()
     _logger.info(
-        f"Products to other_product_model bulk handler took {end_time - start_time} seconds"
+        f"{description} took {elapsed_sec} seconds. "
+        f"batches={num_batches} messages={num_messages} next_batch_size={_bulk_batch_size.value} "
+        f"write_rate={_other_product_model_write_limiter.current_rate:.1f}/s"
     )
+    if is_product_read_cache_enabled():
+        _logger.info(f"Product read cache stats={get_product_read_cache_stats()}")
 
- 
\ No newline at end of file
+    if num_messages > 0:
+        set_gauge("bulk_messages_per_sec", num_messages / elapsed_sec)
+        set_gauge("bulk_batch_size_next", _bulk_batch_size.value)
+        set_gauge("write_rate_limit_ops_per_sec", _other_product_model_write_limiter.current_rate)
+    log_metrics("Products sync bulk metrics")
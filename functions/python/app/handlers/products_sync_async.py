@@ -0,0 +1,419 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from firebase_functions.firestore_fn import (
+    Event,
+    DocumentSnapshot,
+)
+from google.api_core.exceptions import DeadlineExceeded
+from app.handlers.products_sync import (
+    BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS,
+    BULK_TOPIC_NAME,
+    BulkMessage,
+    get_ack_ids_by_product_id,
+    get_bulk_ack_concurrency,
+    get_bulk_ack_sub_batch_size,
+    get_bulk_batch_size,
+    get_bulk_drain_time_budget,
+    get_bulk_message_from_event,
+    get_bulk_nack_delay,
+    get_bulk_read_concurrency,
+    get_bulk_write_concurrency,
+    get_done_ack_ids,
+    get_other_product_model_write_limiter,
+    get_product_writes,
+    get_products_to_delete,
+    get_products_to_read,
+    get_publish_deadline,
+    is_bulk_drain_enabled,
+    is_trigger_fire_and_forget,
+    record_bulk_handler_run,
+    record_deleted_products,
+    record_read_products,
+    record_upserted_products,
+    split_bulk_messages,
+    trigger_bulk_sync,
+)
+from app.models.product import (
+    FirestoreProduct,
+    OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+)
+from app.metrics import (
+    PIPELINE_STAGE,
+    maybe_log_metrics,
+    record_batch_size,
+    record_stage,
+    timed_stage,
+)
+from app.services.event_loop import run_coroutine
+from app.services.product.bulk_messages import (
+    decode_bulk_messages,
+    encode_bulk_message,
+)
+from app.services.product.firestore_async import (
+    delete_products_by_ids_async,
+    get_products_by_ids_async,
+    upsert_products_by_ids_async,
+)
+from app.services.product.sync_lag import (
+    record_synced_lag,
+    reset_sync_staleness,
+    set_sync_staleness,
+)
+from app.services.pubsub import (
+    get_or_create_subscription,
+    get_or_create_topic,
+    get_pubsub_publisher_client,
+)
+from app.services.pubsub_async import (
+    AsyncAckManager,
+    pull_messages_async,
+    publish_message_async,
+)
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+############################### ASYNC HANDLERS ####################################
+###################################################################################
+# asyncio variants of the products_sync handlers on the async Firestore and Pub/Sub
+# clients. They share message building, coalescing, transforms, the bookkeeping
+# around reads and writes and the write budget with app.handlers.products_sync,
+# only the I/O differs: reads, writes and acks of a batch all run concurrently,
+# bounded by BULK_READ_CONCURRENCY, BULK_WRITE_CONCURRENCY and BULK_ACK_CONCURRENCY.
+#
+# main.py switches to them with PRODUCTS_SYNC_ASYNC=true through the sync wrappers
+# at the bottom, which run the coroutines on the instance's background event loop.
+###################################################################################
+
+
+def is_products_sync_async_enabled() -> bool:
+    return os.environ.get("PRODUCTS_SYNC_ASYNC") == "true"
+
+
+async def products_sync_handler_async(event: Event[DocumentSnapshot]) -> None:
+    message_payload = get_bulk_message_from_event(event)
+    if message_payload is None:
+        return
+
+    # Provisioning is cached after the first call, the admin RPCs stay in a thread
+    bulk_topic_path = await asyncio.to_thread(
+        get_or_create_topic, get_pubsub_publisher_client(True), BULK_TOPIC_NAME
+    )
+
+    data, attributes = encode_bulk_message(message_payload)
+    publishes = [
+        publish_message_async(
+            bulk_topic_path,
+            data,
+            attributes,
+            ordering_key=message_payload.product_id,
+        )
+    ]
+
+    # The debounced trigger keeps using the batching sync publisher, it is shared
+    # with the sync handler and flushed on shutdown
+    try:
+        trigger_future = await asyncio.to_thread(trigger_bulk_sync)
+    except Exception as e:
+        _logger.error(f"Error publishing to trigger topic: {str(e)} event.id={event.id}")
+    else:
+        if trigger_future is None:
+            _logger.info(f"Debounced trigger message event.id={event.id}")
+        elif not is_trigger_fire_and_forget():
+            publishes.append(asyncio.wrap_future(trigger_future))
+
+    start_publishing_time = time.monotonic()
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*publishes, return_exceptions=True),
+            timeout=get_publish_deadline(),
+        )
+    except asyncio.TimeoutError:
+        _logger.error(
+            f"Timed out waiting for {len(publishes)} publishes event.id={event.id}"
+        )
+        return
+
+    failed = [result for result in results if isinstance(result, Exception)]
+    record_stage(
+        PIPELINE_STAGE.PUBLISH,
+        time.monotonic() - start_publishing_time,
+        len(publishes),
+        errors=len(failed),
+    )
+    for result in failed:
+        _logger.error(f"Error publishing product sync messages: {result} event.id={event.id}")
+
+    maybe_log_metrics()
+
+
+async def upsert_other_product_models_async(
+    upsert_messages: list[BulkMessage],
+    read_semaphore: asyncio.Semaphore,
+    write_semaphore: asyncio.Semaphore,
+) -> list[str]:
+    """
+    See upsert_other_product_models.
+
+    Returns:
+        The ack_ids of the messages that are done
+    """
+
+    ack_ids_by_product_id = get_ack_ids_by_product_id(upsert_messages)
+    another_model_products, min_update_times = get_products_to_read(upsert_messages)
+
+    product_ids = list(min_update_times)
+    fs_products: dict[str, FirestoreProduct] = {}
+    done_product_ids: list[str] = []
+    if len(product_ids) > 0:
+        try:
+            with timed_stage(PIPELINE_STAGE.READ, len(product_ids)):
+                fs_products, missing_ids, invalid_ids = await get_products_by_ids_async(
+                    product_ids,
+                    min_update_times=min_update_times,
+                    semaphore=read_semaphore,
+                )
+            done_product_ids.extend(record_read_products(missing_ids, invalid_ids))
+        except Exception as e:
+            _logger.error(f"Error getting products from firestore {product_ids}: {e}")
+
+    another_model_products, skipped_ids = get_product_writes(
+        fs_products, another_model_products
+    )
+    done_product_ids.extend(skipped_ids)
+
+    if len(another_model_products) > 0:
+        start_writing_time = time.monotonic()
+        write_result = await upsert_products_by_ids_async(
+            another_model_products,
+            OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+            rate_limiter=get_other_product_model_write_limiter(),
+            semaphore=write_semaphore,
+        )
+        done_product_ids.extend(
+            record_upserted_products(
+                another_model_products,
+                write_result,
+                time.monotonic() - start_writing_time,
+            )
+        )
+
+    return get_done_ack_ids(done_product_ids, ack_ids_by_product_id)
+
+
+async def delete_other_product_models_async(
+    delete_messages: list[BulkMessage],
+    write_semaphore: asyncio.Semaphore,
+) -> list[str]:
+    """
+    See delete_other_product_models.
+
+    Returns:
+        The ack_ids of the messages whose document is deleted
+    """
+
+    ack_ids_by_product_id = get_products_to_delete(delete_messages)
+
+    start_deleting_time = time.monotonic()
+    delete_result = await delete_products_by_ids_async(
+        list(ack_ids_by_product_id.keys()),
+        OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+        rate_limiter=get_other_product_model_write_limiter(),
+        semaphore=write_semaphore,
+    )
+
+    return record_deleted_products(
+        ack_ids_by_product_id, delete_result, time.monotonic() - start_deleting_time
+    )
+
+
+async def _sync_sub_batch_async(
+    ack_manager: AsyncAckManager,
+    upsert_messages: list[BulkMessage],
+    delete_messages: list[BulkMessage],
+    read_semaphore: asyncio.Semaphore,
+    write_semaphore: asyncio.Semaphore,
+) -> float | None:
+    """
+    Returns:
+        The worst write -> commit lag of the sub-batch
+    """
+
+    chunk_ack_ids = [
+        ack_id
+        for _, message_ack_ids in upsert_messages + delete_messages
+        for ack_id in message_ack_ids
+    ]
+
+    done_ack_ids: set[str] = set()
+    results = await asyncio.gather(
+        upsert_other_product_models_async(
+            upsert_messages, read_semaphore, write_semaphore
+        ),
+        delete_other_product_models_async(delete_messages, write_semaphore),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            _logger.error(f"Error syncing bulk sub-batch: {result}")
+        else:
+            done_ack_ids.update(result)
+    lag_sec = record_synced_lag(upsert_messages + delete_messages, done_ack_ids)
+
+    ack_manager.ack([ack_id for ack_id in chunk_ack_ids if ack_id in done_ack_ids])
+    ack_manager.nack([ack_id for ack_id in chunk_ack_ids if ack_id not in done_ack_ids])
+    await ack_manager.flush()
+
+    return lag_sec
+
+
+async def pull_bulk_batch_async(
+    ack_manager: AsyncAckManager, num_messages: int
+) -> tuple[list[BulkMessage], list[BulkMessage], int]:
+    """
+    Returns:
+        (upsert messages, delete messages, number of messages pulled)
+    """
+
+    try:
+        with timed_stage(PIPELINE_STAGE.PULL):
+            try:
+                received_messages = await pull_messages_async(
+                    ack_manager.subscription_path, num_messages
+                )
+            except DeadlineExceeded:
+                # What a pull on an empty subscription raises, see
+                # get_product_to_bulk_topic_messages
+                received_messages = []
+    except Exception as e:
+        _logger.error(f"Error pulling messages from subscription: {e}")
+        return [], [], 0
+    record_batch_size("pull", len(received_messages))
+
+    if not received_messages:
+        _logger.info("No messages available.")
+        reset_sync_staleness()
+        return [], [], 0
+
+    ack_manager.track([received.ack_id for received in received_messages])
+    start_decoding_time = time.monotonic()
+    messages, poison_ack_ids = decode_bulk_messages(
+        [(received.message, received.ack_id) for received in received_messages],
+        datetime.now(timezone.utc),
+    )
+    record_stage(
+        PIPELINE_STAGE.DECODE,
+        time.monotonic() - start_decoding_time,
+        len(received_messages),
+        errors=len(poison_ack_ids),
+    )
+    ack_manager.ack(poison_ack_ids)
+
+    return *split_bulk_messages(messages), len(received_messages)
+
+
+async def sync_pulled_bulk_batch_async(
+    ack_manager: AsyncAckManager,
+    upsert_messages: list[BulkMessage],
+    delete_messages: list[BulkMessage],
+    read_semaphore: asyncio.Semaphore,
+    write_semaphore: asyncio.Semaphore,
+) -> None:
+    # Messages are coalesced per product, so sub-batches never share a product
+    # and can all run at once
+    sub_batch_size = get_bulk_ack_sub_batch_size()
+    lags_sec = await asyncio.gather(
+        *[
+            _sync_sub_batch_async(
+                ack_manager,
+                upsert_messages[i : i + sub_batch_size],
+                delete_messages[i : i + sub_batch_size],
+                read_semaphore,
+                write_semaphore,
+            )
+            for i in range(
+                0, max(len(upsert_messages), len(delete_messages)), sub_batch_size
+            )
+        ]
+    )
+    set_sync_staleness(lags_sec)
+
+
+async def products_sync_bulk_handler_async(event: Event[DocumentSnapshot]) -> None:
+    subscription_path = await asyncio.to_thread(
+        get_or_create_subscription,
+        BULK_TOPIC_NAME,
+        True,
+        BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS,
+    )
+
+    start_time = time.time()
+    deadline = start_time + get_bulk_drain_time_budget()
+    drain_enabled = is_bulk_drain_enabled()
+    read_semaphore = asyncio.Semaphore(get_bulk_read_concurrency())
+    write_semaphore = asyncio.Semaphore(get_bulk_write_concurrency())
+
+    bulk_batch_size = get_bulk_batch_size()
+    num_batches, num_messages = 0, 0
+    batch_latency = 0.0
+    async with AsyncAckManager(
+        subscription_path,
+        BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS,
+        nack_delay_seconds=get_bulk_nack_delay(),
+        max_concurrency=get_bulk_ack_concurrency(),
+    ) as ack_manager:
+        batch_start_time = time.time()
+        upsert_messages, delete_messages, pulled = await pull_bulk_batch_async(
+            ack_manager, bulk_batch_size.value
+        )
+        while pulled > 0:
+            # Pull the next batch while this one syncs, see products_sync_bulk_handler
+            next_batch = (
+                asyncio.create_task(
+                    pull_bulk_batch_async(ack_manager, bulk_batch_size.value)
+                )
+                if drain_enabled and time.time() + 2 * batch_latency <= deadline
+                else None
+            )
+
+            await sync_pulled_bulk_batch_async(
+                ack_manager,
+                upsert_messages,
+                delete_messages,
+                read_semaphore,
+                write_semaphore,
+            )
+            batch_latency = time.time() - batch_start_time
+
+            num_batches += 1
+            num_messages += pulled
+            bulk_batch_size.record(pulled, batch_latency)
+
+            if next_batch is None:
+                if drain_enabled:
+                    _logger.info(
+                        f"Drain time budget exhausted after {num_batches} batches, the next trigger continues"
+                    )
+                break
+
+            batch_start_time = time.time()
+            upsert_messages, delete_messages, pulled = await next_batch
+
+    record_bulk_handler_run(
+        "Async products to other_product_model bulk handler",
+        time.time() - start_time,
+        num_batches,
+        num_messages,
+    )
+
+
+def run_products_sync_handler_async(event: Event[DocumentSnapshot]) -> None:
+    run_coroutine(products_sync_handler_async(event))
+
+
+def run_products_sync_bulk_handler_async(event: Event[DocumentSnapshot]) -> None:
+    run_coroutine(products_sync_bulk_handler_async(event))
@@ -0,0 +1,230 @@
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from typing import Any, Iterator
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+################################# METRICS #########################################
+###################################################################################
+# In-process metrics for the sync pipeline: a duration histogram, item and error
+# counters per stage, batch size histograms and gauges. They live as long as the
+# instance, get_metrics_snapshot() returns them as a dict and log_metrics() writes
+# that dict into the log line as JSON, so it reaches the logs with the plain stdout
+# formatter as well, and as json_fields for the Cloud Logging handler, which
+# indexes it so it can be charted and alerted on with log based metrics.
+###################################################################################
+
+
+class PIPELINE_STAGE(str, Enum):
+    PUBLISH = "publish"
+    PULL = "pull"
+    DECODE = "decode"
+    READ = "read"
+    TRANSFORM = "transform"
+    WRITE = "write"
+    DELETE = "delete"
+    ACK = "ack"
+
+
+# Upper bounds of the buckets, values above the last one go to an overflow bucket
+LATENCY_BUCKETS_SEC = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600,
+)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+STAGE_DURATION_METRIC = "stage_duration_sec"
+STAGE_ITEMS_METRIC = "stage_items"
+STAGE_ERRORS_METRIC = "stage_errors"
+BATCH_SIZE_METRIC = "batch_size"
+
+
+class Histogram:
+    """Fixed bucket histogram, percentiles are estimated from the buckets."""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, pct: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # The bucket's upper bound, but never beyond what was observed
+                upper_bound = self.buckets[i] if i < len(self.buckets) else self.max
+                return max(self.min, min(upper_bound, self.max))
+        return self.max
+
+    def snapshot(self) -> dict[str, Any]:
+        if self.count == 0:
+            return {"count": 0}
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Exact nearest-rank percentile, for small per-batch samples."""
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+# name -> label -> value
+_histograms: dict[str, dict[str, Histogram]] = {}
+_counters: dict[str, dict[str, float]] = {}
+_gauges: dict[str, dict[str, float]] = {}
+_metrics_lock = threading.Lock()
+_metrics_started_at = time.monotonic()
+_metrics_logged_at = time.monotonic()
+
+
+def observe(
+    name: str,
+    value: float,
+    label: str = "",
+    buckets: tuple[float, ...] = LATENCY_BUCKETS_SEC,
+) -> None:
+    with _metrics_lock:
+        histogram = _histograms.setdefault(name, {}).get(label)
+        if histogram is None:
+            histogram = _histograms[name][label] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def increment(name: str, label: str = "", value: float = 1) -> None:
+    with _metrics_lock:
+        labels = _counters.setdefault(name, {})
+        labels[label] = labels.get(label, 0) + value
+
+
+def set_gauge(name: str, value: float, label: str = "") -> None:
+    with _metrics_lock:
+        _gauges.setdefault(name, {})[label] = value
+
+
+def record_stage(
+    stage: PIPELINE_STAGE, duration_sec: float, items: int = 1, errors: int = 0
+) -> None:
+    observe(STAGE_DURATION_METRIC, duration_sec, stage.value)
+    increment(STAGE_ITEMS_METRIC, stage.value, items)
+    if errors:
+        increment(STAGE_ERRORS_METRIC, stage.value, errors)
+
+
+def record_stage_errors(stage: PIPELINE_STAGE, errors: int = 1) -> None:
+    increment(STAGE_ERRORS_METRIC, stage.value, errors)
+
+
+def record_batch_size(name: str, size: int) -> None:
+    observe(BATCH_SIZE_METRIC, size, name, BATCH_SIZE_BUCKETS)
+
+
+@contextmanager
+def timed_stage(stage: PIPELINE_STAGE, items: int = 1) -> Iterator[None]:
+    """Record how long the block took, a raised exception counts as items errors."""
+
+    start_time = time.monotonic()
+    try:
+        yield
+    except Exception:
+        record_stage(stage, time.monotonic() - start_time, items, errors=items)
+        raise
+    record_stage(stage, time.monotonic() - start_time, items)
+
+
+def get_metrics_snapshot() -> dict[str, Any]:
+    with _metrics_lock:
+        histograms = {
+            name: {label: histogram.snapshot() for label, histogram in labels.items()}
+            for name, labels in _histograms.items()
+        }
+        counters = {name: dict(labels) for name, labels in _counters.items()}
+        gauges = {name: dict(labels) for name, labels in _gauges.items()}
+
+    # Per stage summary, items_per_sec is the stage's throughput while it runs
+    stages = {}
+    for stage, duration in histograms.get(STAGE_DURATION_METRIC, {}).items():
+        items = counters.get(STAGE_ITEMS_METRIC, {}).get(stage, 0)
+        stages[stage] = {
+            "calls": duration["count"],
+            "items": items,
+            "errors": counters.get(STAGE_ERRORS_METRIC, {}).get(stage, 0),
+            "p50_sec": duration.get("p50", 0.0),
+            "p95_sec": duration.get("p95", 0.0),
+            "max_sec": duration.get("max", 0.0),
+            "items_per_sec": items / duration["sum"] if duration.get("sum") else 0.0,
+        }
+
+    return {
+        "uptime_sec": time.monotonic() - _metrics_started_at,
+        "stages": stages,
+        "histograms": histograms,
+        "counters": counters,
+        "gauges": gauges,
+    }
+
+
+def reset_metrics() -> None:
+    with _metrics_lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+def get_metrics_log_interval() -> float:
+    return float(os.environ.get("METRICS_LOG_INTERVAL_SEC", "60"))
+
+
+def log_metrics(message: str = "Sync pipeline metrics") -> None:
+    global _metrics_logged_at
+
+    _metrics_logged_at = time.monotonic()
+    snapshot = get_metrics_snapshot()
+    # json_fields is dropped by the basicConfig formatter that setup_logging installs
+    # with disable_logging_client, so the snapshot goes into the message as well
+    _logger.info(
+        f"{message} metrics={json.dumps(snapshot, default=str)}",
+        extra={"json_fields": {"metrics": snapshot}},
+    )
+
+
+def maybe_log_metrics(message: str = "Sync pipeline metrics") -> None:
+    """log_metrics() at most once per METRICS_LOG_INTERVAL_SEC, for hot paths."""
+
+    if time.monotonic() - _metrics_logged_at >= get_metrics_log_interval():
+        log_metrics(message)
@@ -3,6 +3,8 @@ from pydantic import BaseModel
 
 
 FIRESTORE_PRODUCTS_COLLECTION_NAME = "products"
+# We are replacing the other_product_model with another firestore collection to make the setup simpler
+OTHER_PRODUCT_MODEL_COLLECTION_NAME = "other_product_model"
 
 
 class FirestoreProduct(BaseModel):
@@ -0,0 +1,45 @@
+import asyncio
+import atexit
+import logging
+import threading
+from typing import Any, Coroutine
+
+_logger = logging.getLogger(__name__)
+
+# One event loop per instance, running on a daemon thread. Sync entry points hand
+# their coroutines to it, so the async clients bound to it stay warm across
+# invocations instead of being rebuilt by asyncio.run() every time.
+_event_loop: asyncio.AbstractEventLoop | None = None
+_event_loop_lock = threading.Lock()
+
+
+def _stop_event_loop() -> None:
+    global _event_loop
+
+    with _event_loop_lock:
+        loop, _event_loop = _event_loop, None
+
+    if loop is not None:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global _event_loop
+
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="event-loop", daemon=True
+            ).start()
+            _event_loop = loop
+            atexit.register(_stop_event_loop)
+            _logger.info("Started background event loop")
+
+        return _event_loop
+
+
+def run_coroutine(coroutine: Coroutine[Any, Any, Any], timeout: float | None = None) -> Any:
+    """Run a coroutine on the background event loop and block until it returns."""
+
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result(timeout)
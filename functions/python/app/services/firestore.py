@@ -1,10 +1,40 @@
+import asyncio
 import logging
+import os
+import threading
+import time
+import weakref
 from enum import Enum
+from typing import Any
 
+import google.auth
 from firebase_functions import firestore_fn
+from google.api_core.client_options import ClientOptions
+from google.api_core.exceptions import Aborted, ResourceExhausted
+from google.cloud import firestore
+from google.cloud.firestore_v1.services.firestore import (
+    FirestoreAsyncClient,
+    FirestoreClient,
+)
+from google.cloud.firestore_v1.services.firestore.transports.grpc import (
+    FirestoreGrpcTransport,
+)
+from google.cloud.firestore_v1.services.firestore.transports.grpc_asyncio import (
+    FirestoreGrpcAsyncIOTransport,
+)
+
+from app.services.throttling import HeldLease
 
 logger = logging.getLogger(__name__)
 
+LEASES_COLLECTION_NAME = "_leases"
+
+# Process-wide clients, created lazily on first use. The async client is bound to
+# the event loop it was created on, so we keep one per loop.
+_firestore_client = None
+_firestore_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_firestore_clients_lock = threading.Lock()
+
 
 class FN_EVENT_TYPE(str, Enum):
     CREATE = "create"
@@ -30,3 +60,142 @@ def get_fn_event_type(
     raise ValueError("get_event_type Unknown event type")
 
 
+def get_firestore_channel_options() -> list[tuple[str, Any]]:
+    return [
+        (
+            "grpc.keepalive_time_ms",
+            int(os.environ.get("FIRESTORE_GRPC_KEEPALIVE_TIME_MS", "30000")),
+        ),
+        (
+            "grpc.keepalive_timeout_ms",
+            int(os.environ.get("FIRESTORE_GRPC_KEEPALIVE_TIMEOUT_MS", "10000")),
+        ),
+        (
+            "grpc.keepalive_permit_without_calls",
+            int(os.environ.get("FIRESTORE_GRPC_KEEPALIVE_PERMIT_WITHOUT_CALLS", "1")),
+        ),
+    ]
+
+
+def get_firestore_api_endpoint() -> str:
+    return os.environ.get("FIRESTORE_API_ENDPOINT", FirestoreClient.DEFAULT_ENDPOINT)
+
+
+def _use_gapic_client(client, gapic_client) -> bool:
+    # firestore.Client has no public way to pass channel arguments, it builds its
+    # GAPIC client lazily on first use. That one slot is filled in up front, the
+    # unit tests fail if a library upgrade removes it.
+    if not hasattr(client, "_firestore_api_internal"):
+        logger.warning(
+            "Firestore client has no _firestore_api_internal, using its default channel"
+        )
+        return False
+
+    client._firestore_api_internal = gapic_client
+    return True
+
+
+def _create_firestore_client(client_class, transport_class, api_class):
+    project = os.environ.get("GCLOUD_PROJECT")
+
+    # The library sets up an insecure channel to the emulator itself
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        return client_class(project=project)
+
+    credentials, _ = google.auth.default(scopes=client_class.SCOPE)
+    client_options = ClientOptions(api_endpoint=get_firestore_api_endpoint())
+    client = client_class(
+        project=project, credentials=credentials, client_options=client_options
+    )
+
+    channel = transport_class.create_channel(
+        client_options.api_endpoint,
+        credentials=credentials,
+        options=get_firestore_channel_options(),
+    )
+    _use_gapic_client(
+        client,
+        api_class(
+            transport=transport_class(host=client_options.api_endpoint, channel=channel),
+            client_options=client_options,
+        ),
+    )
+    return client
+
+
+def get_firestore_client() -> firestore.Client:
+    global _firestore_client
+
+    if _firestore_client is not None:
+        return _firestore_client
+
+    with _firestore_clients_lock:
+        if _firestore_client is None:
+            _firestore_client = _create_firestore_client(
+                firestore.Client, FirestoreGrpcTransport, FirestoreClient
+            )
+
+    return _firestore_client
+
+
+def set_firestore_client(client: Any | None) -> None:
+    """
+    Replace the process-wide client, e.g. with an in-memory stand-in for
+    benchmarks. None goes back to a real client on next use.
+    """
+
+    global _firestore_client
+
+    with _firestore_clients_lock:
+        _firestore_client = client
+
+
+def get_firestore_async_client() -> firestore.AsyncClient:
+    """Return the AsyncClient for the running event loop, creating it on first use."""
+
+    loop = asyncio.get_running_loop()
+
+    with _firestore_clients_lock:
+        client = _firestore_async_clients.get(loop)
+        if client is None:
+            client = _create_firestore_client(
+                firestore.AsyncClient,
+                FirestoreGrpcAsyncIOTransport,
+                FirestoreAsyncClient,
+            )
+            _firestore_async_clients[loop] = client
+
+    return client
+
+
+def is_firestore_throttling_error(error: Exception) -> bool:
+    # RESOURCE_EXHAUSTED is quota or hot-spotting, ABORTED is contention
+    return isinstance(error, (ResourceExhausted, Aborted))
+
+
+def try_acquire_lease(name: str, duration_sec: float) -> HeldLease | None:
+    """
+    Take a named lease shared by every instance, in a transaction.
+
+    Returns:
+        None when the lease was acquired, otherwise the current holder's lease
+    """
+
+    firestore_client = get_firestore_client()
+    lease_ref = firestore_client.collection(LEASES_COLLECTION_NAME).document(name)
+
+    @firestore.transactional
+    def acquire(transaction: firestore.Transaction) -> HeldLease | None:
+        lease = lease_ref.get(transaction=transaction).to_dict() or {}
+        expires_at = lease.get("expiresAt", 0)
+
+        now = time.time()
+        if expires_at > now:
+            # Leases written before acquiredAt was stored lasted duration_sec
+            acquired_at = lease.get("acquiredAt", expires_at - duration_sec)
+            return HeldLease(remaining_sec=expires_at - now, age_sec=now - acquired_at)
+
+        transaction.set(lease_ref, {"acquiredAt": now, "expiresAt": now + duration_sec})
+        return None
+
+    return acquire(firestore_client.transaction())
@@ -1,8 +1,13 @@
 # ruff: noqa: F401
 
 from .firestore import (
+    delete_products_by_ids,
     get_product_by_id,
+    get_products_by_ids,
+    upsert_products_by_ids,
 )
 from .transformers import (
     get_another_model_from_product,
+    get_another_models_from_products,
+    register_converter,
 )
@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+import zlib
+from datetime import datetime
+from typing import Any, Optional, Protocol
+
+from pydantic import BaseModel
+
+from app.services.firestore import FN_EVENT_TYPE
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+############################# BULK MESSAGE FORMAT #################################
+###################################################################################
+# v1: data = json.dumps({"data": {"product_id": ..., "event_type": ...}}), no
+#     attributes. "update_time" and "event_time" ride along in "data", consumers
+#     that predate them ignore unknown fields.
+# v2: data = b"", attributes = {"v": "2", "product_id": ..., "event_type": ...}
+#     plus "update_time" when the source document has one and "event_time", when
+#     the Firestore event happened, for lag tracking.
+#     In carry-state mode data is the transformed snapshot as JSON, zlib compressed
+#     ("enc": "zlib") when big, and left out above a size threshold so the message
+#     falls back to a reference that the consumer reads from Firestore.
+#
+# The decoder reads both, so v1 messages that are still in flight during a rollout
+# keep working. The producer writes BULK_MESSAGE_WIRE_VERSION, v1 by default
+# because consumers that only know v1 ack v2 messages as poison. Set it to 2 once
+# every consumer runs this decoder, carry-state mode needs v2.
+###################################################################################
+
+WIRE_VERSION_ATTRIBUTE = "v"
+WIRE_VERSION_1 = "1"
+WIRE_VERSION_2 = "2"
+ENCODING_ATTRIBUTE = "enc"
+ZLIB_ENCODING = "zlib"
+
+_EVENT_TYPES = {event_type.value: event_type for event_type in FN_EVENT_TYPE}
+
+
+class TriggerMessage(BaseModel):
+    product_id: str
+    event_type: FN_EVENT_TYPE
+    update_time: Optional[datetime] = None
+    event_time: Optional[datetime] = None
+    # other_product_model document, only set in carry-state mode
+    snapshot: Optional[dict[str, Any]] = None
+    # Set by the consumer when decoding, never encoded
+    publish_time: Optional[datetime] = None
+    received_time: Optional[datetime] = None
+    # Oldest source write of the messages coalesced into this one
+    oldest_write_time: Optional[datetime] = None
+
+
+class PubsubMessageLike(Protocol):
+    # Both pulled PubsubMessage protos and streamed Message objects have these
+    data: bytes
+    attributes: Any
+
+
+def get_bulk_message_wire_version() -> str:
+    return os.environ.get("BULK_MESSAGE_WIRE_VERSION", WIRE_VERSION_1)
+
+
+def is_carry_state_enabled() -> bool:
+    # Only v2 can carry the snapshot
+    return (
+        os.environ.get("BULK_MESSAGE_CARRY_STATE") == "true"
+        and get_bulk_message_wire_version() == WIRE_VERSION_2
+    )
+
+
+def get_snapshot_compress_min_bytes() -> int:
+    return int(os.environ.get("BULK_MESSAGE_COMPRESS_MIN_BYTES", "1024"))
+
+
+def get_snapshot_max_bytes() -> int:
+    # Bigger snapshots are sent as a reference only
+    return int(os.environ.get("BULK_MESSAGE_MAX_SNAPSHOT_BYTES", "65536"))
+
+
+def _encode_snapshot(snapshot: dict[str, Any]) -> tuple[bytes, dict[str, str]]:
+    data = json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+    attributes = {}
+
+    if len(data) >= get_snapshot_compress_min_bytes():
+        data = zlib.compress(data)
+        attributes[ENCODING_ATTRIBUTE] = ZLIB_ENCODING
+
+    if len(data) > get_snapshot_max_bytes():
+        return b"", {}
+
+    return data, attributes
+
+
+def _decode_snapshot(data: bytes, encoding: str | None) -> dict[str, Any] | None:
+    try:
+        if encoding == ZLIB_ENCODING:
+            data = zlib.decompress(data)
+        return json.loads(data)
+    except Exception as e:
+        # The message is still valid as a reference, the product gets read instead
+        _logger.error(f"Error decoding carried snapshot, falling back to a read: {e}")
+        return None
+
+
+def encode_bulk_message(
+    message: TriggerMessage, wire_version: str | None = None
+) -> tuple[bytes, dict[str, str]]:
+    """
+    Returns:
+        (data, attributes) to publish
+    """
+
+    if (wire_version or get_bulk_message_wire_version()) == WIRE_VERSION_2:
+        data = b""
+        attributes = {
+            WIRE_VERSION_ATTRIBUTE: WIRE_VERSION_2,
+            "product_id": message.product_id,
+            "event_type": message.event_type.value,
+        }
+        if message.update_time is not None:
+            attributes["update_time"] = message.update_time.isoformat()
+        if message.event_time is not None:
+            attributes["event_time"] = message.event_time.isoformat()
+        if message.snapshot is not None:
+            data, snapshot_attributes = _encode_snapshot(message.snapshot)
+            attributes.update(snapshot_attributes)
+
+        return data, attributes
+
+    # v1 only ever carried the reference
+    payload = {"product_id": message.product_id, "event_type": message.event_type.value}
+    if message.update_time is not None:
+        payload["update_time"] = message.update_time.isoformat()
+    if message.event_time is not None:
+        payload["event_time"] = message.event_time.isoformat()
+    return json.dumps({"data": payload}).encode("utf-8"), {}
+
+
+def _build_trigger_message(
+    product_id: Any,
+    event_type: Any,
+    update_time: datetime | None = None,
+    snapshot: dict[str, Any] | None = None,
+    event_time: datetime | None = None,
+    publish_time: datetime | None = None,
+    received_time: datetime | None = None,
+) -> TriggerMessage:
+    # Checked by hand and built without pydantic validation, this runs for every
+    # message of every pull
+    if not isinstance(product_id, str) or not product_id:
+        raise ValueError(f"Invalid product_id={product_id!r}")
+
+    fn_event_type = _EVENT_TYPES.get(event_type)
+    if fn_event_type is None:
+        raise ValueError(f"Invalid event_type={event_type!r}")
+
+    return TriggerMessage.model_construct(
+        product_id=product_id,
+        event_type=fn_event_type,
+        update_time=update_time,
+        event_time=event_time,
+        snapshot=snapshot,
+        publish_time=publish_time,
+        received_time=received_time,
+    )
+
+
+def _parse_time(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+def decode_bulk_message(
+    message: PubsubMessageLike, received_time: datetime | None = None
+) -> TriggerMessage:
+    # Set by Pub/Sub on every message, streamed and pulled ones alike
+    publish_time = getattr(message, "publish_time", None)
+
+    attributes = message.attributes
+    if attributes and attributes.get(WIRE_VERSION_ATTRIBUTE) == WIRE_VERSION_2:
+        return _build_trigger_message(
+            attributes.get("product_id"),
+            attributes.get("event_type"),
+            _parse_time(attributes.get("update_time")),
+            (
+                _decode_snapshot(message.data, attributes.get(ENCODING_ATTRIBUTE))
+                if message.data
+                else None
+            ),
+            _parse_time(attributes.get("event_time")),
+            publish_time,
+            received_time,
+        )
+
+    # v1, the whole payload is JSON in the body
+    msg_data = json.loads(message.data.decode("utf-8")).get("data", {})
+    return _build_trigger_message(
+        msg_data.get("product_id"),
+        msg_data.get("event_type"),
+        _parse_time(msg_data.get("update_time")),
+        event_time=_parse_time(msg_data.get("event_time")),
+        publish_time=publish_time,
+        received_time=received_time,
+    )
+
+
+def decode_bulk_messages(
+    messages: list[tuple[PubsubMessageLike, str]],
+    received_time: datetime | None = None,
+) -> tuple[list[tuple[TriggerMessage, str]], list[str]]:
+    """
+    Decode a whole pull in one pass.
+
+    Args:
+        messages: (message, ack_id) in arrival order
+        received_time: When the messages were pulled, for lag tracking
+
+    Returns:
+        (decoded messages with their ack_id, ack_ids of poison messages to ack)
+    """
+
+    decoded: list[tuple[TriggerMessage, str]] = []
+    poison_ack_ids: list[str] = []
+    for message, ack_id in messages:
+        try:
+            decoded.append((decode_bulk_message(message, received_time), ack_id))
+        except Exception as e:
+            _logger.error(
+                f"Error decoding bulk message: {e}. attributes={dict(message.attributes or {})} data={message.data[:200]!r}"
+            )
+            poison_ack_ids.append(ack_id)
+
+    return decoded, poison_ack_ids
@@ -0,0 +1,83 @@
+import logging
+import os
+import threading
+from typing import Any
+
+from app.models.product import FirestoreProduct
+from app.services.firestore import FN_EVENT_TYPE
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+############################### CHANGE FILTER #####################################
+###################################################################################
+# Decides whether a product write has to be synced at all. Updates are diffed over
+# the fields other_product_model depends on, so writes that only move updatedAt or
+# touch fields it doesn't use (tooling, backfills) are dropped at the source.
+# Creates and deletes are always synced.
+###################################################################################
+
+# Fields whose change alone is not worth a sync
+IGNORED_PRODUCT_FIELDS = frozenset({"updatedAt"})
+
+_change_filter_stats = {"relevant": 0, "suppressed": 0}
+_change_filter_stats_lock = threading.Lock()
+
+
+def is_change_filter_enabled() -> bool:
+    return os.environ.get("PRODUCT_CHANGE_FILTER_ENABLED", "true") == "true"
+
+
+def get_relevant_product_fields() -> frozenset[str]:
+    # Comma separated, defaults to every FirestoreProduct field but updatedAt
+    fields = os.environ.get("PRODUCT_SYNC_RELEVANT_FIELDS")
+    if fields:
+        return frozenset(field.strip() for field in fields.split(",") if field.strip())
+
+    return frozenset(FirestoreProduct.model_fields) - IGNORED_PRODUCT_FIELDS
+
+
+def get_changed_fields(
+    before: dict[str, Any], after: dict[str, Any], fields: frozenset[str]
+) -> set[str]:
+    return {
+        field
+        for field in fields
+        if field in before or field in after
+        if before.get(field) != after.get(field)
+    }
+
+
+def has_relevant_changes(
+    event_type: FN_EVENT_TYPE,
+    before: dict[str, Any] | None,
+    after: dict[str, Any] | None,
+    fields: frozenset[str] | None = None,
+) -> bool:
+    """
+    Args:
+        event_type: The type of the write
+        before: The document before the write, None on create
+        after: The document after the write, None on delete
+        fields: The fields to diff, defaults to get_relevant_product_fields()
+
+    Returns:
+        Whether the write changes anything other_product_model depends on
+    """
+
+    if event_type != FN_EVENT_TYPE.UPDATE or before is None or after is None:
+        return True
+
+    return bool(
+        get_changed_fields(before, after, fields or get_relevant_product_fields())
+    )
+
+
+def record_change_filter_result(relevant: bool) -> None:
+    with _change_filter_stats_lock:
+        _change_filter_stats["relevant" if relevant else "suppressed"] += 1
+
+
+def get_change_filter_stats() -> dict[str, int]:
+    with _change_filter_stats_lock:
+        return dict(_change_filter_stats)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any
+
+from app.services.cache import LRUCache
+from app.services.firestore import get_firestore_client
+from app.services.product.firestore import PRODUCTS_BATCH_READ_SIZE
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+########################### CONTENT HASH WRITE ELISION ############################
+###################################################################################
+# Every synced document carries a digest of its content in CONTENT_HASH_FIELD.
+# The digests of recent writes are kept in an in-process LRU, and a document whose
+# digest matches is not written again. That happens on redeliveries, duplicate
+# messages and source updates that don't change the transformed output.
+#
+# A miss in the LRU (cold instance, evicted entry) writes the document, unless
+# CONTENT_HASH_VERIFY_TARGET=true, which reads the stored digests first. A read is
+# cheaper than a write, but only pays off when most misses are unchanged.
+###################################################################################
+
+CONTENT_HASH_FIELD = "_contentHash"
+
+# Only the writes of this instance are seen, the TTL bounds how long a change made
+# by another one (an overlapping instance, manual edits) can be hidden. 0 disables it.
+_content_hashes = LRUCache(
+    max_size=int(os.environ.get("CONTENT_HASH_CACHE_SIZE", "10000")),
+    ttl_sec=float(os.environ.get("CONTENT_HASH_CACHE_TTL_SEC", "3600")) or None,
+)
+
+_write_stats = {"elided": 0, "performed": 0}
+_write_stats_lock = threading.Lock()
+
+
+def is_content_hash_enabled() -> bool:
+    return os.environ.get("CONTENT_HASH_ENABLED", "true") == "true"
+
+
+def is_content_hash_target_verify_enabled() -> bool:
+    return os.environ.get("CONTENT_HASH_VERIFY_TARGET") == "true"
+
+
+def compute_content_hash(document: dict[str, Any]) -> str:
+    content = {
+        key: value for key, value in document.items() if key != CONTENT_HASH_FIELD
+    }
+    canonical_json = json.dumps(
+        content, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(canonical_json.encode("utf-8")).hexdigest()
+
+
+def _cache_key(collection_name: str, document_id: str) -> tuple[str, str]:
+    return collection_name, document_id
+
+
+def _get_stored_content_hashes(
+    collection_name: str, document_ids: list[str]
+) -> dict[str, str]:
+    firestore_client = get_firestore_client()
+    collection = firestore_client.collection(collection_name)
+
+    stored_hashes: dict[str, str] = {}
+    for i in range(0, len(document_ids), PRODUCTS_BATCH_READ_SIZE):
+        refs = [
+            collection.document(document_id)
+            for document_id in document_ids[i : i + PRODUCTS_BATCH_READ_SIZE]
+        ]
+        for snapshot in firestore_client.get_all(
+            refs, field_paths=[CONTENT_HASH_FIELD]
+        ):
+            content_hash = snapshot.get(CONTENT_HASH_FIELD) if snapshot.exists else None
+            if content_hash:
+                stored_hashes[snapshot.id] = content_hash
+
+    return stored_hashes
+
+
+def elide_unchanged_writes(
+    documents: dict[str, dict[str, Any]], collection_name: str
+) -> tuple[dict[str, dict[str, Any]], list[str]]:
+    """
+    Stamp the documents with their content hash and drop the unchanged ones.
+
+    Returns:
+        (documents that have to be written, ids whose write was elided)
+    """
+
+    to_write: dict[str, dict[str, Any]] = {}
+    elided_ids: list[str] = []
+    for document_id, document in documents.items():
+        content_hash = compute_content_hash(document)
+        if _content_hashes.get(_cache_key(collection_name, document_id)) == content_hash:
+            elided_ids.append(document_id)
+        else:
+            to_write[document_id] = {**document, CONTENT_HASH_FIELD: content_hash}
+
+    if to_write and is_content_hash_target_verify_enabled():
+        try:
+            stored_hashes = _get_stored_content_hashes(collection_name, list(to_write))
+        except Exception as e:
+            _logger.error(f"Error reading content hashes from {collection_name}: {e}")
+            stored_hashes = {}
+
+        for document_id, content_hash in stored_hashes.items():
+            if to_write[document_id][CONTENT_HASH_FIELD] == content_hash:
+                del to_write[document_id]
+                elided_ids.append(document_id)
+                _content_hashes.set(_cache_key(collection_name, document_id), content_hash)
+
+    with _write_stats_lock:
+        _write_stats["elided"] += len(elided_ids)
+        _write_stats["performed"] += len(to_write)
+
+    return to_write, elided_ids
+
+
+def record_written_documents(
+    documents: dict[str, dict[str, Any]],
+    written_ids: list[str],
+    collection_name: str,
+) -> None:
+    """Remember the hashes of documents returned by elide_unchanged_writes once they commit."""
+
+    for document_id in written_ids:
+        content_hash = documents[document_id].get(CONTENT_HASH_FIELD)
+        if content_hash:
+            _content_hashes.set(_cache_key(collection_name, document_id), content_hash)
+
+
+def invalidate_content_hashes(document_ids: list[str], collection_name: str) -> None:
+    for document_id in document_ids:
+        _content_hashes.pop(_cache_key(collection_name, document_id))
+
+
+def get_content_hash_stats() -> dict[str, int]:
+    with _write_stats_lock:
+        return {**_write_stats, "cached": len(_content_hashes)}
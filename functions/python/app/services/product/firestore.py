@@ -1,32 +1,265 @@
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any
+
 from google.cloud import firestore
+from pydantic import BaseModel, ConfigDict, Field
+
 from app.models.product import (
     FirestoreProduct,
     FIRESTORE_PRODUCTS_COLLECTION_NAME,
 )
+from app.services.cache import LRUCache
+from app.services.firestore import get_firestore_client, is_firestore_throttling_error
+from app.services.throttling import TokenBucketRateLimiter
+
+_logger = logging.getLogger(__name__)
 
 PRODUCT_404 = "Product with id=%s is not found in Firestore collection=%s."
 
-def get_product_ref_by_id(product_id: str) -> firestore.DocumentReference:
-    firestore_client = firestore.Client()
-    return firestore_client.collection(FIRESTORE_PRODUCTS_COLLECTION_NAME).document(
+# Documents fetched per BatchGetDocuments call in get_products_by_ids
+PRODUCTS_BATCH_READ_SIZE = 100
+
+# Firestore commits at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+
+# Opt-in cache of products read by this instance, keyed by (collection, id) and
+# stamped with the document's update_time. Callers that know the version they need
+# pass it, and older cached entries are read again.
+_product_read_cache = LRUCache(
+    max_size=int(os.environ.get("PRODUCT_READ_CACHE_SIZE", "5000")),
+    ttl_sec=float(os.environ.get("PRODUCT_READ_CACHE_TTL_SEC", "60")) or None,
+)
+_product_read_cache_stats = {"hits": 0, "misses": 0, "stale": 0}
+_product_read_cache_stats_lock = threading.Lock()
+
+
+class BatchWriteResult(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    succeeded_ids: list[str] = Field(default_factory=list)
+    errors: dict[str, Exception] = Field(default_factory=dict)
+
+
+def is_product_read_cache_enabled() -> bool:
+    return os.environ.get("PRODUCT_READ_CACHE_ENABLED") == "true"
+
+
+def _get_cached_product(
+    product_id: str, collection_name: str, min_update_time: datetime | None
+) -> FirestoreProduct | None:
+    entry = _product_read_cache.get((collection_name, product_id))
+
+    with _product_read_cache_stats_lock:
+        if entry is None:
+            _product_read_cache_stats["misses"] += 1
+            return None
+
+        product, update_time = entry
+        if min_update_time is not None and (
+            update_time is None or update_time < min_update_time
+        ):
+            _product_read_cache_stats["stale"] += 1
+            return None
+
+        _product_read_cache_stats["hits"] += 1
+
+    # Callers may modify what they get back
+    return product.model_copy()
+
+
+def _cache_product(
+    product_id: str,
+    collection_name: str,
+    product: FirestoreProduct,
+    update_time: datetime | None,
+) -> None:
+    cached = _product_read_cache.get((collection_name, product_id))
+    # Concurrent reads may finish out of order, never replace a newer version
+    if cached is not None and cached[1] is not None and (
+        update_time is None or cached[1] > update_time
+    ):
+        return
+    _product_read_cache.set((collection_name, product_id), (product, update_time))
+
+
+def invalidate_cached_products(
+    product_ids: list[str], collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME
+) -> None:
+    for product_id in product_ids:
+        _product_read_cache.pop((collection_name, product_id))
+
+
+def get_product_read_cache_stats() -> dict[str, Any]:
+    with _product_read_cache_stats_lock:
+        stats = dict(_product_read_cache_stats)
+
+    lookups = stats["hits"] + stats["misses"] + stats["stale"]
+    return {
+        **stats,
+        "hit_ratio": stats["hits"] / lookups if lookups else 0.0,
+        "size": len(_product_read_cache),
+    }
+
+
+def parse_product_snapshot(
+    snapshot: firestore.DocumentSnapshot, collection_name: str
+) -> FirestoreProduct | None:
+    """
+    Returns:
+        The product, or None when the document is not a valid product
+    """
+
+    try:
+        return FirestoreProduct(**snapshot.to_dict())
+    except Exception as e:
+        # One malformed document must not fail the read of the whole batch
+        _logger.error(f"Invalid product {snapshot.id} in {collection_name}: {e}")
+        return None
+
+
+def get_cached_products(
+    product_ids: list[str],
+    collection_name: str,
+    min_update_times: dict[str, datetime | None] | None = None,
+) -> tuple[dict[str, FirestoreProduct], list[str]]:
+    """
+    Look up products in the read cache, see get_products_by_ids for min_update_times.
+
+    Returns:
+        (cached products keyed by document id, unique ids that have to be read)
+    """
+
+    # get_all rejects duplicated references
+    unique_ids = list(dict.fromkeys(product_ids))
+
+    products: dict[str, FirestoreProduct] = {}
+    if not is_product_read_cache_enabled():
+        return products, unique_ids
+
+    for product_id in unique_ids:
+        if min_update_times is not None and product_id in min_update_times:
+            min_update_time = min_update_times[product_id]
+            if min_update_time is None:
+                continue
+        else:
+            min_update_time = None
+
+        cached_product = _get_cached_product(product_id, collection_name, min_update_time)
+        if cached_product is not None:
+            products[product_id] = cached_product
+
+    return products, [product_id for product_id in unique_ids if product_id not in products]
+
+
+def add_product_snapshot(
+    snapshot: firestore.DocumentSnapshot,
+    collection_name: str,
+    products: dict[str, FirestoreProduct],
+    missing_ids: list[str],
+    invalid_ids: list[str],
+) -> None:
+    """Sort a read snapshot into products, missing_ids or invalid_ids, caching valid products."""
+
+    if not snapshot.exists:
+        missing_ids.append(snapshot.id)
+        return
+
+    product = parse_product_snapshot(snapshot, collection_name)
+    if product is None:
+        invalid_ids.append(snapshot.id)
+        return
+
+    if is_product_read_cache_enabled():
+        _cache_product(snapshot.id, collection_name, product, snapshot.update_time)
+        product = product.model_copy()
+    products[snapshot.id] = product
+
+
+def get_product_ref_by_id(product_id: str, collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME) -> firestore.DocumentReference:
+    firestore_client = get_firestore_client()
+    return firestore_client.collection(collection_name).document(
         product_id
     )
 
 
-def get_product_by_id(product_id: str, collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME) -> FirestoreProduct:
-    product_ref = get_product_ref_by_id(product_id)
-    product = product_ref.get()
+def get_product_by_id(
+    product_id: str,
+    collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    min_update_time: datetime | None = None,
+) -> FirestoreProduct:
+    """
+    Args:
+        min_update_time: Oldest acceptable version when the read cache is enabled,
+            a cached product older than this is read again
+    """
+
+    cache_enabled = is_product_read_cache_enabled()
+    if cache_enabled:
+        cached_product = _get_cached_product(product_id, collection_name, min_update_time)
+        if cached_product is not None:
+            return cached_product
 
-    if not product.exists:
+    product_ref = get_product_ref_by_id(product_id, collection_name)
+    snapshot = product_ref.get()
+
+    if not snapshot.exists:
         raise ValueError(PRODUCT_404 % (product_id, collection_name))
 
-    product = FirestoreProduct(**product.to_dict())
+    product = FirestoreProduct(**snapshot.to_dict())
+    if cache_enabled:
+        _cache_product(product_id, collection_name, product, snapshot.update_time)
+        product = product.model_copy()
 
     return product
 
 
+def get_products_by_ids(
+    product_ids: list[str],
+    collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    chunk_size: int = PRODUCTS_BATCH_READ_SIZE,
+    min_update_times: dict[str, datetime | None] | None = None,
+) -> tuple[dict[str, FirestoreProduct], list[str], list[str]]:
+    """
+    Fetch many products with one get_all RPC per chunk instead of one get per id.
+
+    Args:
+        min_update_times: Oldest acceptable version per id when the read cache is
+            enabled. Ids mapped to None are always read, ids left out accept any
+            cached version.
+
+    Returns:
+        (products keyed by document id, ids that do not exist in the collection,
+        ids whose document is not a valid product)
+    """
+
+    firestore_client = get_firestore_client()
+    collection = firestore_client.collection(collection_name)
+
+    products, unique_ids = get_cached_products(
+        product_ids, collection_name, min_update_times
+    )
+
+    missing_ids: list[str] = []
+    invalid_ids: list[str] = []
+    for i in range(0, len(unique_ids), chunk_size):
+        product_refs = [
+            collection.document(product_id)
+            for product_id in unique_ids[i : i + chunk_size]
+        ]
+        for snapshot in firestore_client.get_all(product_refs):
+            add_product_snapshot(
+                snapshot, collection_name, products, missing_ids, invalid_ids
+            )
+
+    return products, missing_ids, invalid_ids
+
+
 def update_product_by_id(product_id, updates: dict[str, any], collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME) -> dict[str, any]:
-    firestore_client = firestore.Client()
+    firestore_client = get_firestore_client()
 
     product_update_data = (
         firestore_client.collection(collection_name)
@@ -38,7 +271,7 @@ def update_product_by_id(product_id, updates: dict[str, any], collection_name: s
 
 
 def upsert_product_by_id(product_id, data: dict[str, any], collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME) -> dict[str, any]:
-    firestore_client = firestore.Client()
+    firestore_client = get_firestore_client()
 
     product_update_data = (
         firestore_client.collection(collection_name)
@@ -50,7 +283,122 @@ def upsert_product_by_id(product_id, data: dict[str, any], collection_name: str
 
 
 def delete_product_by_id(id: str, collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME):
-    firestore_client = firestore.Client()
+    firestore_client = get_firestore_client()
     firestore_client.collection(collection_name).document(
         id
     ).delete()
+
+
+def _write_document(ref: firestore.DocumentReference, data: dict[str, Any] | None) -> None:
+    # None means the document has to be deleted
+    if data is None:
+        ref.delete()
+    else:
+        ref.set(data)
+
+
+def _write_document_in_batch(
+    batch: firestore.WriteBatch,
+    ref: firestore.DocumentReference,
+    data: dict[str, Any] | None,
+) -> None:
+    if data is None:
+        batch.delete(ref)
+    else:
+        batch.set(ref, data)
+
+
+def report_write_error(
+    rate_limiter: TokenBucketRateLimiter | None, error: Exception
+) -> None:
+    if rate_limiter is not None and is_firestore_throttling_error(error):
+        rate_limiter.on_throttled()
+
+
+def _commit_in_batches(
+    collection_name: str,
+    documents: list[tuple[str, dict[str, Any] | None]],
+    chunk_size: int = MAX_BATCH_WRITES,
+    rate_limiter: TokenBucketRateLimiter | None = None,
+) -> BatchWriteResult:
+    firestore_client = get_firestore_client()
+    collection = firestore_client.collection(collection_name)
+    result = BatchWriteResult()
+
+    for i in range(0, len(documents), chunk_size):
+        chunk = documents[i : i + chunk_size]
+
+        batch = firestore_client.batch()
+        for document_id, data in chunk:
+            _write_document_in_batch(batch, collection.document(document_id), data)
+
+        if rate_limiter is not None:
+            rate_limiter.acquire(len(chunk))
+
+        try:
+            batch.commit()
+            result.succeeded_ids.extend(document_id for document_id, _ in chunk)
+            if rate_limiter is not None:
+                rate_limiter.on_success()
+            continue
+        except Exception as e:
+            report_write_error(rate_limiter, e)
+            if is_firestore_throttling_error(e):
+                # Firestore asks us to back off, one by one writes would multiply the
+                # load. The whole chunk fails and its messages are redelivered later.
+                _logger.error(
+                    f"Throttled committing batch of {len(chunk)} writes to {collection_name}: {e}"
+                )
+                for document_id, _ in chunk:
+                    result.errors[document_id] = e
+                continue
+
+            # A batch is atomic, so only this chunk is retried one by one to find
+            # out which documents are actually failing, e.g. a single invalid one
+            _logger.error(
+                f"Error committing batch of {len(chunk)} writes to {collection_name}: {e}. Trying one by one."
+            )
+
+        for document_id, data in chunk:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+
+            try:
+                _write_document(collection.document(document_id), data)
+                result.succeeded_ids.append(document_id)
+                if rate_limiter is not None:
+                    rate_limiter.on_success()
+            except Exception as e:
+                report_write_error(rate_limiter, e)
+                _logger.error(
+                    f"Error writing document {document_id} to {collection_name}: {e}"
+                )
+                result.errors[document_id] = e
+
+    return result
+
+
+def upsert_products_by_ids(
+    products: dict[str, dict[str, Any]],
+    collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    rate_limiter: TokenBucketRateLimiter | None = None,
+) -> BatchWriteResult:
+    """Set many documents with chunked write batches, reporting each document."""
+
+    return _commit_in_batches(
+        collection_name, list(products.items()), rate_limiter=rate_limiter
+    )
+
+
+def delete_products_by_ids(
+    product_ids: list[str],
+    collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    rate_limiter: TokenBucketRateLimiter | None = None,
+) -> BatchWriteResult:
+    """Delete many documents with chunked write batches, reporting each document."""
+
+    return _commit_in_batches(
+        collection_name,
+        [(product_id, None) for product_id in dict.fromkeys(product_ids)],
+        rate_limiter=rate_limiter,
+    )
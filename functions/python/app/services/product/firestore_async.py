@@ -0,0 +1,206 @@
+import asyncio
+import contextlib
+import logging
+from datetime import datetime
+from typing import Any
+
+from google.cloud import firestore
+
+from app.models.product import (
+    FirestoreProduct,
+    FIRESTORE_PRODUCTS_COLLECTION_NAME,
+)
+from app.services.firestore import (
+    get_firestore_async_client,
+    is_firestore_throttling_error,
+)
+from app.services.product.firestore import (
+    MAX_BATCH_WRITES,
+    PRODUCTS_BATCH_READ_SIZE,
+    BatchWriteResult,
+    add_product_snapshot,
+    get_cached_products,
+    report_write_error,
+)
+from app.services.throttling import TokenBucketRateLimiter
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+########################## ASYNC PRODUCT FIRESTORE ################################
+###################################################################################
+# asyncio counterparts of the bulk helpers in app.services.product.firestore on the
+# Firestore AsyncClient. Chunks are read and committed concurrently, bounded by
+# the semaphore the caller passes in, and share the sync module's read cache.
+###################################################################################
+
+
+async def get_products_by_ids_async(
+    product_ids: list[str],
+    collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    chunk_size: int = PRODUCTS_BATCH_READ_SIZE,
+    min_update_times: dict[str, datetime | None] | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+) -> tuple[dict[str, FirestoreProduct], list[str], list[str]]:
+    """
+    See get_products_by_ids, the chunks are fetched concurrently.
+
+    Returns:
+        (products keyed by document id, ids that do not exist in the collection,
+        ids whose document is not a valid product)
+    """
+
+    firestore_client = get_firestore_async_client()
+    collection = firestore_client.collection(collection_name)
+
+    products, unique_ids = get_cached_products(
+        product_ids, collection_name, min_update_times
+    )
+
+    missing_ids: list[str] = []
+    invalid_ids: list[str] = []
+
+    async def read_chunk(chunk_ids: list[str]) -> None:
+        product_refs = [collection.document(product_id) for product_id in chunk_ids]
+        async with semaphore or contextlib.nullcontext():
+            async for snapshot in firestore_client.get_all(product_refs):
+                add_product_snapshot(
+                    snapshot, collection_name, products, missing_ids, invalid_ids
+                )
+
+    await asyncio.gather(
+        *[
+            read_chunk(unique_ids[i : i + chunk_size])
+            for i in range(0, len(unique_ids), chunk_size)
+        ]
+    )
+
+    return products, missing_ids, invalid_ids
+
+
+async def _write_document_async(
+    ref: firestore.AsyncDocumentReference, data: dict[str, Any] | None
+) -> None:
+    # None means the document has to be deleted
+    if data is None:
+        await ref.delete()
+    else:
+        await ref.set(data)
+
+
+async def _commit_chunk_async(
+    firestore_client: firestore.AsyncClient,
+    collection: firestore.AsyncCollectionReference,
+    collection_name: str,
+    chunk: list[tuple[str, dict[str, Any] | None]],
+    result: BatchWriteResult,
+    rate_limiter: TokenBucketRateLimiter | None,
+) -> None:
+    batch = firestore_client.batch()
+    for document_id, data in chunk:
+        if data is None:
+            batch.delete(collection.document(document_id))
+        else:
+            batch.set(collection.document(document_id), data)
+
+    if rate_limiter is not None:
+        await rate_limiter.acquire_async(len(chunk))
+
+    try:
+        await batch.commit()
+        result.succeeded_ids.extend(document_id for document_id, _ in chunk)
+        if rate_limiter is not None:
+            rate_limiter.on_success()
+        return
+    except Exception as e:
+        report_write_error(rate_limiter, e)
+        if is_firestore_throttling_error(e):
+            # Firestore asks us to back off, one by one writes would multiply the
+            # load. The whole chunk fails and its messages are redelivered later.
+            _logger.error(
+                f"Throttled committing batch of {len(chunk)} writes to {collection_name}: {e}"
+            )
+            for document_id, _ in chunk:
+                result.errors[document_id] = e
+            return
+
+        # A batch is atomic, so only this chunk is retried one by one to find
+        # out which documents are actually failing, e.g. a single invalid one
+        _logger.error(
+            f"Error committing batch of {len(chunk)} writes to {collection_name}: {e}. Trying one by one."
+        )
+
+    for document_id, data in chunk:
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async()
+
+        try:
+            await _write_document_async(collection.document(document_id), data)
+            result.succeeded_ids.append(document_id)
+            if rate_limiter is not None:
+                rate_limiter.on_success()
+        except Exception as e:
+            report_write_error(rate_limiter, e)
+            _logger.error(
+                f"Error writing document {document_id} to {collection_name}: {e}"
+            )
+            result.errors[document_id] = e
+
+
+async def _commit_in_batches_async(
+    collection_name: str,
+    documents: list[tuple[str, dict[str, Any] | None]],
+    chunk_size: int = MAX_BATCH_WRITES,
+    rate_limiter: TokenBucketRateLimiter | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+) -> BatchWriteResult:
+    firestore_client = get_firestore_async_client()
+    collection = firestore_client.collection(collection_name)
+    result = BatchWriteResult()
+
+    async def commit_chunk(chunk: list[tuple[str, dict[str, Any] | None]]) -> None:
+        async with semaphore or contextlib.nullcontext():
+            await _commit_chunk_async(
+                firestore_client, collection, collection_name, chunk, result, rate_limiter
+            )
+
+    await asyncio.gather(
+        *[
+            commit_chunk(documents[i : i + chunk_size])
+            for i in range(0, len(documents), chunk_size)
+        ]
+    )
+
+    return result
+
+
+async def upsert_products_by_ids_async(
+    products: dict[str, dict[str, Any]],
+    collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    rate_limiter: TokenBucketRateLimiter | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+) -> BatchWriteResult:
+    """Set many documents with concurrent write batches, reporting each document."""
+
+    return await _commit_in_batches_async(
+        collection_name,
+        list(products.items()),
+        rate_limiter=rate_limiter,
+        semaphore=semaphore,
+    )
+
+
+async def delete_products_by_ids_async(
+    product_ids: list[str],
+    collection_name: str = FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    rate_limiter: TokenBucketRateLimiter | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+) -> BatchWriteResult:
+    """Delete many documents with concurrent write batches, reporting each document."""
+
+    return await _commit_in_batches_async(
+        collection_name,
+        [(product_id, None) for product_id in dict.fromkeys(product_ids)],
+        rate_limiter=rate_limiter,
+        semaphore=semaphore,
+    )
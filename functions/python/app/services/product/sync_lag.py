@@ -0,0 +1,142 @@
+import logging
+from datetime import datetime, timezone
+from enum import Enum
+
+from app.metrics import observe, percentile, set_gauge
+from app.services.firestore import FN_EVENT_TYPE
+from app.services.product.bulk_messages import TriggerMessage
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+################################### SYNC LAG ######################################
+###################################################################################
+# How far other_product_model is behind products, measured per committed message:
+#   source write (event_time, else update_time) -> publish (Pub/Sub publish_time)
+#   -> pull (received_time) -> commit (now)
+# Every segment goes into the sync_lag_sec histogram labelled by segment, and the
+# worst write -> commit lag of the last pull is the sync_staleness_sec gauge.
+# When several writes of a product are coalesced, write -> commit is measured from
+# the oldest one and the other segments from the newest message.
+###################################################################################
+
+
+class LAG_SEGMENT(str, Enum):
+    WRITE_TO_PUBLISH = "write_to_publish"
+    PUBLISH_TO_PULL = "publish_to_pull"
+    PULL_TO_COMMIT = "pull_to_commit"
+    WRITE_TO_COMMIT = "write_to_commit"
+
+
+SYNC_LAG_METRIC = "sync_lag_sec"
+SYNC_STALENESS_GAUGE = "sync_staleness_sec"
+
+
+def get_source_write_time(message: TriggerMessage) -> datetime | None:
+    if message.event_time is not None:
+        return message.event_time
+
+    # The update_time of a deleted document is the one of its last write
+    if message.event_type == FN_EVENT_TYPE.DELETE:
+        return None
+
+    return message.update_time
+
+
+def get_oldest_write_time(message: TriggerMessage) -> datetime | None:
+    return message.oldest_write_time or get_source_write_time(message)
+
+
+def get_message_lags(
+    message: TriggerMessage, committed_at: datetime
+) -> dict[LAG_SEGMENT, float]:
+    """
+    Returns:
+        Lag in seconds per segment, segments with a missing timestamp are left out
+    """
+
+    write_time = get_source_write_time(message)
+    points = [
+        (LAG_SEGMENT.WRITE_TO_PUBLISH, write_time, message.publish_time),
+        (LAG_SEGMENT.PUBLISH_TO_PULL, message.publish_time, message.received_time),
+        (LAG_SEGMENT.PULL_TO_COMMIT, message.received_time, committed_at),
+        (LAG_SEGMENT.WRITE_TO_COMMIT, get_oldest_write_time(message), committed_at),
+    ]
+
+    return {
+        segment: max(0.0, (end - start).total_seconds())
+        for segment, start, end in points
+        if start is not None and end is not None
+    }
+
+
+def record_sync_lag(
+    messages: list[TriggerMessage], committed_at: datetime | None = None
+) -> dict[str, dict[str, float]]:
+    """
+    Record the lag of a committed batch.
+
+    Returns:
+        {segment: {"p50", "p95", "max"}} for the segments that had timestamps
+    """
+
+    committed_at = committed_at or datetime.now(timezone.utc)
+    lags: dict[LAG_SEGMENT, list[float]] = {}
+    for message in messages:
+        for segment, lag in get_message_lags(message, committed_at).items():
+            lags.setdefault(segment, []).append(lag)
+            observe(SYNC_LAG_METRIC, lag, segment.value)
+
+    summary = {
+        segment.value: {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values),
+        }
+        for segment, values in lags.items()
+    }
+    if not summary:
+        return summary
+
+    _logger.info(
+        f"Sync lag of {len(messages)} products: "
+        + " ".join(
+            f"{segment} p50={lag['p50']:.3f}s p95={lag['p95']:.3f}s max={lag['max']:.3f}s"
+            for segment, lag in summary.items()
+        ),
+        extra={"json_fields": {"sync_lag": summary}},
+    )
+    return summary
+
+
+def record_synced_lag(
+    messages: list[tuple[TriggerMessage, list[str]]], done_ack_ids: set[str]
+) -> float | None:
+    """
+    record_sync_lag() for the coalesced messages whose ack_ids all committed.
+
+    Returns:
+        The worst write -> commit lag, None without timestamps
+    """
+
+    summary = record_sync_lag(
+        [
+            message
+            for message, ack_ids in messages
+            if ack_ids and all(ack_id in done_ack_ids for ack_id in ack_ids)
+        ]
+    )
+    return summary.get(LAG_SEGMENT.WRITE_TO_COMMIT.value, {}).get("max")
+
+
+def set_sync_staleness(lags_sec: list[float | None]) -> None:
+    """Set the gauge once per pull, from the worst lag of all its sub-batches."""
+
+    lags_sec = [lag_sec for lag_sec in lags_sec if lag_sec is not None]
+    if lags_sec:
+        set_gauge(SYNC_STALENESS_GAUGE, max(lags_sec))
+
+
+def reset_sync_staleness() -> None:
+    # The subscription is drained, other_product_model is up to date
+    set_gauge(SYNC_STALENESS_GAUGE, 0.0)
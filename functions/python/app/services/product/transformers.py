@@ -1,16 +1,118 @@
-import json
-import time
-from datetime import datetime
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Callable
+from uuid import UUID
+
+from google.cloud.firestore import DocumentReference, GeoPoint
+from pydantic_core import to_jsonable_python
 
 from app.models.product import (
     FirestoreProduct,
 )
 
+###################################################################################
+############################## TRANSFORMER ENGINE #################################
+###################################################################################
+# Turns a product into the other_product_model document in a single pass over its
+# fields. Values are normalised by converters registered per type, producing the
+# same output as the former model_dump_json -> json.loads round trip, without
+# building and parsing a JSON string per product.
+###################################################################################
+
+Converter = Callable[[Any], Any]
+
+_JSON_TYPES = (str, int, float, bool, type(None))
+
+_converters: dict[type, Converter] = {}
+# Resolved converter per concrete type, including subclasses such as
+# DatetimeWithNanoseconds, so the MRO is only walked once per type
+_resolved_converters: dict[type, Converter | None] = {}
+
+
+def register_converter(value_type: type, converter: Converter) -> None:
+    _converters[value_type] = converter
+    _resolved_converters.clear()
+
+
+def _get_converter(value_type: type) -> Converter | None:
+    try:
+        return _resolved_converters[value_type]
+    except KeyError:
+        pass
+
+    converter = next(
+        (_converters[base] for base in value_type.__mro__ if base in _converters),
+        None,
+    )
+    _resolved_converters[value_type] = converter
+    return converter
+
+
+def convert_value(value: Any) -> Any:
+    value_type = type(value)
+    if value_type in _JSON_TYPES:
+        return value
+
+    if value_type is dict:
+        return {str(key): convert_value(item) for key, item in value.items()}
+
+    if value_type in (list, tuple, set, frozenset):
+        return [convert_value(item) for item in value]
+
+    converter = _resolved_converters.get(value_type) or _get_converter(value_type)
+    if converter is not None:
+        return converter(value)
+
+    # Anything else is serialised the way pydantic would have done it
+    return to_jsonable_python(value)
+
+
+def _convert_datetime(value: datetime) -> str:
+    # pydantic writes UTC as "Z", keep the documents identical to what it produced
+    text = value.isoformat()
+    return text[:-6] + "Z" if text.endswith("+00:00") else text
+
+
+def _convert_geo_point(value: GeoPoint) -> dict[str, float]:
+    return {"latitude": value.latitude, "longitude": value.longitude}
+
+
+register_converter(datetime, _convert_datetime)
+register_converter(date, lambda value: value.isoformat())
+register_converter(time, lambda value: value.isoformat())
+register_converter(bytes, lambda value: value.decode("utf-8"))
+register_converter(Decimal, str)
+register_converter(UUID, str)
+register_converter(Enum, lambda value: convert_value(value.value))
+register_converter(GeoPoint, _convert_geo_point)
+register_converter(DocumentReference, lambda value: value.path)
+
 
 def get_another_model_from_product(data: FirestoreProduct):
-    ts_data = json.loads(
-        data.model_dump_json()
-    )  # model_dump_json will serialize timestamps and similar fields
+    # __dict__ holds exactly the fields, iterating the model itself is much slower
+    return {name: convert_value(value) for name, value in data.__dict__.items()}
+
+
+def get_another_models_from_products(
+    products: dict[str, FirestoreProduct],
+) -> tuple[dict[str, dict[str, Any]], dict[str, Exception]]:
+    """
+    Transform a whole pull at once.
+
+    Returns:
+        (documents by product id, errors by product id)
+    """
+
+    another_model_products: dict[str, dict[str, Any]] = {}
+    errors: dict[str, Exception] = {}
+    for product_id, product in products.items():
+        try:
+            another_model_products[product_id] = get_another_model_from_product(
+                product
+            )
+        except Exception as e:
+            errors[product_id] = e
 
+    return another_model_products, errors
 
-    return ts_data
@@ -1,65 +1,264 @@
+import atexit
+import functools
 import json
 import logging
-from typing import Any, Dict
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
 
 from google.cloud import pubsub_v1
+from google.api_core.exceptions import AlreadyExists, NotFound
 from google.api_core.retry import Retry
 from google.cloud.pubsub_v1.publisher.futures import Future
 
+from app.metrics import PIPELINE_STAGE, record_stage
+
 
 _logger = logging.getLogger(__name__)
 
-_pubsub_publisher_client = None
+PROJECT_ID = "demo-local-development"
+
+# Clients are pooled for the lifetime of the instance: one publisher per ordering
+# mode and one subscriber, shared by every function in main.py. Opening a gRPC
+# channel costs more than the publish itself, so we never stop them per event.
+_pubsub_publisher_clients: dict[bool, pubsub_v1.PublisherClient] = {}
 _pubsub_subscriber_client = None
+_pubsub_clients_lock = threading.Lock()
+_pubsub_pool_stats = {"hits": 0, "misses": 0}
+_pubsub_shutdown_registered = False
+_pubsub_shutdown_hooks: list[Callable[[], None]] = []
+
+# Topics and subscriptions that are known to exist, path -> monotonic expiry.
+# Saves the get_topic/get_subscription admin RPCs on every event.
+_provisioned_paths: dict[str, float] = {}
+_provisioned_paths_lock = threading.Lock()
+
+
+def get_publisher_batch_settings() -> pubsub_v1.types.BatchSettings:
+    # Defaults match the client library, override them per deployment via env
+    return pubsub_v1.types.BatchSettings(
+        max_messages=int(os.environ.get("PUBSUB_BATCH_MAX_MESSAGES", "100")),
+        max_bytes=int(os.environ.get("PUBSUB_BATCH_MAX_BYTES", "1000000")),
+        max_latency=float(os.environ.get("PUBSUB_BATCH_MAX_LATENCY", "0.01")),
+    )
+
+
+def _register_pubsub_shutdown() -> None:
+    global _pubsub_shutdown_registered
+
+    if not _pubsub_shutdown_registered:
+        atexit.register(shutdown_pubsub_clients)
+        _pubsub_shutdown_registered = True
 
 
 def get_pubsub_publisher_client(
     enable_message_ordering: bool = False
 ) -> pubsub_v1.PublisherClient:
-    if _pubsub_publisher_client is not None:
-        return _pubsub_publisher_client
-
-    if not enable_message_ordering:
-        return pubsub_v1.PublisherClient()
+    with _pubsub_clients_lock:
+        publisher = _pubsub_publisher_clients.get(enable_message_ordering)
+        if publisher is not None:
+            _pubsub_pool_stats["hits"] += 1
+            return publisher
 
-    return pubsub_v1.PublisherClient(
-        publisher_options=pubsub_v1.types.PublisherOptions(
-            enable_message_ordering=True,
+        _pubsub_pool_stats["misses"] += 1
+        publisher = pubsub_v1.PublisherClient(
+            batch_settings=get_publisher_batch_settings(),
+            publisher_options=pubsub_v1.types.PublisherOptions(
+                enable_message_ordering=enable_message_ordering,
+            ),
         )
-    )
+        _pubsub_publisher_clients[enable_message_ordering] = publisher
+        _register_pubsub_shutdown()
+        _logger.info(
+            f"Created pooled publisher client enable_message_ordering={enable_message_ordering}"
+        )
+
+        return publisher
 
 
 def get_pubsub_subscriber_client() -> pubsub_v1.SubscriberClient:
-    if _pubsub_subscriber_client is not None:
+    global _pubsub_subscriber_client
+
+    with _pubsub_clients_lock:
+        if _pubsub_subscriber_client is not None:
+            _pubsub_pool_stats["hits"] += 1
+            return _pubsub_subscriber_client
+
+        _pubsub_pool_stats["misses"] += 1
+        _pubsub_subscriber_client = pubsub_v1.SubscriberClient()
+        _register_pubsub_shutdown()
+        _logger.info("Created pooled subscriber client")
+
         return _pubsub_subscriber_client
 
-    return pubsub_v1.SubscriberClient()
 
+def set_pubsub_clients(
+    publisher: Any | None = None, subscriber: Any | None = None
+) -> None:
+    """
+    Replace the pooled clients, e.g. with in-memory stand-ins for benchmarks.
+
+    The publisher serves both ordering modes. None empties the pool, so real
+    clients are created on next use.
+    """
+
+    global _pubsub_subscriber_client
+
+    with _pubsub_clients_lock:
+        _pubsub_publisher_clients.clear()
+        if publisher is not None:
+            _pubsub_publisher_clients[True] = publisher
+            _pubsub_publisher_clients[False] = publisher
+        _pubsub_subscriber_client = subscriber
+
+    with _provisioned_paths_lock:
+        _provisioned_paths.clear()
+
+
+def get_pubsub_pool_stats() -> dict[str, int]:
+    with _pubsub_clients_lock:
+        return {
+            **_pubsub_pool_stats,
+            "publishers": len(_pubsub_publisher_clients),
+            "subscribers": int(_pubsub_subscriber_client is not None),
+        }
+
+
+def flush_pubsub_publishers() -> None:
+    """
+    Stop the pooled publishers, which sends every pending batch before returning.
+
+    A stopped publisher can't be reused, so they are dropped from the pool and the
+    next get_pubsub_publisher_client call builds a fresh one.
+    """
+
+    with _pubsub_clients_lock:
+        publishers = list(_pubsub_publisher_clients.items())
+        _pubsub_publisher_clients.clear()
+
+    for enable_message_ordering, publisher in publishers:
+        try:
+            publisher.stop()
+        except Exception as e:
+            _logger.error(
+                f"Error flushing publisher enable_message_ordering={enable_message_ordering}: {e}"
+            )
+
+
+def register_pubsub_shutdown_hook(hook: Callable[[], None]) -> None:
+    """Run hook on shutdown before the publishers are flushed, e.g. to publish a last message."""
+
+    _pubsub_shutdown_hooks.append(hook)
+
+
+def shutdown_pubsub_clients() -> None:
+    """Flush and close every pooled client. Registered with atexit on first use."""
+
+    global _pubsub_subscriber_client
+
+    for hook in _pubsub_shutdown_hooks:
+        try:
+            hook()
+        except Exception as e:
+            _logger.error(f"Error running Pub/Sub shutdown hook {hook}: {e}")
+
+    flush_pubsub_publishers()
+
+    with _pubsub_clients_lock:
+        subscriber = _pubsub_subscriber_client
+        _pubsub_subscriber_client = None
+
+    if subscriber is not None:
+        try:
+            subscriber.close()
+        except Exception as e:
+            _logger.error(f"Error closing subscriber client: {e}")
+
+    _logger.info(f"Pub/Sub clients shut down. pool_stats={get_pubsub_pool_stats()}")
+
+
+def get_provisioning_ttl() -> float:
+    return float(os.environ.get("PUBSUB_PROVISIONING_TTL_SEC", "3600"))
+
+
+def is_provisioning_assumed() -> bool:
+    # Set when topics and subscriptions are created at deploy time, in which case
+    # we never spend admin API quota on existence checks at runtime
+    return os.environ.get("PUBSUB_ASSUME_PROVISIONED") == "true"
+
+
+def _is_provisioned(path: str) -> bool:
+    if is_provisioning_assumed():
+        return True
+
+    with _provisioned_paths_lock:
+        expires_at = _provisioned_paths.get(path)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del _provisioned_paths[path]
+            return False
+        return True
+
+
+def _mark_provisioned(path: str) -> None:
+    with _provisioned_paths_lock:
+        _provisioned_paths[path] = time.monotonic() + get_provisioning_ttl()
+
+
+def invalidate_provisioned_path(path: str) -> None:
+    """Forget a topic or subscription, so the next lookup checks it again."""
+
+    with _provisioned_paths_lock:
+        if _provisioned_paths.pop(path, None) is not None:
+            _logger.info(f"Invalidated provisioned path {path}")
+
+
+def invalidate_provisioned_path_on_not_found(path: str, error: Exception) -> None:
+    if isinstance(error, NotFound):
+        invalidate_provisioned_path(path)
 
+
+@functools.lru_cache(maxsize=None)
 def get_topic_path(project_id: str, topic_id: str) -> str:
-    pubsub_client = get_pubsub_publisher_client()
-    return pubsub_client.topic_path(project_id, topic_id)
+    # topic_path is a static helper, it does not need a client instance
+    return pubsub_v1.PublisherClient.topic_path(project_id, topic_id)
+
+
+@functools.lru_cache(maxsize=None)
+def get_subscription_path(project_id: str, subscription_id: str) -> str:
+    return pubsub_v1.SubscriberClient.subscription_path(project_id, subscription_id)
 
 
 def get_or_create_topic(
     publisher: pubsub_v1.PublisherClient,
     topic_name: str,
 ) -> str:
-    topic_path = get_topic_path("demo-local-development", topic_name)
+    topic_path = get_topic_path(PROJECT_ID, topic_name)
+
+    if _is_provisioned(topic_path):
+        return topic_path
 
     try:
         publisher.get_topic(request={"topic": topic_path})
         _logger.info(f"Topic {topic_path} already exists")
     except Exception:
-        publisher.create_topic(
-            request={
-                "name": topic_path,
-            },
-            retry=Retry(
-                minimum_backoff="10s",
-                maximum_backoff="600s",
-            ),
-        )
+        try:
+            publisher.create_topic(
+                request={
+                    "name": topic_path,
+                },
+                retry=Retry(
+                    minimum_backoff="10s",
+                    maximum_backoff="600s",
+                ),
+            )
+        except AlreadyExists:
+            # Another instance created it in the meantime
+            pass
+
+    _mark_provisioned(topic_path)
 
     return topic_path
 
@@ -70,7 +269,7 @@ def publish_message(
     attributes: Dict[str, str] = {},
 ) -> Future:
     pubsub_client = get_pubsub_publisher_client()
-    topic_path = get_topic_path("demo-local-development", topic_id)
+    topic_path = get_topic_path(PROJECT_ID, topic_id)
 
     try:
         message_bytes = json.dumps(message_data).encode("utf-8")
@@ -95,18 +294,19 @@ def get_or_create_subscription(
     enable_message_ordering: bool = False,
     ack_deadline_seconds: int = 120,
 ):
+    # Define subscription
+    subscription_name = f"{topic_name}-sub"
+    subscription_path = get_subscription_path(PROJECT_ID, subscription_name)
+
+    if _is_provisioned(subscription_path):
+        return subscription_path
+
     subscriber = get_pubsub_subscriber_client()
     publisher = get_pubsub_publisher_client()
 
     # Define topic
     topic_path = get_or_create_topic(publisher, topic_name)
 
-    # Define subscription
-    subscription_name = f"{topic_name}-sub"
-    subscription_path = subscriber.subscription_path(
-        "demo-local-development", subscription_name
-    )
-
     try:
         subscriber.get_subscription(request={"subscription": subscription_path})
         # _logger.info(f"Subscription {subscription_path} exists")
@@ -125,7 +325,202 @@ def get_or_create_subscription(
                     "ack_deadline_seconds": ack_deadline_seconds,
                 },
             )
+        except AlreadyExists:
+            pass
         except Exception as e:
             _logger.error(f"Error creating subscription {subscription_path}: {e}")
+            return subscription_path
+
+    _mark_provisioned(subscription_path)
 
     return subscription_path
+
+
+def provision_pubsub_resources(
+    topic_names: list[str],
+    subscriptions: list[tuple[str, bool, int]],
+) -> None:
+    """
+    Ensure topics and subscriptions exist up front, e.g. from a deploy step.
+
+    Args:
+        topic_names: Topics to create if missing
+        subscriptions: (topic_name, enable_message_ordering, ack_deadline_seconds)
+    """
+
+    publisher = get_pubsub_publisher_client()
+    for topic_name in topic_names:
+        get_or_create_topic(publisher, topic_name)
+
+    for topic_name, enable_message_ordering, ack_deadline_seconds in subscriptions:
+        get_or_create_subscription(
+            topic_name, enable_message_ordering, ack_deadline_seconds
+        )
+
+
+# Acknowledge and ModifyAckDeadline requests are capped at 512KB
+MAX_ACK_IDS_PER_REQUEST = 1000
+
+
+class AckManager:
+    """
+    Acknowledges pulled messages of one subscription incrementally.
+
+    ack() and nack() buffer ack_ids and send them in batched RPCs on flush(), or as
+    soon as a full request is buffered. Every tracked ack_id that is neither acked
+    nor nacked yet gets its deadline extended from a background thread, so large or
+    slow batches don't expire and get redelivered while they are being processed.
+    """
+
+    def __init__(
+        self,
+        subscriber: pubsub_v1.SubscriberClient,
+        subscription_path: str,
+        ack_deadline_seconds: int,
+        nack_delay_seconds: int = 0,
+    ):
+        self.subscriber = subscriber
+        self.subscription_path = subscription_path
+        self.ack_deadline_seconds = ack_deadline_seconds
+        self.nack_delay_seconds = nack_delay_seconds
+        self.stats = {"acked": 0, "nacked": 0, "extended": 0, "rpcs": 0}
+        self._in_progress: set[str] = set()
+        self._pending_acks: list[str] = []
+        self._pending_nacks: list[str] = []
+        self._lock = threading.Lock()
+        # Held while extending leases and while sending nacks, so an extension
+        # never lands after the nack of the same message
+        self._lease_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._lease_thread: threading.Thread | None = None
+
+    def __enter__(self) -> "AckManager":
+        self._lease_thread = threading.Thread(
+            target=self._extend_leases, name="ack-lease-extension", daemon=True
+        )
+        self._lease_thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def track(self, ack_ids: list[str]) -> None:
+        with self._lock:
+            self._in_progress.update(ack_ids)
+
+    def ack(self, ack_ids: list[str]) -> None:
+        with self._lock:
+            self._in_progress.difference_update(ack_ids)
+            self._pending_acks.extend(ack_ids)
+            flush = len(self._pending_acks) >= MAX_ACK_IDS_PER_REQUEST
+
+        if flush:
+            self.flush()
+
+    def nack(self, ack_ids: list[str]) -> None:
+        with self._lock:
+            self._in_progress.difference_update(ack_ids)
+            self._pending_nacks.extend(ack_ids)
+            flush = len(self._pending_nacks) >= MAX_ACK_IDS_PER_REQUEST
+
+        if flush:
+            self.flush()
+
+    def _count(self, stat: str, value: int) -> None:
+        # Called from the shard threads and the lease thread
+        with self._lock:
+            self.stats[stat] += value
+
+    def _send(self, method: str, ack_ids: list[str], **request: Any) -> int:
+        """
+        Returns:
+            The number of ack_ids whose request failed
+        """
+
+        failed = 0
+        for i in range(0, len(ack_ids), MAX_ACK_IDS_PER_REQUEST):
+            chunk = ack_ids[i : i + MAX_ACK_IDS_PER_REQUEST]
+            try:
+                getattr(self.subscriber, method)(
+                    request={
+                        "subscription": self.subscription_path,
+                        "ack_ids": chunk,
+                        **request,
+                    }
+                )
+                self._count("rpcs", 1)
+            except Exception as e:
+                # Unacked messages are redelivered once their deadline expires
+                _logger.error(
+                    f"Error calling {method} for {len(chunk)} messages on {self.subscription_path}: {e}"
+                )
+                failed += len(chunk)
+
+        return failed
+
+    def flush(self) -> None:
+        with self._lock:
+            acks, self._pending_acks = self._pending_acks, []
+            nacks, self._pending_nacks = self._pending_nacks, []
+
+        if not acks and not nacks:
+            return
+
+        start_time = time.monotonic()
+        failed = 0
+        if acks:
+            failed += self._send("acknowledge", acks)
+            self._count("acked", len(acks))
+
+        if nacks:
+            # A short deadline makes Pub/Sub redeliver without waiting for the
+            # subscription's ack deadline
+            with self._lease_lock:
+                failed += self._send(
+                    "modify_ack_deadline",
+                    nacks,
+                    ack_deadline_seconds=self.nack_delay_seconds,
+                )
+            self._count("nacked", len(nacks))
+
+        record_stage(
+            PIPELINE_STAGE.ACK,
+            time.monotonic() - start_time,
+            len(acks) + len(nacks),
+            errors=failed,
+        )
+
+    def extend_leases(self) -> int:
+        """
+        Extend the deadline of every ack_id that is neither acked nor nacked yet.
+
+        Returns:
+            The number of extended ack_ids
+        """
+
+        with self._lease_lock:
+            # Read under the lease lock, a message nacked after this point has its
+            # nack sent once the extension is done
+            with self._lock:
+                ack_ids = list(self._in_progress)
+
+            if ack_ids:
+                self._send(
+                    "modify_ack_deadline",
+                    ack_ids,
+                    ack_deadline_seconds=self.ack_deadline_seconds,
+                )
+                self._count("extended", len(ack_ids))
+
+        return len(ack_ids)
+
+    def _extend_leases(self) -> None:
+        # Renew halfway through the deadline to leave room for slow RPCs
+        interval = max(1, self.ack_deadline_seconds // 2)
+        while not self._stop_event.wait(interval):
+            self.extend_leases()
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self.flush()
+        _logger.info(f"Ack manager for {self.subscription_path} closed. stats={self.stats}")
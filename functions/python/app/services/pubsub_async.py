@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any
+
+import grpc
+from google.auth.credentials import AnonymousCredentials
+from google.pubsub_v1.services.publisher import PublisherAsyncClient
+from google.pubsub_v1.services.publisher.transports.grpc_asyncio import (
+    PublisherGrpcAsyncIOTransport,
+)
+from google.pubsub_v1.services.subscriber import SubscriberAsyncClient
+from google.pubsub_v1.services.subscriber.transports.grpc_asyncio import (
+    SubscriberGrpcAsyncIOTransport,
+)
+from google.pubsub_v1.types import ReceivedMessage
+
+from app.metrics import PIPELINE_STAGE, record_stage
+from app.services.pubsub import (
+    MAX_ACK_IDS_PER_REQUEST,
+    invalidate_provisioned_path_on_not_found,
+)
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+############################ ASYNC PUB/SUB SERVICES ###############################
+###################################################################################
+# asyncio counterparts of app.services.pubsub on the GAPIC async clients. These
+# have no client side batching: one publish is one RPC, which suits handlers that
+# publish a single message per event. Topics and subscriptions are still
+# provisioned through the sync helpers, which cache their result.
+#
+# gRPC asyncio channels belong to the event loop they were created on, so the
+# clients are kept per loop, like the Firestore AsyncClient.
+###################################################################################
+
+_pubsub_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_pubsub_async_clients_lock = threading.Lock()
+
+
+def _create_async_client(client_class, transport_class):
+    emulator_host = os.environ.get("PUBSUB_EMULATOR_HOST")
+    if not emulator_host:
+        return client_class()
+
+    # The GAPIC clients don't know about the emulator, which only speaks plaintext
+    return client_class(
+        transport=transport_class(
+            channel=grpc.aio.insecure_channel(emulator_host),
+            credentials=AnonymousCredentials(),
+        )
+    )
+
+
+def _get_async_clients() -> dict[str, Any]:
+    loop = asyncio.get_running_loop()
+
+    with _pubsub_async_clients_lock:
+        clients = _pubsub_async_clients.get(loop)
+        if clients is None:
+            clients = {}
+            _pubsub_async_clients[loop] = clients
+        return clients
+
+
+def get_pubsub_publisher_async_client() -> PublisherAsyncClient:
+    """Return the PublisherAsyncClient for the running event loop."""
+
+    clients = _get_async_clients()
+    if "publisher" not in clients:
+        clients["publisher"] = _create_async_client(
+            PublisherAsyncClient, PublisherGrpcAsyncIOTransport
+        )
+    return clients["publisher"]
+
+
+def get_pubsub_subscriber_async_client() -> SubscriberAsyncClient:
+    """Return the SubscriberAsyncClient for the running event loop."""
+
+    clients = _get_async_clients()
+    if "subscriber" not in clients:
+        clients["subscriber"] = _create_async_client(
+            SubscriberAsyncClient, SubscriberGrpcAsyncIOTransport
+        )
+    return clients["subscriber"]
+
+
+async def publish_message_async(
+    topic_path: str,
+    data: bytes,
+    attributes: dict[str, str] | None = None,
+    ordering_key: str = "",
+) -> str:
+    """
+    Returns:
+        The message id
+    """
+
+    publisher = get_pubsub_publisher_async_client()
+    try:
+        response = await publisher.publish(
+            request={
+                "topic": topic_path,
+                "messages": [
+                    {
+                        "data": data,
+                        "attributes": attributes or {},
+                        "ordering_key": ordering_key,
+                    }
+                ],
+            }
+        )
+    except Exception as e:
+        invalidate_provisioned_path_on_not_found(topic_path, e)
+        raise
+
+    return response.message_ids[0]
+
+
+async def pull_messages_async(
+    subscription_path: str, max_messages: int, timeout: float = 30
+) -> list[ReceivedMessage]:
+    subscriber = get_pubsub_subscriber_async_client()
+    try:
+        response = await subscriber.pull(
+            request={"subscription": subscription_path, "max_messages": max_messages},
+            timeout=timeout,
+        )
+    except Exception as e:
+        invalidate_provisioned_path_on_not_found(subscription_path, e)
+        raise
+
+    return list(response.received_messages)
+
+
+class AsyncAckManager:
+    """
+    asyncio version of AckManager.
+
+    Acks and nacks are buffered and sent on flush(), with at most max_concurrency
+    RPCs in flight. A background task extends the leases of tracked messages that
+    are neither acked nor nacked yet. Extensions and nacks hold the same lock, so an
+    extension never lands after a nack's short deadline and undoes it.
+    """
+
+    def __init__(
+        self,
+        subscription_path: str,
+        ack_deadline_seconds: int,
+        nack_delay_seconds: int = 0,
+        max_concurrency: int = 4,
+    ):
+        self.subscription_path = subscription_path
+        self.ack_deadline_seconds = ack_deadline_seconds
+        self.nack_delay_seconds = nack_delay_seconds
+        self.stats = {"acked": 0, "nacked": 0, "extended": 0, "rpcs": 0}
+        self._in_progress: set[str] = set()
+        self._pending_acks: list[str] = []
+        self._pending_nacks: list[str] = []
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._lease_lock = asyncio.Lock()
+        self._lease_task: asyncio.Task | None = None
+
+    async def __aenter__(self) -> "AsyncAckManager":
+        self._lease_task = asyncio.create_task(self._extend_leases())
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    def track(self, ack_ids: list[str]) -> None:
+        self._in_progress.update(ack_ids)
+
+    def ack(self, ack_ids: list[str]) -> None:
+        self._in_progress.difference_update(ack_ids)
+        self._pending_acks.extend(ack_ids)
+
+    def nack(self, ack_ids: list[str]) -> None:
+        self._in_progress.difference_update(ack_ids)
+        self._pending_nacks.extend(ack_ids)
+
+    async def _send_chunk(self, method: str, ack_ids: list[str], **request: Any) -> int:
+        subscriber = get_pubsub_subscriber_async_client()
+        async with self._semaphore:
+            try:
+                await getattr(subscriber, method)(
+                    request={
+                        "subscription": self.subscription_path,
+                        "ack_ids": ack_ids,
+                        **request,
+                    }
+                )
+                self.stats["rpcs"] += 1
+                return 0
+            except Exception as e:
+                # Unacked messages are redelivered once their deadline expires
+                _logger.error(
+                    f"Error calling {method} for {len(ack_ids)} messages on {self.subscription_path}: {e}"
+                )
+                return len(ack_ids)
+
+    def _send(self, method: str, ack_ids: list[str], **request: Any) -> list:
+        return [
+            self._send_chunk(
+                method, ack_ids[i : i + MAX_ACK_IDS_PER_REQUEST], **request
+            )
+            for i in range(0, len(ack_ids), MAX_ACK_IDS_PER_REQUEST)
+        ]
+
+    async def flush(self) -> None:
+        acks, self._pending_acks = self._pending_acks, []
+        nacks, self._pending_nacks = self._pending_nacks, []
+        if not acks and not nacks:
+            return
+
+        start_time = time.monotonic()
+        failed_acks, failed_nacks = await asyncio.gather(
+            asyncio.gather(*self._send("acknowledge", acks)),
+            self._send_nacks(nacks),
+        )
+        self.stats["acked"] += len(acks)
+        self.stats["nacked"] += len(nacks)
+        record_stage(
+            PIPELINE_STAGE.ACK,
+            time.monotonic() - start_time,
+            len(acks) + len(nacks),
+            errors=sum(failed_acks) + sum(failed_nacks),
+        )
+
+    async def _send_nacks(self, nacks: list[str]) -> list[int]:
+        # A short deadline makes Pub/Sub redeliver without waiting for the
+        # subscription's ack deadline
+        async with self._lease_lock:
+            return await asyncio.gather(
+                *self._send(
+                    "modify_ack_deadline",
+                    nacks,
+                    ack_deadline_seconds=self.nack_delay_seconds,
+                )
+            )
+
+    async def extend_leases(self) -> int:
+        """
+        Extend the deadline of every ack_id that is neither acked nor nacked yet.
+
+        Returns:
+            The number of extended ack_ids
+        """
+
+        async with self._lease_lock:
+            # Read under the lease lock, a message nacked after this point has its
+            # nack sent once the extension is done
+            ack_ids = list(self._in_progress)
+            if ack_ids:
+                await asyncio.gather(
+                    *self._send(
+                        "modify_ack_deadline",
+                        ack_ids,
+                        ack_deadline_seconds=self.ack_deadline_seconds,
+                    )
+                )
+                self.stats["extended"] += len(ack_ids)
+
+        return len(ack_ids)
+
+    async def _extend_leases(self) -> None:
+        # Renew halfway through the deadline to leave room for slow RPCs
+        interval = max(1, self.ack_deadline_seconds // 2)
+        while True:
+            await asyncio.sleep(interval)
+            await self.extend_leases()
+
+    async def close(self) -> None:
+        if self._lease_task is not None:
+            self._lease_task.cancel()
+            self._lease_task = None
+        await self.flush()
+        _logger.info(
+            f"Async ack manager for {self.subscription_path} closed. stats={self.stats}"
+        )
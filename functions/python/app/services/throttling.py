@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from pydantic import BaseModel
+
+_logger = logging.getLogger(__name__)
+
+
+class AdaptiveBatchSize:
+    """
+    Self-tuning number of messages to pull per batch.
+
+    After every batch the per-message latency is used to estimate how many messages
+    fit in the target latency. The size moves towards that estimate by at most a
+    factor of two per batch, and only grows when the last pull came back full,
+    since a partial pull says nothing about a bigger one.
+    """
+
+    def __init__(
+        self,
+        initial_size: int,
+        min_size: int,
+        max_size: int,
+        target_latency_sec: float,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency_sec = target_latency_sec
+        self._size = max(min_size, min(max_size, initial_size))
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        return self._size
+
+    def record(self, batch_size: int, latency_sec: float) -> int:
+        with self._lock:
+            if batch_size <= 0:
+                return self._size
+
+            if latency_sec <= 0:
+                estimate = self._size * 2
+            else:
+                estimate = int(batch_size * self.target_latency_sec / latency_sec)
+
+            if estimate > self._size and batch_size < self._size:
+                estimate = self._size
+
+            new_size = max(self._size // 2, min(self._size * 2, estimate))
+            new_size = max(self.min_size, min(self.max_size, new_size))
+
+            if new_size != self._size:
+                _logger.info(
+                    f"Adjusted batch size {self._size} -> {new_size}. batch_size={batch_size} latency={latency_sec:.3f}s"
+                )
+                self._size = new_size
+
+            return self._size
+
+
+class TokenBucketRateLimiter:
+    """
+    Token bucket with AIMD rate control.
+
+    acquire() blocks until the requested tokens are available. Callers report
+    throttling errors from the target with on_throttled(), which cuts the rate by
+    decrease_factor (at most once per decrease_cooldown_sec), and successful calls
+    with on_success(), which adds increase_step ops/sec back up to max_rate.
+    """
+
+    def __init__(
+        self,
+        rate_per_sec: float,
+        burst: int,
+        min_rate_per_sec: float = 1,
+        max_rate_per_sec: float | None = None,
+        increase_step: float = 5,
+        decrease_factor: float = 0.5,
+        decrease_cooldown_sec: float = 1,
+    ):
+        self.burst = burst
+        self.min_rate_per_sec = min_rate_per_sec
+        self.max_rate_per_sec = max_rate_per_sec or rate_per_sec
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown_sec = decrease_cooldown_sec
+        self._rate = rate_per_sec
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._last_decrease_at = float("-inf")
+        self._lock = threading.Lock()
+
+    @property
+    def current_rate(self) -> float:
+        return self._rate
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated_at) * self._rate
+        )
+        self._updated_at = now
+
+    def acquire(self, tokens: int = 1) -> float:
+        """
+        Take tokens from the bucket, sleeping until they are paid for.
+
+        Requests bigger than the burst are allowed and leave the bucket in debt,
+        which the following callers wait out.
+
+        Returns:
+            Seconds spent waiting
+        """
+
+        wait_sec = self._reserve(tokens)
+        if wait_sec > 0:
+            time.sleep(wait_sec)
+
+        return wait_sec
+
+    async def acquire_async(self, tokens: int = 1) -> float:
+        """acquire() for coroutines, waits without blocking the event loop."""
+
+        wait_sec = self._reserve(tokens)
+        if wait_sec > 0:
+            await asyncio.sleep(wait_sec)
+
+        return wait_sec
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._rate = min(self.max_rate_per_sec, self._rate + self.increase_step)
+
+    def on_throttled(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease_at < self.decrease_cooldown_sec:
+                return
+
+            self._refill(now)
+            self._last_decrease_at = now
+            previous_rate = self._rate
+            self._rate = max(self.min_rate_per_sec, self._rate * self.decrease_factor)
+
+        _logger.warning(
+            f"Throttled by the target, rate {previous_rate:.1f} -> {self._rate:.1f} ops/sec"
+        )
+
+
+class HeldLease(BaseModel):
+    """A lease another process holds, as seen from the process that was denied it."""
+
+    # Seconds until the lease expires
+    remaining_sec: float
+    # Seconds since the holder acquired it, and ran the action
+    age_sec: float
+
+
+class Debouncer:
+    """
+    Runs an action at most once per window, on the leading and trailing edge.
+
+    The first call after a quiet window runs the action right away. The first call
+    inside the window waits until it ends and then runs one trailing action for
+    every call made meanwhile, which return right away. So the action always runs
+    after the last call of a burst, and inside a caller instead of a background
+    timer, which may never fire once a serverless invocation has returned. flush() runs a pending
+    trailing call immediately and is meant for shutdown.
+
+    acquire_lease optionally coordinates several processes: it returns None when this
+    process may run the action, or the HeldLease of the current holder. A denied
+    trailing run is only dropped when the holder took its lease after our last call,
+    otherwise it waits for the lease to expire and tries again.
+    """
+
+    def __init__(
+        self,
+        action: Callable[[], Any],
+        window_sec: float,
+        acquire_lease: Callable[[], HeldLease | None] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.action = action
+        self.window_sec = window_sec
+        self.acquire_lease = acquire_lease
+        self.stats = {"runs": 0, "debounced": 0}
+        self._clock = clock
+        self._sleep = sleep
+        self._last_run_at = float("-inf")
+        self._last_call_at = float("-inf")
+        self._pending = False
+        # Whether a caller is waiting to run the trailing action
+        self._waiting = False
+        self._lock = threading.Lock()
+
+    def _try_acquire_lease(self) -> HeldLease | None:
+        if self.acquire_lease is None:
+            return None
+
+        try:
+            return self.acquire_lease()
+        except Exception as e:
+            # Running the action too often is better than not running it at all
+            _logger.error(f"Error acquiring debounce lease, running anyway: {e}")
+            return None
+
+    def _run(self) -> Any:
+        self.stats["runs"] += 1
+        return self.action()
+
+    def trigger(self) -> Any | None:
+        """
+        Blocks for up to a window when this call has to run the trailing action.
+
+        Returns:
+            The action's result when this call ran it, None when another call's run
+            covers it
+
+        Raises:
+            Whatever the action raised when this call ran it
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._last_call_at = now
+            debounced = self._pending or now - self._last_run_at < self.window_sec
+            if debounced:
+                if not self._defer():
+                    return None
+                delay_sec = self._last_run_at + self.window_sec - now
+            else:
+                self._last_run_at = now
+
+        if not debounced:
+            held_lease = self._try_acquire_lease()
+            if held_lease is None:
+                return self._run()
+
+            with self._lock:
+                if not self._defer():
+                    return None
+            delay_sec = held_lease.remaining_sec
+
+        return self._run_trailing(delay_sec)
+
+    def _defer(self) -> bool:
+        """
+        Must be called with the lock held.
+
+        Returns:
+            Whether the caller has to wait and run the trailing action
+        """
+
+        self.stats["debounced"] += 1
+        self._pending = True
+        if self._waiting:
+            return False
+        self._waiting = True
+        return True
+
+    def _run_trailing(self, delay_sec: float) -> Any | None:
+        while True:
+            self._sleep(max(0.0, delay_sec))
+            with self._lock:
+                if not self._pending:
+                    # flush() ran the action after our call
+                    self._waiting = False
+                    return None
+
+                now = self._clock()
+                delay_sec = self._last_run_at + self.window_sec - now
+                if delay_sec <= 0:
+                    # Calls from now on need a trailing run of their own
+                    self._pending = False
+                    self._waiting = False
+                    self._last_run_at = now
+                    last_call_at = self._last_call_at
+                    break
+
+        return self._run_with_lease(last_call_at)
+
+    def _run_with_lease(self, last_call_at: float) -> Any | None:
+        while True:
+            held_lease = self._try_acquire_lease()
+            if held_lease is None:
+                return self._run()
+
+            if self._clock() - held_lease.age_sec >= last_call_at:
+                # The holder ran the action after our last call, which covers it
+                return None
+
+            self._sleep(max(0.0, held_lease.remaining_sec))
+
+    def flush(self) -> None:
+        with self._lock:
+            pending = self._pending
+            self._pending = False
+
+        if pending:
+            self._run()
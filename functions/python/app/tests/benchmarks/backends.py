@@ -0,0 +1,464 @@
+import concurrent.futures
+import copy
+import itertools
+import random
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable
+
+from google.api_core.exceptions import AlreadyExists, NotFound, ServiceUnavailable
+
+###################################################################################
+############################ IN-MEMORY BACKENDS ###################################
+###################################################################################
+# Stand-ins for the Firestore client and the Pub/Sub publisher and subscriber,
+# covering the calls the products sync pipeline makes. Plug them in with
+# set_firestore_client() and set_pubsub_clients(). Every RPC goes through a
+# FaultInjector, which counts it, sleeps for the configured latency and fails a
+# share of the calls.
+###################################################################################
+
+
+class FaultInjector:
+    def __init__(
+        self,
+        latency_sec: float = 0.0,
+        jitter_sec: float = 0.0,
+        error_rate: float = 0.0,
+        error_factory: Callable[[str], Exception] = lambda method: ServiceUnavailable(
+            f"Injected error in {method}"
+        ),
+        seed: int | None = None,
+    ):
+        self.latency_sec = latency_sec
+        self.jitter_sec = jitter_sec
+        self.error_rate = error_rate
+        self.error_factory = error_factory
+        self.rpcs: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self, method: str) -> None:
+        with self._lock:
+            self.rpcs[method] += 1
+            latency_sec = self.latency_sec + self._random.uniform(0, self.jitter_sec)
+            fail = self._random.random() < self.error_rate
+
+        if latency_sec > 0:
+            time.sleep(latency_sec)
+
+        if fail:
+            with self._lock:
+                self.errors[method] += 1
+            raise self.error_factory(method)
+
+
+###################################################################################
+################################# FIRESTORE #######################################
+###################################################################################
+
+
+class InMemoryDocumentSnapshot:
+    def __init__(
+        self,
+        reference: "InMemoryDocumentReference",
+        data: dict[str, Any] | None,
+        update_time: datetime | None,
+    ):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self) -> dict[str, Any] | None:
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path: str) -> Any:
+        return (self._data or {}).get(field_path)
+
+
+class InMemoryDocumentReference:
+    def __init__(self, client: "InMemoryFirestoreClient", collection_name: str, id: str):
+        self._client = client
+        self.collection_name = collection_name
+        self.id = id
+        self.path = f"{collection_name}/{id}"
+
+    def get(self, **_) -> InMemoryDocumentSnapshot:
+        self._client.faults.call("GetDocument")
+        return self._client._snapshot(self)
+
+    def set(self, data: dict[str, Any], **_) -> None:
+        self._client.faults.call("Commit")
+        self._client._apply([(self, data)])
+
+    def update(self, data: dict[str, Any], **_) -> None:
+        self._client.faults.call("Commit")
+        current = self._client._snapshot(self).to_dict()
+        if current is None:
+            raise NotFound(f"No document to update: {self.path}")
+        self._client._apply([(self, {**current, **data})])
+
+    def delete(self, **_) -> None:
+        self._client.faults.call("Commit")
+        self._client._apply([(self, None)])
+
+
+class InMemoryCollectionReference:
+    def __init__(self, client: "InMemoryFirestoreClient", name: str):
+        self._client = client
+        self.id = name
+
+    def document(self, document_id: str) -> InMemoryDocumentReference:
+        return InMemoryDocumentReference(self._client, self.id, document_id)
+
+
+class InMemoryWriteBatch:
+    def __init__(self, client: "InMemoryFirestoreClient"):
+        self._client = client
+        self._writes: list[tuple[InMemoryDocumentReference, dict[str, Any] | None]] = []
+
+    def set(self, reference: InMemoryDocumentReference, data: dict[str, Any], **_) -> None:
+        self._writes.append((reference, data))
+
+    def delete(self, reference: InMemoryDocumentReference, **_) -> None:
+        self._writes.append((reference, None))
+
+    def commit(self, **_) -> list:
+        # Atomic like the real thing, an injected error applies nothing
+        self._client.faults.call("Commit")
+        self._client._apply(self._writes)
+        return []
+
+
+class InMemoryFirestoreClient:
+    """
+    Covers collection().document() get/set/update/delete, get_all and batch().
+
+    on_write hooks are called with (collection_name, document_id, data or None)
+    after every applied write, under the client's lock.
+    """
+
+    def __init__(self, faults: FaultInjector | None = None):
+        self.faults = faults or FaultInjector()
+        self.on_write: list[Callable[[str, str, dict[str, Any] | None], None]] = []
+        # collection -> id -> (data, update_time)
+        self._documents: dict[str, dict[str, tuple[dict[str, Any], datetime]]] = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name: str) -> InMemoryCollectionReference:
+        return InMemoryCollectionReference(self, name)
+
+    def batch(self) -> InMemoryWriteBatch:
+        return InMemoryWriteBatch(self)
+
+    def get_all(self, references, field_paths=None, **_):
+        self.faults.call("BatchGetDocuments")
+        snapshots = [self._snapshot(reference) for reference in references]
+        if field_paths is not None:
+            for snapshot in snapshots:
+                if snapshot.exists:
+                    snapshot._data = {
+                        field: value
+                        for field, value in snapshot._data.items()
+                        if field in field_paths
+                    }
+        return iter(snapshots)
+
+    def _snapshot(self, reference: InMemoryDocumentReference) -> InMemoryDocumentSnapshot:
+        with self._lock:
+            data, update_time = self._documents.get(reference.collection_name, {}).get(
+                reference.id, (None, None)
+            )
+            return InMemoryDocumentSnapshot(reference, copy.deepcopy(data), update_time)
+
+    def _apply(
+        self, writes: list[tuple[InMemoryDocumentReference, dict[str, Any] | None]]
+    ) -> None:
+        with self._lock:
+            update_time = datetime.now(timezone.utc)
+            for reference, data in writes:
+                collection = self._documents.setdefault(reference.collection_name, {})
+                if data is None:
+                    collection.pop(reference.id, None)
+                else:
+                    collection[reference.id] = (copy.deepcopy(data), update_time)
+
+                for hook in self.on_write:
+                    hook(reference.collection_name, reference.id, data)
+
+    def write_without_rpc(
+        self, collection_name: str, document_id: str, data: dict[str, Any] | None
+    ) -> tuple[InMemoryDocumentSnapshot, InMemoryDocumentSnapshot]:
+        """
+        Write as a user would, outside the pipeline's RPC counts.
+
+        Returns:
+            (snapshot before, snapshot after), to build the trigger event from
+        """
+
+        reference = self.collection(collection_name).document(document_id)
+        before = self._snapshot(reference)
+        self._apply([(reference, data)])
+        return before, self._snapshot(reference)
+
+
+class InMemoryAsyncDocumentReference(InMemoryDocumentReference):
+    async def get(self, **kwargs) -> InMemoryDocumentSnapshot:
+        return super().get(**kwargs)
+
+    async def set(self, data: dict[str, Any], **kwargs) -> None:
+        super().set(data, **kwargs)
+
+    async def update(self, data: dict[str, Any], **kwargs) -> None:
+        super().update(data, **kwargs)
+
+    async def delete(self, **kwargs) -> None:
+        super().delete(**kwargs)
+
+
+class InMemoryAsyncCollectionReference(InMemoryCollectionReference):
+    def document(self, document_id: str) -> InMemoryAsyncDocumentReference:
+        return InMemoryAsyncDocumentReference(self._client, self.id, document_id)
+
+
+class InMemoryAsyncWriteBatch(InMemoryWriteBatch):
+    async def commit(self, **kwargs) -> list:
+        return super().commit(**kwargs)
+
+
+class InMemoryAsyncFirestoreClient:
+    """The AsyncClient calls of the pipeline, on the documents of an InMemoryFirestoreClient."""
+
+    def __init__(self, client: InMemoryFirestoreClient):
+        self.client = client
+
+    def collection(self, name: str) -> InMemoryAsyncCollectionReference:
+        return InMemoryAsyncCollectionReference(self.client, name)
+
+    def batch(self) -> InMemoryAsyncWriteBatch:
+        return InMemoryAsyncWriteBatch(self.client)
+
+    async def get_all(self, references, field_paths=None, **kwargs):
+        for snapshot in self.client.get_all(references, field_paths, **kwargs):
+            yield snapshot
+
+
+###################################################################################
+################################## PUB/SUB ########################################
+###################################################################################
+
+
+class _Subscription:
+    def __init__(self, topic_path: str, ack_deadline_seconds: int):
+        self.topic_path = topic_path
+        self.ack_deadline_seconds = ack_deadline_seconds
+        self.available: deque = deque()
+        # ack_id -> (message, monotonic deadline)
+        self.leased: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+
+
+class InMemoryPubsub:
+    """Topics and subscriptions shared by the in-memory publisher and subscriber."""
+
+    def __init__(self, faults: FaultInjector | None = None):
+        self.faults = faults or FaultInjector()
+        self.topics: set[str] = set()
+        self.subscriptions: dict[str, _Subscription] = {}
+        # topic_path -> callbacks called with every published message
+        self.on_publish: dict[str, list[Callable[[Any], None]]] = {}
+        self._message_ids = itertools.count(1)
+        self._ack_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(
+        self, topic_path: str, data: bytes, ordering_key: str, attributes: dict[str, str]
+    ) -> str:
+        with self._lock:
+            if topic_path not in self.topics:
+                raise NotFound(f"Topic not found: {topic_path}")
+
+            message = SimpleNamespace(
+                data=data,
+                attributes=attributes,
+                message_id=str(next(self._message_ids)),
+                publish_time=datetime.now(timezone.utc),
+                ordering_key=ordering_key,
+            )
+            for subscription in self.subscriptions.values():
+                if subscription.topic_path == topic_path:
+                    subscription.available.append(message)
+            hooks = list(self.on_publish.get(topic_path, []))
+
+        for hook in hooks:
+            hook(message)
+
+        return message.message_id
+
+    def _expire_leases(self, subscription: _Subscription) -> None:
+        # Must be called with the lock held
+        now = time.monotonic()
+        expired = [
+            ack_id
+            for ack_id, (_, deadline) in subscription.leased.items()
+            if deadline <= now
+        ]
+        for ack_id in reversed(expired):
+            message, _ = subscription.leased.pop(ack_id)
+            subscription.available.appendleft(message)
+
+    def pull(self, subscription_path: str, max_messages: int) -> list:
+        with self._lock:
+            subscription = self._get_subscription(subscription_path)
+            self._expire_leases(subscription)
+
+            received_messages = []
+            deadline = time.monotonic() + subscription.ack_deadline_seconds
+            while subscription.available and len(received_messages) < max_messages:
+                message = subscription.available.popleft()
+                ack_id = f"ack-{next(self._ack_ids)}"
+                subscription.leased[ack_id] = (message, deadline)
+                received_messages.append(
+                    SimpleNamespace(ack_id=ack_id, message=message, delivery_attempt=0)
+                )
+
+            return received_messages
+
+    def acknowledge(self, subscription_path: str, ack_ids: list[str]) -> None:
+        with self._lock:
+            subscription = self._get_subscription(subscription_path)
+            for ack_id in ack_ids:
+                subscription.leased.pop(ack_id, None)
+
+    def modify_ack_deadline(
+        self, subscription_path: str, ack_ids: list[str], ack_deadline_seconds: int
+    ) -> None:
+        with self._lock:
+            subscription = self._get_subscription(subscription_path)
+            deadline = time.monotonic() + ack_deadline_seconds
+            for ack_id in ack_ids:
+                if ack_id in subscription.leased:
+                    message, _ = subscription.leased[ack_id]
+                    subscription.leased[ack_id] = (message, deadline)
+            self._expire_leases(subscription)
+
+    def backlog(self, subscription_path: str) -> int:
+        with self._lock:
+            subscription = self._get_subscription(subscription_path)
+            return len(subscription.available) + len(subscription.leased)
+
+    def _get_subscription(self, subscription_path: str) -> _Subscription:
+        subscription = self.subscriptions.get(subscription_path)
+        if subscription is None:
+            raise NotFound(f"Subscription not found: {subscription_path}")
+        return subscription
+
+
+class InMemoryPublisherClient:
+    """
+    Publishes in the background like the real client, publish() returns a future
+    that resolves once the Publish RPC went through.
+    """
+
+    def __init__(self, pubsub: InMemoryPubsub, max_workers: int = 4):
+        self.pubsub = pubsub
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="in-memory-publisher"
+        )
+
+    def _publish(
+        self, topic_path: str, data: bytes, ordering_key: str, attributes: dict[str, str]
+    ) -> str:
+        self.pubsub.faults.call("Publish")
+        return self.pubsub.publish(topic_path, data, ordering_key, attributes)
+
+    def publish(
+        self, topic: str, data: bytes, ordering_key: str = "", **attributes: str
+    ) -> concurrent.futures.Future:
+        return self._executor.submit(
+            self._publish, topic, data, ordering_key, attributes
+        )
+
+    def resume_publish(self, topic: str, ordering_key: str) -> None:
+        pass
+
+    def get_topic(self, request: dict, **_) -> SimpleNamespace:
+        self.pubsub.faults.call("GetTopic")
+        if request["topic"] not in self.pubsub.topics:
+            raise NotFound(f"Topic not found: {request['topic']}")
+        return SimpleNamespace(name=request["topic"])
+
+    def create_topic(self, request: dict, **_) -> SimpleNamespace:
+        self.pubsub.faults.call("CreateTopic")
+        with self.pubsub._lock:
+            if request["name"] in self.pubsub.topics:
+                raise AlreadyExists(f"Topic already exists: {request['name']}")
+            self.pubsub.topics.add(request["name"])
+        return SimpleNamespace(name=request["name"])
+
+    def stop(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class InMemorySubscriberClient:
+    def __init__(self, pubsub: InMemoryPubsub):
+        self.pubsub = pubsub
+
+    def pull(self, request: dict, **_) -> SimpleNamespace:
+        self.pubsub.faults.call("Pull")
+        return SimpleNamespace(
+            received_messages=self.pubsub.pull(
+                request["subscription"], request["max_messages"]
+            )
+        )
+
+    def acknowledge(self, request: dict, **_) -> None:
+        self.pubsub.faults.call("Acknowledge")
+        self.pubsub.acknowledge(request["subscription"], request["ack_ids"])
+
+    def modify_ack_deadline(self, request: dict, **_) -> None:
+        self.pubsub.faults.call("ModifyAckDeadline")
+        self.pubsub.modify_ack_deadline(
+            request["subscription"], request["ack_ids"], request["ack_deadline_seconds"]
+        )
+
+    def get_subscription(self, request: dict, **_) -> SimpleNamespace:
+        self.pubsub.faults.call("GetSubscription")
+        self.pubsub._get_subscription(request["subscription"])
+        return SimpleNamespace(name=request["subscription"])
+
+    def create_subscription(self, request: dict, **_) -> SimpleNamespace:
+        self.pubsub.faults.call("CreateSubscription")
+        with self.pubsub._lock:
+            if request["name"] in self.pubsub.subscriptions:
+                raise AlreadyExists(f"Subscription already exists: {request['name']}")
+            if request["topic"] not in self.pubsub.topics:
+                raise NotFound(f"Topic not found: {request['topic']}")
+            self.pubsub.subscriptions[request["name"]] = _Subscription(
+                request["topic"], request.get("ack_deadline_seconds", 10)
+            )
+        return SimpleNamespace(name=request["name"])
+
+    def close(self) -> None:
+        pass
+
+
+class InMemorySubscriberAsyncClient:
+    """The SubscriberAsyncClient calls of the pipeline, on an InMemorySubscriberClient."""
+
+    def __init__(self, pubsub: InMemoryPubsub):
+        self.subscriber = InMemorySubscriberClient(pubsub)
+
+    async def pull(self, request: dict, **kwargs) -> SimpleNamespace:
+        return self.subscriber.pull(request, **kwargs)
+
+    async def acknowledge(self, request: dict, **kwargs) -> None:
+        self.subscriber.acknowledge(request, **kwargs)
+
+    async def modify_ack_deadline(self, request: dict, **kwargs) -> None:
+        self.subscriber.modify_ack_deadline(request, **kwargs)
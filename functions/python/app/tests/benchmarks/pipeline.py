@@ -0,0 +1,303 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any
+
+from app.handlers.products_sync import (
+    BULK_TOPIC_NAME,
+    TRIGGER_TOPIC_NAME,
+    products_sync_bulk_handler,
+    products_sync_handler,
+    provision_products_sync_resources,
+)
+from app.metrics import get_metrics_snapshot, percentile, reset_metrics
+from app.models.product import (
+    FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+)
+from app.services.firestore import set_firestore_client
+from app.services.product.changes import get_change_filter_stats
+from app.services.product.content_hash import get_content_hash_stats
+from app.services.product.sync_lag import SYNC_LAG_METRIC
+from app.services.pubsub import (
+    PROJECT_ID,
+    get_subscription_path,
+    get_topic_path,
+    set_pubsub_clients,
+    shutdown_pubsub_clients,
+)
+from app.tests.benchmarks.backends import (
+    FaultInjector,
+    InMemoryFirestoreClient,
+    InMemoryPublisherClient,
+    InMemoryPubsub,
+    InMemorySubscriberClient,
+)
+
+###################################################################################
+# Drives synthetic product writes through products_sync_handler and
+# products_sync_bulk_handler on the in-memory backends, no emulator needed.
+# Every trigger message starts a bulk run, one at a time like max_instances=1.
+#
+# Reports throughput, the latency from a product's last relevant write until
+# other_product_model reflects it, and the RPCs per backend. Run it with:
+#   python -m app.tests.benchmarks.pipeline --products 500 --rate 500
+###################################################################################
+
+
+def create_event_schedule(
+    num_products: int,
+    updates_per_product: int,
+    noop_update_ratio: float,
+    delete_ratio: float,
+    seed: int,
+) -> list[tuple[str, str]]:
+    """
+    Returns:
+        (product_id, "create" | "update" | "noop" | "delete") in emission order,
+        phase by phase so that every product's writes stay in order
+    """
+
+    rng = random.Random(seed)
+    product_ids = [f"product-{i}" for i in range(num_products)]
+
+    phases = [[(product_id, "create") for product_id in product_ids]]
+    for _ in range(updates_per_product):
+        phases.append(
+            [
+                (product_id, "noop" if rng.random() < noop_update_ratio else "update")
+                for product_id in product_ids
+            ]
+        )
+    phases.append(
+        [
+            (product_id, "delete")
+            for product_id in product_ids
+            if rng.random() < delete_ratio
+        ]
+    )
+
+    schedule = []
+    for phase in phases:
+        rng.shuffle(phase)
+        schedule.extend(phase)
+    return schedule
+
+
+class ConvergenceTracker:
+    """Records when other_product_model catches up with each product's last relevant write."""
+
+    def __init__(self):
+        # product_id -> (expected title or None when deleted, emitted at)
+        self.expected: dict[str, tuple[str | None, float]] = {}
+        self.converged: set[str] = set()
+        self.latencies: list[float] = []
+        self._lock = threading.Lock()
+
+    def expect(self, product_id: str, title: str | None) -> None:
+        with self._lock:
+            self.expected[product_id] = (title, time.monotonic())
+            self.converged.discard(product_id)
+
+    def on_write(self, collection_name: str, document_id: str, data: dict | None) -> None:
+        if collection_name != OTHER_PRODUCT_MODEL_COLLECTION_NAME:
+            return
+
+        with self._lock:
+            expected = self.expected.get(document_id)
+            if expected is None or document_id in self.converged:
+                return
+
+            title, emitted_at = expected
+            if (data is None and title is None) or (
+                data is not None and data.get("title") == title
+            ):
+                self.converged.add(document_id)
+                self.latencies.append(time.monotonic() - emitted_at)
+
+    def is_converged(self) -> bool:
+        with self._lock:
+            return len(self.converged) == len(self.expected)
+
+
+def run_pipeline_benchmark(
+    num_products: int = 200,
+    events_per_sec: float = 500,
+    updates_per_product: int = 2,
+    noop_update_ratio: float = 0.2,
+    delete_ratio: float = 0.1,
+    producer_concurrency: int = 10,
+    firestore_latency_sec: float = 0.005,
+    pubsub_latency_sec: float = 0.002,
+    firestore_error_rate: float = 0.0,
+    pubsub_error_rate: float = 0.0,
+    timeout_sec: float = 120,
+    seed: int = 0,
+) -> dict[str, Any]:
+    firestore_client = InMemoryFirestoreClient(
+        FaultInjector(
+            firestore_latency_sec, firestore_latency_sec, firestore_error_rate, seed=seed
+        )
+    )
+    pubsub = InMemoryPubsub(
+        FaultInjector(
+            pubsub_latency_sec, pubsub_latency_sec, pubsub_error_rate, seed=seed
+        )
+    )
+    publisher = InMemoryPublisherClient(pubsub)
+    set_firestore_client(firestore_client)
+    set_pubsub_clients(publisher, InMemorySubscriberClient(pubsub))
+    provision_products_sync_resources()
+    reset_metrics()
+
+    tracker = ConvergenceTracker()
+    firestore_client.on_write.append(tracker.on_write)
+
+    # Each trigger starts a bulk run, triggers that arrive during a run start one more
+    trigger_event = threading.Event()
+    stop_event = threading.Event()
+    pubsub.on_publish.setdefault(
+        get_topic_path(PROJECT_ID, TRIGGER_TOPIC_NAME), []
+    ).append(lambda _message: trigger_event.set())
+    bulk_runs = 0
+
+    def run_bulk_consumer() -> None:
+        nonlocal bulk_runs
+        while not stop_event.is_set():
+            if trigger_event.wait(0.05):
+                trigger_event.clear()
+                bulk_runs += 1
+                products_sync_bulk_handler(SimpleNamespace(id=f"trigger-{bulk_runs}"))
+
+    consumer = threading.Thread(target=run_bulk_consumer, name="bulk-consumer")
+    consumer.start()
+
+    schedule = create_event_schedule(
+        num_products, updates_per_product, noop_update_ratio, delete_ratio, seed
+    )
+    versions: dict[str, int] = {}
+    handler_errors = 0
+    start_time = time.monotonic()
+
+    def handle(event: SimpleNamespace) -> None:
+        nonlocal handler_errors
+        try:
+            products_sync_handler(event)
+        except Exception as e:
+            handler_errors += 1
+            logging.getLogger(__name__).error(f"products_sync_handler failed: {e}")
+
+    with concurrent.futures.ThreadPoolExecutor(producer_concurrency) as producers:
+        for i, (product_id, kind) in enumerate(schedule):
+            delay = start_time + i / events_per_sec - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            if kind == "delete":
+                data, title = None, None
+            else:
+                if kind != "noop":
+                    versions[product_id] = versions.get(product_id, 0) + 1
+                title = f"{product_id} v{versions[product_id]}"
+                data = {"id": product_id, "title": title, "updatedAt": time.time()}
+
+            if kind != "noop":
+                tracker.expect(product_id, title)
+            before, after = firestore_client.write_without_rpc(
+                FIRESTORE_PRODUCTS_COLLECTION_NAME, product_id, data
+            )
+            producers.submit(
+                handle,
+                SimpleNamespace(
+                    id=f"event-{i}",
+                    time=datetime.now(timezone.utc),
+                    data=SimpleNamespace(
+                        before=before if before.exists else None,
+                        after=after if after.exists else None,
+                    ),
+                ),
+            )
+        emitted_at = time.monotonic()
+
+    while not tracker.is_converged() and time.monotonic() - start_time < timeout_sec:
+        time.sleep(0.01)
+    converged_at = time.monotonic()
+
+    stop_event.set()
+    consumer.join()
+    shutdown_pubsub_clients()
+    set_pubsub_clients()
+    set_firestore_client(None)
+
+    elapsed_sec = converged_at - start_time
+    metrics = get_metrics_snapshot()
+    return {
+        "events": len(schedule),
+        "products": num_products,
+        "converged": len(tracker.converged),
+        "handler_errors": handler_errors,
+        "bulk_runs": bulk_runs,
+        "elapsed_sec": round(elapsed_sec, 3),
+        "emit_rate": round(len(schedule) / max(emitted_at - start_time, 1e-9), 1),
+        "throughput_events_per_sec": round(len(schedule) / max(elapsed_sec, 1e-9), 1),
+        "latency_ms": {
+            f"p{pct}": round(percentile(tracker.latencies, pct) * 1000, 1)
+            for pct in (50, 95, 99, 100)
+        },
+        "bulk_backlog": pubsub.backlog(
+            get_subscription_path(PROJECT_ID, f"{BULK_TOPIC_NAME}-sub")
+        ),
+        "firestore_rpcs": dict(firestore_client.faults.rpcs),
+        "pubsub_rpcs": dict(pubsub.faults.rpcs),
+        "injected_errors": dict(
+            firestore_client.faults.errors + pubsub.faults.errors
+        ),
+        "change_filter": get_change_filter_stats(),
+        "content_hash": get_content_hash_stats(),
+        "stages": metrics["stages"],
+        "sync_lag_sec": metrics["histograms"].get(SYNC_LAG_METRIC, {}),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=500, help="events per second")
+    parser.add_argument("--updates", type=int, default=2, help="updates per product")
+    parser.add_argument("--noop-ratio", type=float, default=0.2)
+    parser.add_argument("--delete-ratio", type=float, default=0.1)
+    parser.add_argument("--producers", type=int, default=10)
+    parser.add_argument("--firestore-latency", type=float, default=0.005)
+    parser.add_argument("--pubsub-latency", type=float, default=0.002)
+    parser.add_argument("--firestore-error-rate", type=float, default=0.0)
+    parser.add_argument("--pubsub-error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print(
+        json.dumps(
+            run_pipeline_benchmark(
+                num_products=args.products,
+                events_per_sec=args.rate,
+                updates_per_product=args.updates,
+                noop_update_ratio=args.noop_ratio,
+                delete_ratio=args.delete_ratio,
+                producer_concurrency=args.producers,
+                firestore_latency_sec=args.firestore_latency,
+                pubsub_latency_sec=args.pubsub_latency,
+                firestore_error_rate=args.firestore_error_rate,
+                pubsub_error_rate=args.pubsub_error_rate,
+                timeout_sec=args.timeout,
+                seed=args.seed,
+            ),
+            indent=2,
+        )
+    )
@@ -0,0 +1,91 @@
+import json
+import timeit
+from datetime import datetime, timezone
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from app.models.product import FirestoreProduct
+from app.services.product.transformers import (
+    get_another_model_from_product,
+    get_another_models_from_products,
+)
+
+###################################################################################
+# Compares the transformer engine with the former model_dump_json -> json.loads
+# round trip on a pull worth of products. Run it with:
+#   python -m app.tests.benchmarks.transformers
+###################################################################################
+
+NUM_PRODUCTS = 1000
+REPEAT = 5
+
+
+def get_another_model_from_product_json_round_trip(data: FirestoreProduct):
+    return json.loads(data.model_dump_json())
+
+
+def create_products(num_products: int) -> dict[str, FirestoreProduct]:
+    created_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    updated_at = DatetimeWithNanoseconds(
+        2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc
+    )
+    return {
+        str(i): FirestoreProduct(
+            id=str(i),
+            title=f"Product {i}",
+            createdAt=created_at,
+            updatedAt=updated_at,
+        )
+        for i in range(num_products)
+    }
+
+
+def run_benchmark(num_products: int = NUM_PRODUCTS, repeat: int = REPEAT) -> dict:
+    products = create_products(num_products)
+
+    expected = {
+        product_id: get_another_model_from_product_json_round_trip(product)
+        for product_id, product in products.items()
+    }
+    documents, errors = get_another_models_from_products(products)
+    assert errors == {}
+    assert documents == expected
+
+    round_trip_sec = min(
+        timeit.repeat(
+            lambda: [
+                get_another_model_from_product_json_round_trip(product)
+                for product in products.values()
+            ],
+            number=1,
+            repeat=repeat,
+        )
+    )
+    single_pass_sec = min(
+        timeit.repeat(
+            lambda: [
+                get_another_model_from_product(product) for product in products.values()
+            ],
+            number=1,
+            repeat=repeat,
+        )
+    )
+    batch_sec = min(
+        timeit.repeat(
+            lambda: get_another_models_from_products(products), number=1, repeat=repeat
+        )
+    )
+
+    return {
+        "products": num_products,
+        "round_trip_sec": round_trip_sec,
+        "single_pass_sec": single_pass_sec,
+        "batch_sec": batch_sec,
+        "speedup": round_trip_sec / batch_sec,
+    }
+
+
+if __name__ == "__main__":
+    results = run_benchmark()
+    print(json.dumps(results, indent=2))
+    assert results["batch_sec"] < results["round_trip_sec"], "No faster than the round trip"
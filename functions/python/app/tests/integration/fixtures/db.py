@@ -1,9 +1,12 @@
+import os
+import urllib.request
 from typing import Any
 
 import pytest
-from firebase_admin.firestore import firestore
 
+from app.services.firestore import get_firestore_client
 from app.tests.integration.fixtures.init_app import (
+    PROJECT_ID,
     initialise_admin_app,
 )
 
@@ -12,7 +15,19 @@ app = initialise_admin_app()
 
 @pytest.fixture(scope="function")
 def firestore_client():
-    return firestore.Client(project=app.project_id)
+    # Same process-wide client the service layer uses
+    return get_firestore_client()
+
+
+def reset_firestore_emulator(project_id: str = PROJECT_ID) -> None:
+    """Delete every document of the emulator's default database in one request."""
+
+    request = urllib.request.Request(
+        f"http://{os.environ['FIRESTORE_EMULATOR_HOST']}/emulator/v1/projects/{project_id}/databases/(default)/documents",
+        method="DELETE",
+    )
+    with urllib.request.urlopen(request, timeout=30):
+        pass
 
 
 @pytest.fixture(autouse=True, scope="function")
@@ -22,6 +37,10 @@ def clear_emulator(firestore_client) -> Any:
     yield
 
     print("Clearing Firestore...")
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        reset_firestore_emulator()
+        return
+
     for collection in firestore_client.collections():
         for doc in collection.stream():
             try:
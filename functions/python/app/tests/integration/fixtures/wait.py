@@ -1,6 +1,11 @@
+import threading
 import time
 import pytest
-from typing import Any
+from typing import Any, Iterable
+
+from google.cloud.firestore_v1.watch import ChangeType
+
+from app.models.product import OTHER_PRODUCT_MODEL_COLLECTION_NAME
 
 
 def wait_until_condition(condition, timeout=10, interval=0.1) -> Any:
@@ -18,3 +23,69 @@ def wait_until():
     """Wait until a condition is met."""
 
     return wait_until_condition
+
+
+class CollectionConvergenceWaiter:
+    """
+    Keeps the set of document ids in a collection up to date from a single
+    on_snapshot listener, so that waiting for many documents costs one listen
+    stream instead of a get() per document and poll.
+    """
+
+    def __init__(self, firestore_client, collection_name: str):
+        self.collection_name = collection_name
+        self._present: set[str] = set()
+        self._synced = False
+        self._condition = threading.Condition()
+        self._watch = firestore_client.collection(collection_name).on_snapshot(
+            self._on_snapshot
+        )
+
+    def _on_snapshot(self, _snapshots, changes, _read_time) -> None:
+        with self._condition:
+            for change in changes:
+                if change.type == ChangeType.REMOVED:
+                    self._present.discard(change.document.id)
+                else:
+                    self._present.add(change.document.id)
+            self._synced = True
+            self._condition.notify_all()
+
+    def wait_for(
+        self,
+        present: Iterable[str] = (),
+        absent: Iterable[str] = (),
+        timeout: float = 30,
+    ) -> None:
+        """Block until every id in present exists and none in absent does."""
+
+        present, absent = set(present), set(absent)
+
+        def converged() -> bool:
+            return (
+                self._synced
+                and present <= self._present
+                and not absent & self._present
+            )
+
+        with self._condition:
+            if not self._condition.wait_for(converged, timeout):
+                pytest.fail(
+                    f"{self.collection_name} did not converge within {timeout}s. "
+                    f"missing={sorted(present - self._present)} "
+                    f"not_deleted={sorted(absent & self._present)}"
+                )
+
+    def close(self) -> None:
+        self._watch.unsubscribe()
+
+
+@pytest.fixture
+def other_product_model_waiter(firestore_client):
+    """Wait for sets of products to be synced to, or deleted from, other_product_model."""
+
+    waiter = CollectionConvergenceWaiter(
+        firestore_client, OTHER_PRODUCT_MODEL_COLLECTION_NAME
+    )
+    yield waiter
+    waiter.close()
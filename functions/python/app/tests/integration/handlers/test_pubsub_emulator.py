@@ -3,25 +3,10 @@ import uuid
 import pytest
 
 
-def get_other_product_model_by_id(firestore_client, id: str) -> dict | None:
-    try:
-        res = firestore_client.collection("other_product_model").document(
-            id
-        ).get()
-        # We are replacing the other_product_model with another firestore collection to make the setup simpler
-
-        if not res.exists:
-            return None
-        return res
-    except Exception as e:
-        # print(f"get_other_product_model_by_id Exception: {e}")
-        return None
-
-
 def always_the_same_test(
     firestore_client,
     dummy_product,
-    wait_until,
+    other_product_model_waiter,
     num_products=100,
 ):
     ids = []
@@ -44,13 +29,7 @@ def always_the_same_test(
         if i % 10 == 0:
 
             # Lets check the state now
-            for id in ids:
-                wait_until(
-                    lambda: get_other_product_model_by_id(firestore_client, id)
-                    is not None,
-                    timeout=30,
-                    interval=1,
-                )
+            other_product_model_waiter.wait_for(present=ids, timeout=30)
 
             deleted_ids = []
             for j, id in enumerate(ids):
@@ -63,37 +42,26 @@ def always_the_same_test(
                     remaining_ids.append(id)
             ids = remaining_ids
 
-
-            for id in deleted_ids:
-                print(f"Waiting for {id} to be deleted out of {i} products")
-                wait_until(
-                    lambda: get_other_product_model_by_id(firestore_client, id) is None,
-                    timeout=30,
-                    interval=1,
-                )
+            print(f"Waiting for {len(deleted_ids)} products to be deleted out of {i} products")
+            other_product_model_waiter.wait_for(absent=deleted_ids, timeout=30)
 
     for id in ids:
         firestore_client.collection("products").document(
             id
         ).delete()
 
-    for id in ids:
-        wait_until(
-            lambda: get_other_product_model_by_id(firestore_client, id) is None,
-            timeout=30,
-            interval=1,
-        )
+    other_product_model_waiter.wait_for(absent=ids, timeout=30)
 
 
 def test_adds_and_deletes_a_single_product(
     firestore_client,
     dummy_product,
-    wait_until,
+    other_product_model_waiter,
 ):
     always_the_same_test(
         firestore_client, 
         dummy_product, 
-        wait_until, 
+        other_product_model_waiter, 
         num_products=1
     )
 
@@ -101,12 +69,12 @@ def test_adds_and_deletes_a_single_product(
 def test_adds_and_deletes_a_hundred_products_on_second_time(
     firestore_client,
     dummy_product,
-    wait_until,
+    other_product_model_waiter,
 ):
     always_the_same_test(
         firestore_client, 
         dummy_product, 
-        wait_until
+        other_product_model_waiter
     )
 
 
@@ -114,12 +82,12 @@ def test_adds_and_deletes_a_hundred_products_on_second_time(
 def test_adds_and_deletes_a_hundred_products_on_third_time(
     firestore_client,
     dummy_product,
-    wait_until,
+    other_product_model_waiter,
 ):
     always_the_same_test(
         firestore_client, 
         dummy_product, 
-        wait_until
+        other_product_model_waiter
     )
 
 
@@ -127,12 +95,12 @@ def test_adds_and_deletes_a_hundred_products_on_third_time(
 def test_adds_and_deletes_a_hundred_products_on_fourth_time(
     firestore_client,
     dummy_product,
-    wait_until,
+    other_product_model_waiter,
 ):
     always_the_same_test(
         firestore_client, 
         dummy_product, 
-        wait_until
+        other_product_model_waiter
     )
 
 
@@ -140,12 +108,12 @@ def test_adds_and_deletes_a_hundred_products_on_fourth_time(
 def test_adds_and_deletes_a_hundred_products_on_fifth_time(
     firestore_client,
     dummy_product,
-    wait_until,
+    other_product_model_waiter,
 ):
     always_the_same_test(
         firestore_client, 
         dummy_product, 
-        wait_until
+        other_product_model_waiter
     )
 
 
@@ -153,10 +121,10 @@ def test_adds_and_deletes_a_hundred_products_on_fifth_time(
 def test_adds_and_deletes_a_hundred_products_on_sixth_time(
     firestore_client,
     dummy_product,
-    wait_until,
+    other_product_model_waiter,
 ):
     always_the_same_test(
         firestore_client, 
         dummy_product, 
-        wait_until
+        other_product_model_waiter
     )
@@ -0,0 +1,119 @@
+import threading
+
+from app.services.pubsub import MAX_ACK_IDS_PER_REQUEST, AckManager
+
+
+class FakeSubscriber:
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+        # Set to block the next lease extension until released
+        self.extension_started: threading.Event | None = None
+        self.release_extension: threading.Event | None = None
+
+    def acknowledge(self, request):
+        with self._lock:
+            self.requests.append(("acknowledge", request))
+
+    def modify_ack_deadline(self, request):
+        if (
+            self.extension_started is not None
+            and request["ack_deadline_seconds"] == 60
+        ):
+            self.extension_started.set()
+            self.release_extension.wait(timeout=5)
+        with self._lock:
+            self.requests.append(("modify_ack_deadline", request))
+
+
+def create_ack_manager(subscriber: FakeSubscriber) -> AckManager:
+    return AckManager(subscriber, "sub", 60, nack_delay_seconds=5)
+
+
+def test_chunks_acks_and_sends_nacks_as_short_deadlines():
+    subscriber = FakeSubscriber()
+    ack_manager = create_ack_manager(subscriber)
+    ack_ids = [f"ack-{i}" for i in range(2600)]
+    ack_manager.track(ack_ids)
+
+    ack_manager.ack(ack_ids[:2500])
+    ack_manager.nack(ack_ids[2500:])
+    ack_manager.flush()
+
+    assert [
+        (method, len(request["ack_ids"]), request.get("ack_deadline_seconds"))
+        for method, request in subscriber.requests
+    ] == [
+        # A full request is sent as soon as it is buffered
+        ("acknowledge", MAX_ACK_IDS_PER_REQUEST, None),
+        ("acknowledge", MAX_ACK_IDS_PER_REQUEST, None),
+        ("acknowledge", 500, None),
+        ("modify_ack_deadline", 100, 5),
+    ]
+    assert ack_manager.stats == {
+        "acked": 2500,
+        "nacked": 100,
+        "extended": 0,
+        "rpcs": 4,
+    }
+
+
+def test_extends_only_messages_in_progress():
+    subscriber = FakeSubscriber()
+    ack_manager = create_ack_manager(subscriber)
+    ack_manager.track(["a", "b", "c"])
+    ack_manager.ack(["a"])
+    ack_manager.nack(["b"])
+
+    assert ack_manager.extend_leases() == 1
+    method, request = subscriber.requests[-1]
+    assert (method, request["ack_ids"], request["ack_deadline_seconds"]) == (
+        "modify_ack_deadline",
+        ["c"],
+        60,
+    )
+
+
+def test_nack_is_sent_after_a_concurrent_extension():
+    subscriber = FakeSubscriber()
+    subscriber.extension_started = threading.Event()
+    subscriber.release_extension = threading.Event()
+    ack_manager = create_ack_manager(subscriber)
+    ack_manager.track(["a"])
+
+    extension = threading.Thread(target=ack_manager.extend_leases)
+    extension.start()
+    assert subscriber.extension_started.wait(timeout=5)
+
+    # Nacked while the extension RPC is in flight
+    ack_manager.nack(["a"])
+    nack = threading.Thread(target=ack_manager.flush)
+    nack.start()
+    subscriber.release_extension.set()
+    extension.join()
+    nack.join()
+
+    # The nack's short deadline is the last one Pub/Sub sees
+    assert [request["ack_deadline_seconds"] for _, request in subscriber.requests] == [
+        60,
+        5,
+    ]
+
+
+def test_counts_stats_from_many_threads():
+    subscriber = FakeSubscriber()
+    ack_manager = create_ack_manager(subscriber)
+
+    def ack_many(thread_index: int):
+        for i in range(200):
+            ack_manager.ack([f"ack-{thread_index}-{i}"])
+            ack_manager.flush()
+
+    threads = [threading.Thread(target=ack_many, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert ack_manager.stats["acked"] == 1600
+    assert ack_manager.stats["rpcs"] == len(subscriber.requests)
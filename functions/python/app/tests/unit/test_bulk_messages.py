@@ -0,0 +1,121 @@
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from app.services.firestore import FN_EVENT_TYPE
+from app.services.product.bulk_messages import (
+    TriggerMessage,
+    decode_bulk_messages,
+    encode_bulk_message,
+)
+
+
+def create_pubsub_message(data: bytes, attributes: dict[str, str]):
+    return SimpleNamespace(data=data, attributes=attributes)
+
+
+def test_decodes_both_wire_versions():
+    message = TriggerMessage(product_id="1", event_type=FN_EVENT_TYPE.UPDATE)
+
+    decoded, poison_ack_ids = decode_bulk_messages(
+        [
+            (create_pubsub_message(*encode_bulk_message(message, "1")), "ack-1"),
+            (create_pubsub_message(*encode_bulk_message(message, "2")), "ack-2"),
+        ]
+    )
+
+    assert poison_ack_ids == []
+    assert [(msg.model_dump(), ack_id) for msg, ack_id in decoded] == [
+        (message.model_dump(), "ack-1"),
+        (message.model_dump(), "ack-2"),
+    ]
+
+
+def test_defaults_to_v1_that_older_consumers_can_read(monkeypatch):
+    monkeypatch.delenv("BULK_MESSAGE_WIRE_VERSION", raising=False)
+    message = TriggerMessage(
+        product_id="1",
+        event_type=FN_EVENT_TYPE.UPDATE,
+        update_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        event_time=datetime(2024, 1, 1, 0, 0, 1, tzinfo=timezone.utc),
+    )
+
+    data, attributes = encode_bulk_message(message)
+
+    assert attributes == {}
+
+    # How consumers that predate v2 and the timestamps decode it
+    class PreviousTriggerMessage(BaseModel):
+        product_id: str
+        event_type: FN_EVENT_TYPE
+
+    previous = PreviousTriggerMessage(**json.loads(data.decode("utf-8"))["data"])
+    assert (previous.product_id, previous.event_type) == ("1", FN_EVENT_TYPE.UPDATE)
+
+    decoded, _ = decode_bulk_messages([(create_pubsub_message(data, attributes), "ack")])
+    assert decoded[0][0].update_time == message.update_time
+    assert decoded[0][0].event_time == message.event_time
+
+
+def test_v2_carries_everything_in_attributes():
+    data, attributes = encode_bulk_message(
+        TriggerMessage(product_id="1", event_type=FN_EVENT_TYPE.DELETE), "2"
+    )
+
+    assert data == b""
+    assert attributes == {"v": "2", "product_id": "1", "event_type": "delete"}
+
+
+def test_collects_poison_messages():
+    decoded, poison_ack_ids = decode_bulk_messages(
+        [
+            (create_pubsub_message(b"not json", {}), "ack-1"),
+            (
+                create_pubsub_message(
+                    json.dumps({"data": {"product_id": "1"}}).encode("utf-8"), {}
+                ),
+                "ack-2",
+            ),
+            (
+                create_pubsub_message(
+                    b"", {"v": "2", "product_id": "1", "event_type": "unknown"}
+                ),
+                "ack-3",
+            ),
+        ]
+    )
+
+    assert decoded == []
+    assert poison_ack_ids == ["ack-1", "ack-2", "ack-3"]
+
+
+def test_carries_compressed_snapshot_and_update_time(monkeypatch):
+    monkeypatch.setenv("BULK_MESSAGE_COMPRESS_MIN_BYTES", "10")
+    message = TriggerMessage(
+        product_id="1",
+        event_type=FN_EVENT_TYPE.UPDATE,
+        update_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        snapshot={"id": "1", "title": "Dummy Title" * 10},
+    )
+
+    data, attributes = encode_bulk_message(message, "2")
+    assert attributes["enc"] == "zlib"
+
+    decoded, _ = decode_bulk_messages([(create_pubsub_message(data, attributes), "ack")])
+    assert decoded[0][0].model_dump() == message.model_dump()
+
+
+def test_falls_back_to_reference_above_the_size_threshold(monkeypatch):
+    monkeypatch.setenv("BULK_MESSAGE_MAX_SNAPSHOT_BYTES", "10")
+    message = TriggerMessage(
+        product_id="1",
+        event_type=FN_EVENT_TYPE.UPDATE,
+        snapshot={"id": "1", "title": "Dummy Title"},
+    )
+
+    data, attributes = encode_bulk_message(message, "2")
+
+    assert data == b""
+    assert "enc" not in attributes
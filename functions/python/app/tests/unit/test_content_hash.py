@@ -0,0 +1,58 @@
+from app.services.product.content_hash import (
+    CONTENT_HASH_FIELD,
+    compute_content_hash,
+    elide_unchanged_writes,
+    invalidate_content_hashes,
+    record_written_documents,
+)
+
+
+
+def test_hash_ignores_key_order_and_own_field():
+    document = {"id": "1", "title": "Product 1"}
+
+    assert compute_content_hash(document) == compute_content_hash(
+        {"title": "Product 1", "id": "1", CONTENT_HASH_FIELD: "stale"}
+    )
+    assert compute_content_hash(document) != compute_content_hash(
+        {**document, "title": "Product 2"}
+    )
+
+
+def test_elides_only_unchanged_written_documents():
+    collection_name = "test_elides"
+    documents = {
+        "1": {"id": "1", "title": "Product 1"},
+        "2": {"id": "2", "title": "Product 2"},
+    }
+
+    to_write, elided_ids = elide_unchanged_writes(documents, collection_name)
+    assert elided_ids == []
+    assert to_write["1"][CONTENT_HASH_FIELD] == compute_content_hash(documents["1"])
+
+    # Only "1" made it to Firestore
+    record_written_documents(to_write, ["1"], collection_name)
+
+    to_write, elided_ids = elide_unchanged_writes(
+        {**documents, "3": {"id": "3", "title": "Product 3"}}, collection_name
+    )
+    assert elided_ids == ["1"]
+    assert list(to_write) == ["2", "3"]
+
+    to_write, elided_ids = elide_unchanged_writes(
+        {"1": {"id": "1", "title": "Product 1 renamed"}}, collection_name
+    )
+    assert elided_ids == []
+
+
+def test_deletes_invalidate_hashes():
+    collection_name = "test_invalidates"
+    documents = {"1": {"id": "1", "title": "Product 1"}}
+    to_write, _ = elide_unchanged_writes(documents, collection_name)
+    record_written_documents(to_write, ["1"], collection_name)
+
+    invalidate_content_hashes(["1"], collection_name)
+
+    to_write, elided_ids = elide_unchanged_writes(documents, collection_name)
+    assert elided_ids == []
+    assert list(to_write) == ["1"]
@@ -0,0 +1,55 @@
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from google.cloud.firestore_v1.services.firestore import FirestoreClient
+from google.cloud.firestore_v1.services.firestore.transports.grpc import (
+    FirestoreGrpcTransport,
+)
+
+from app.services import firestore as firestore_service
+from app.services.firestore import (
+    _create_firestore_client,
+    _use_gapic_client,
+    get_firestore_channel_options,
+)
+
+
+def test_library_still_has_the_gapic_client_slot():
+    # _use_gapic_client relies on this private attribute, a library upgrade that
+    # removes it has to fail here rather than silently drop the channel options
+    for client_class in (firestore.Client, firestore.AsyncClient):
+        client = client_class(project="test", credentials=AnonymousCredentials())
+        assert hasattr(client, "_firestore_api_internal")
+
+    client = firestore.Client(project="test", credentials=AnonymousCredentials())
+    gapic_client = object()
+    assert _use_gapic_client(client, gapic_client)
+    assert client._firestore_api is gapic_client
+
+
+def test_creates_the_client_on_a_channel_with_our_options(monkeypatch):
+    monkeypatch.delenv("FIRESTORE_EMULATOR_HOST", raising=False)
+    monkeypatch.setenv("GCLOUD_PROJECT", "test")
+    monkeypatch.setattr(
+        firestore_service.google.auth,
+        "default",
+        lambda scopes=None: (AnonymousCredentials(), "test"),
+    )
+    channels = []
+    create_channel_original = FirestoreGrpcTransport.create_channel
+
+    def create_channel(host, credentials, options):
+        channels.append((host, dict(options)))
+        return create_channel_original(host, credentials=credentials, options=options)
+
+    monkeypatch.setattr(FirestoreGrpcTransport, "create_channel", create_channel)
+
+    client = _create_firestore_client(
+        firestore.Client, FirestoreGrpcTransport, FirestoreClient
+    )
+
+    assert isinstance(client._firestore_api, FirestoreClient)
+    assert channels == [
+        ("firestore.googleapis.com", dict(get_firestore_channel_options()))
+    ]
+    # Server side only, it does nothing on a client channel
+    assert "grpc.max_concurrent_streams" not in channels[0][1]
@@ -0,0 +1,76 @@
+import json
+import logging
+
+import pytest
+
+from app.metrics import (
+    PIPELINE_STAGE,
+    Histogram,
+    get_metrics_snapshot,
+    log_metrics,
+    record_batch_size,
+    reset_metrics,
+    set_gauge,
+    timed_stage,
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    reset_metrics()
+    yield
+    reset_metrics()
+
+
+def test_histogram_percentiles():
+    histogram = Histogram((1, 2, 5, 10))
+    for value in [0.5] * 50 + [3] * 45 + [20] * 5:
+        histogram.observe(value)
+
+    assert histogram.percentile(50) == 1
+    assert histogram.percentile(95) == 5
+    assert histogram.percentile(99) == 20
+    assert histogram.snapshot()["max"] == 20
+
+
+def test_timed_stage_counts_items_and_errors():
+    with timed_stage(PIPELINE_STAGE.READ, 10):
+        pass
+    with pytest.raises(RuntimeError):
+        with timed_stage(PIPELINE_STAGE.READ, 5):
+            raise RuntimeError("boom")
+
+    read = get_metrics_snapshot()["stages"]["read"]
+    assert read["calls"] == 2
+    assert read["items"] == 15
+    assert read["errors"] == 5
+
+
+def test_snapshot_includes_batch_sizes_and_gauges():
+    record_batch_size("pull", 100)
+    record_batch_size("pull", 20)
+    set_gauge("bulk_messages_per_sec", 42)
+
+    snapshot = get_metrics_snapshot()
+    assert snapshot["histograms"]["batch_size"]["pull"]["count"] == 2
+    assert snapshot["histograms"]["batch_size"]["pull"]["max"] == 100
+    assert snapshot["gauges"]["bulk_messages_per_sec"] == {"": 42}
+
+
+def test_log_metrics_writes_the_snapshot_into_the_message(caplog):
+    record_batch_size("pull", 100)
+    set_gauge("sync_staleness_sec", 3.5)
+    with timed_stage(PIPELINE_STAGE.WRITE, 10):
+        pass
+
+    with caplog.at_level(logging.INFO, logger="app.metrics"):
+        log_metrics("Products sync bulk metrics")
+
+    # The formatter setup_logging(disable_logging_client=True) installs
+    line = logging.Formatter("%(levelname)s:: %(message)s").format(caplog.records[-1])
+    prefix = "INFO:: Products sync bulk metrics metrics="
+    assert line.startswith(prefix)
+    metrics = json.loads(line[len(prefix) :])
+    assert metrics["stages"]["write"]["items"] == 10
+    assert metrics["histograms"]["batch_size"]["pull"]["count"] == 1
+    assert metrics["gauges"]["sync_staleness_sec"] == {"": 3.5}
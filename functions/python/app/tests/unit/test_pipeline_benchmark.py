@@ -0,0 +1,16 @@
+from app.tests.benchmarks.pipeline import run_pipeline_benchmark
+
+
+def test_pipeline_converges_on_in_memory_backends():
+    results = run_pipeline_benchmark(
+        num_products=30,
+        events_per_sec=2000,
+        firestore_latency_sec=0,
+        pubsub_latency_sec=0,
+        timeout_sec=20,
+    )
+
+    assert results["converged"] == 30
+    assert results["handler_errors"] == 0
+    assert results["bulk_backlog"] == 0
+    assert results["change_filter"]["suppressed"] > 0
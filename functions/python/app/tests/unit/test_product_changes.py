@@ -0,0 +1,33 @@
+from app.services.firestore import FN_EVENT_TYPE
+from app.services.product.changes import (
+    get_relevant_product_fields,
+    has_relevant_changes,
+)
+
+
+def test_ignores_updated_at_only_updates():
+    before = {"id": "1", "title": "Product 1", "updatedAt": 1}
+    after = {"id": "1", "title": "Product 1", "updatedAt": 2}
+
+    assert "updatedAt" not in get_relevant_product_fields()
+    assert not has_relevant_changes(FN_EVENT_TYPE.UPDATE, before, after)
+    assert has_relevant_changes(
+        FN_EVENT_TYPE.UPDATE, before, {**after, "title": "Product 2"}
+    )
+
+
+def test_ignores_fields_outside_the_relevant_set():
+    before = {"id": "1", "title": "Product 1"}
+    after = {"id": "1", "title": "Product 1", "internalNote": "backfilled"}
+
+    assert not has_relevant_changes(FN_EVENT_TYPE.UPDATE, before, after)
+    assert has_relevant_changes(
+        FN_EVENT_TYPE.UPDATE, before, after, frozenset({"title", "internalNote"})
+    )
+
+
+def test_creates_and_deletes_are_always_relevant():
+    product = {"id": "1", "title": "Product 1"}
+
+    assert has_relevant_changes(FN_EVENT_TYPE.CREATE, None, product)
+    assert has_relevant_changes(FN_EVENT_TYPE.DELETE, product, None)
@@ -0,0 +1,113 @@
+import pytest
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+
+from app.models.product import FIRESTORE_PRODUCTS_COLLECTION_NAME
+from app.services.product import firestore as product_firestore
+from app.services.product.firestore import (
+    delete_products_by_ids,
+    upsert_products_by_ids,
+)
+from app.services.throttling import TokenBucketRateLimiter
+from app.tests.benchmarks.backends import FaultInjector, InMemoryFirestoreClient
+
+
+class FailingFirestoreClient(InMemoryFirestoreClient):
+    """Rejects every commit that writes one of failing_ids, like an invalid document."""
+
+    def __init__(self, faults: FaultInjector | None = None):
+        super().__init__(faults)
+        self.failing_ids: frozenset[str] = frozenset()
+        # Document ids of every commit, batched or single
+        self.commits: list[list[str]] = []
+
+    def _apply(self, writes) -> None:
+        document_ids = [reference.id for reference, _ in writes]
+        self.commits.append(document_ids)
+        for document_id in document_ids:
+            if document_id in self.failing_ids:
+                raise InvalidArgument(f"Invalid document {document_id}")
+        super()._apply(writes)
+
+    def exists(self, document_id: str) -> bool:
+        return self._snapshot(
+            self.collection(FIRESTORE_PRODUCTS_COLLECTION_NAME).document(document_id)
+        ).exists
+
+
+@pytest.fixture
+def firestore_client(monkeypatch):
+    client = FailingFirestoreClient()
+    monkeypatch.setattr(product_firestore, "get_firestore_client", lambda: client)
+    return client
+
+
+def test_upsert_splits_writes_into_batches_of_500(firestore_client):
+    products = {str(i): {"id": str(i)} for i in range(501)}
+
+    result = upsert_products_by_ids(products)
+
+    assert [len(commit) for commit in firestore_client.commits] == [500, 1]
+    assert result.succeeded_ids == list(products)
+    assert result.errors == {}
+
+
+def test_upsert_retries_a_failed_batch_one_by_one(firestore_client):
+    firestore_client.failing_ids = frozenset({"502"})
+    products = {str(i): {"id": str(i)} for i in range(510)}
+
+    result = upsert_products_by_ids(products)
+
+    assert [len(commit) for commit in firestore_client.commits[:2]] == [500, 10]
+    # Only the failed chunk is written again, document by document
+    assert firestore_client.commits[2:] == [[str(i)] for i in range(500, 510)]
+    assert sorted(result.succeeded_ids) == sorted(set(products) - {"502"})
+    assert list(result.errors) == ["502"]
+    assert isinstance(result.errors["502"], InvalidArgument)
+    assert not firestore_client.exists("502")
+
+
+def test_delete_deduplicates_ids_and_retries_a_failed_batch(firestore_client):
+    for i in range(3):
+        firestore_client.write_without_rpc(
+            FIRESTORE_PRODUCTS_COLLECTION_NAME, str(i), {"id": str(i)}
+        )
+    firestore_client.commits.clear()
+    firestore_client.failing_ids = frozenset({"1"})
+
+    result = delete_products_by_ids(["0", "1", "2", "0"])
+
+    assert firestore_client.commits == [["0", "1", "2"], ["0"], ["1"], ["2"]]
+    assert result.succeeded_ids == ["0", "2"]
+    assert list(result.errors) == ["1"]
+    assert [firestore_client.exists(str(i)) for i in range(3)] == [False, True, False]
+
+
+def test_throttled_batch_fails_the_chunk_without_single_writes(monkeypatch):
+    faults = FaultInjector(
+        error_rate=1, error_factory=lambda method: ResourceExhausted("Slow down")
+    )
+    client = InMemoryFirestoreClient(faults)
+    monkeypatch.setattr(product_firestore, "get_firestore_client", lambda: client)
+    rate_limiter = TokenBucketRateLimiter(rate_per_sec=1000, burst=1000)
+
+    result = upsert_products_by_ids(
+        {str(i): {"id": str(i)} for i in range(10)}, rate_limiter=rate_limiter
+    )
+
+    assert faults.rpcs["Commit"] == 1
+    assert result.succeeded_ids == []
+    assert sorted(result.errors) == sorted(str(i) for i in range(10))
+    assert rate_limiter.current_rate == 500
+
+
+def test_single_writes_after_a_failed_batch_raise_the_rate(firestore_client):
+    firestore_client.failing_ids = frozenset({"1"})
+    rate_limiter = TokenBucketRateLimiter(rate_per_sec=100, burst=100)
+    rate_limiter.on_throttled()
+
+    upsert_products_by_ids(
+        {str(i): {"id": str(i)} for i in range(3)}, rate_limiter=rate_limiter
+    )
+
+    # Two documents were written one by one, each adds increase_step back
+    assert rate_limiter.current_rate == 60
@@ -0,0 +1,58 @@
+import asyncio
+
+from google.api_core.exceptions import Aborted
+
+from app.models.product import FIRESTORE_PRODUCTS_COLLECTION_NAME
+from app.services.product import firestore_async as product_firestore_async
+from app.services.product.firestore_async import (
+    get_products_by_ids_async,
+    upsert_products_by_ids_async,
+)
+from app.tests.benchmarks.backends import (
+    FaultInjector,
+    InMemoryAsyncFirestoreClient,
+    InMemoryFirestoreClient,
+)
+
+
+def test_skips_invalid_documents_in_every_chunk(monkeypatch):
+    firestore_client = InMemoryFirestoreClient()
+    for product_id, data in {
+        "1": {"id": "1", "title": "Product 1"},
+        # No title
+        "2": {"id": "2"},
+        "3": {"id": "3", "title": "Product 3"},
+    }.items():
+        firestore_client.write_without_rpc(
+            FIRESTORE_PRODUCTS_COLLECTION_NAME, product_id, data
+        )
+    monkeypatch.setattr(
+        product_firestore_async,
+        "get_firestore_async_client",
+        lambda: InMemoryAsyncFirestoreClient(firestore_client),
+    )
+
+    products, missing_ids, invalid_ids = asyncio.run(
+        get_products_by_ids_async(["1", "2", "3", "4"], chunk_size=1)
+    )
+
+    assert set(products) == {"1", "3"}
+    assert missing_ids == ["4"]
+    assert invalid_ids == ["2"]
+
+
+def test_throttled_batch_fails_the_chunk_without_single_writes(monkeypatch):
+    faults = FaultInjector(
+        error_rate=1, error_factory=lambda method: Aborted("Contention")
+    )
+    client = InMemoryAsyncFirestoreClient(InMemoryFirestoreClient(faults))
+    monkeypatch.setattr(
+        product_firestore_async, "get_firestore_async_client", lambda: client
+    )
+
+    result = asyncio.run(
+        upsert_products_by_ids_async({str(i): {"id": str(i)} for i in range(10)})
+    )
+
+    assert faults.rpcs["Commit"] == 1
+    assert len(result.errors) == 10
@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+import pytest
+
+from app.models.product import FIRESTORE_PRODUCTS_COLLECTION_NAME
+from app.services.product import firestore as product_firestore
+from app.services.product.firestore import (
+    get_product_by_id,
+    get_product_read_cache_stats,
+    get_products_by_ids,
+    invalidate_cached_products,
+)
+from app.tests.benchmarks.backends import InMemoryFirestoreClient
+
+
+class CountingFirestoreClient(InMemoryFirestoreClient):
+    """Counts the documents read through get_all and document().get()."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+        self.update_times = {}
+
+    def _snapshot(self, reference):
+        self.reads += 1
+        return super()._snapshot(reference)
+
+
+@pytest.fixture
+def firestore_client(monkeypatch):
+    client = CountingFirestoreClient()
+    for product_id, data in {
+        "1": {"id": "1", "title": "Product 1"},
+        "2": {"id": "2", "title": "Product 2"},
+        # No title
+        "3": {"id": "3"},
+    }.items():
+        _, snapshot = client.write_without_rpc(
+            FIRESTORE_PRODUCTS_COLLECTION_NAME, product_id, data
+        )
+        client.update_times[product_id] = snapshot.update_time
+    client.reads = 0
+
+    monkeypatch.setenv("PRODUCT_READ_CACHE_ENABLED", "true")
+    monkeypatch.setattr(product_firestore, "get_firestore_client", lambda: client)
+    invalidate_cached_products(["1", "2", "3"])
+    return client
+
+
+def test_serves_repeated_reads_from_the_cache(firestore_client):
+    hits_before = get_product_read_cache_stats()["hits"]
+
+    get_products_by_ids(["1", "2"])
+    products, _, _ = get_products_by_ids(["1", "2"])
+    product = get_product_by_id("1")
+
+    assert firestore_client.reads == 2
+    assert product.title == "Product 1"
+    assert set(products) == {"1", "2"}
+    assert get_product_read_cache_stats()["hits"] - hits_before == 3
+
+
+def test_reads_again_when_the_message_is_newer(firestore_client):
+    get_products_by_ids(["1", "2"])
+
+    get_products_by_ids(
+        ["1", "2"],
+        min_update_times={
+            "1": firestore_client.update_times["1"],
+            "2": firestore_client.update_times["2"] + timedelta(seconds=1),
+        },
+    )
+    assert firestore_client.reads == 3
+
+    # Messages without an update_time can't tell, so the product is read
+    get_products_by_ids(["1"], min_update_times={"1": None})
+    assert firestore_client.reads == 4
+
+
+def test_disabled_by_default(firestore_client, monkeypatch):
+    monkeypatch.delenv("PRODUCT_READ_CACHE_ENABLED")
+
+    get_product_by_id("1")
+    get_product_by_id("1")
+
+    assert firestore_client.reads == 2
+
+
+def test_skips_invalid_documents_of_a_batch(firestore_client):
+    products, missing_ids, invalid_ids = get_products_by_ids(["1", "3", "2", "4"])
+
+    assert set(products) == {"1", "2"}
+    assert missing_ids == ["4"]
+    assert invalid_ids == ["3"]
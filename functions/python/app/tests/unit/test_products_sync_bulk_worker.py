@@ -0,0 +1,173 @@
+import signal
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app.workers import products_sync_bulk
+from app.workers.products_sync_bulk import (
+    DelayedNacks,
+    run_products_sync_bulk_worker,
+    sync_streamed_messages,
+)
+
+
+class FakeMessage:
+    def __init__(self, product_id: str | None, event_type: str = "update"):
+        self.ack_id = f"ack-{product_id}"
+        self.data = b""
+        self.attributes = {"v": "2", "event_type": event_type}
+        if product_id is not None:
+            self.attributes["product_id"] = product_id
+        self.publish_time = datetime.now(timezone.utc)
+        self.acked = False
+        self.nacked = False
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.nacked = True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def fail_products(*failing_product_ids: str):
+    """sync_bulk_messages_in_shards that fails the given products."""
+
+    synced = []
+
+    def sync_bulk_messages_in_shards(upsert_messages, delete_messages, on_synced):
+        done, failed = [], []
+        for message, ack_ids in upsert_messages + delete_messages:
+            synced.append(message.product_id)
+            if message.product_id in failing_product_ids:
+                failed.extend(ack_ids)
+            else:
+                done.extend(ack_ids)
+        on_synced(done, failed)
+
+    return sync_bulk_messages_in_shards, synced
+
+
+def test_acks_synced_and_poison_messages_and_delays_nacks(monkeypatch):
+    sync, _ = fail_products("2")
+    monkeypatch.setattr(products_sync_bulk, "sync_bulk_messages_in_shards", sync)
+    clock = FakeClock()
+    delayed_nacks = DelayedNacks(10, clock=clock)
+    done, failed, poison = FakeMessage("1"), FakeMessage("2"), FakeMessage(None)
+
+    sync_streamed_messages([done, failed, poison], delayed_nacks)
+
+    assert done.acked and poison.acked
+    # Held back instead of being redelivered right away
+    assert not failed.acked and not failed.nacked
+    assert delayed_nacks.nack_due() == 0
+
+    clock.now = 10
+    assert delayed_nacks.nack_due() == 1
+    assert failed.nacked
+    assert len(delayed_nacks) == 0
+
+
+def test_nacks_right_away_without_a_delay(monkeypatch):
+    sync, _ = fail_products("1")
+    monkeypatch.setattr(products_sync_bulk, "sync_bulk_messages_in_shards", sync)
+    message = FakeMessage("1")
+
+    sync_streamed_messages([message], DelayedNacks(0))
+
+    assert message.nacked
+
+
+class FakeStreamingPullFuture:
+    def __init__(self):
+        self.cancelled = False
+
+    def done(self) -> bool:
+        return self.cancelled
+
+    def cancel(self):
+        self.cancelled = True
+
+    def result(self, timeout=None):
+        return None
+
+
+class FakeSubscriber:
+    def __init__(self, messages: list[FakeMessage]):
+        self.messages = messages
+        self.subscribe_kwargs = {}
+        self.callback = None
+        self.future = FakeStreamingPullFuture()
+
+    def subscribe(self, subscription_path, callback, **kwargs):
+        self.subscribe_kwargs = kwargs
+        self.callback = callback
+        for message in self.messages:
+            callback(message)
+        return self.future
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    handlers = {}
+    monkeypatch.setattr(
+        products_sync_bulk.signal,
+        "signal",
+        lambda signum, handler: handlers.__setitem__(signum, handler),
+    )
+    logging_kwargs = {}
+    monkeypatch.setattr(
+        products_sync_bulk,
+        "setup_logging",
+        lambda **kwargs: logging_kwargs.update(kwargs),
+    )
+    monkeypatch.setattr(
+        products_sync_bulk, "get_or_create_subscription", lambda *_: "bulk-sub"
+    )
+    monkeypatch.setattr(products_sync_bulk, "shutdown_pubsub_clients", lambda: None)
+    monkeypatch.setenv("BULK_WORKER_BATCH_SIZE", "2")
+    monkeypatch.setenv("BULK_WORKER_BATCH_WAIT_SEC", "0")
+    return SimpleNamespace(signal_handlers=handlers, logging_kwargs=logging_kwargs)
+
+
+def test_worker_drains_buffered_messages_on_shutdown(worker, monkeypatch):
+    messages = [FakeMessage(str(i)) for i in range(5)]
+    subscriber = FakeSubscriber(messages)
+    monkeypatch.setattr(
+        products_sync_bulk, "get_pubsub_subscriber_client", lambda: subscriber
+    )
+    sync, synced = fail_products("1")
+
+    def sync_and_stop(upsert_messages, delete_messages, on_synced):
+        # SIGTERM arrives while the first batch syncs
+        worker.signal_handlers[signal.SIGTERM](signal.SIGTERM, None)
+        sync(upsert_messages, delete_messages, on_synced)
+
+    monkeypatch.setattr(
+        products_sync_bulk, "sync_bulk_messages_in_shards", sync_and_stop
+    )
+
+    run_products_sync_bulk_worker()
+
+    # Local runs against the emulators have no credentials for Cloud Logging
+    assert worker.logging_kwargs["disable_logging_client"] is True
+    assert subscriber.subscribe_kwargs["await_callbacks_on_shutdown"] is True
+    # The buffered messages are synced before the stream is cancelled
+    assert sorted(synced) == ["0", "1", "2", "3", "4"]
+    assert [message.acked for message in messages] == [True, False, True, True, True]
+    # The held failed message is released on shutdown
+    assert messages[1].nacked
+    assert subscriber.future.cancelled
+
+    # Messages delivered after the stop signal go back to the subscription
+    late_message = FakeMessage("5")
+    subscriber.callback(late_message)
+    assert late_message.nacked
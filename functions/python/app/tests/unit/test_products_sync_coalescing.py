@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+
+from app.handlers.products_sync import TriggerMessage, coalesce_bulk_messages
+from app.services.firestore import FN_EVENT_TYPE
+
+
+def create_message(product_id: str, event_type: FN_EVENT_TYPE) -> TriggerMessage:
+    return TriggerMessage(product_id=product_id, event_type=event_type)
+
+
+def test_keeps_the_last_action_per_product_with_every_ack_id():
+    coalesced = coalesce_bulk_messages(
+        [
+            (create_message("1", FN_EVENT_TYPE.CREATE), "ack-1"),
+            (create_message("2", FN_EVENT_TYPE.CREATE), "ack-2"),
+            (create_message("1", FN_EVENT_TYPE.UPDATE), "ack-3"),
+            (create_message("1", FN_EVENT_TYPE.DELETE), "ack-4"),
+        ]
+    )
+
+    assert [(msg.product_id, msg.event_type, ack_ids) for msg, ack_ids in coalesced] == [
+        ("2", FN_EVENT_TYPE.CREATE, ["ack-2"]),
+        ("1", FN_EVENT_TYPE.DELETE, ["ack-1", "ack-3", "ack-4"]),
+    ]
+
+
+def test_upsert_after_delete_wins():
+    coalesced = coalesce_bulk_messages(
+        [
+            (create_message("1", FN_EVENT_TYPE.DELETE), "ack-1"),
+            (create_message("1", FN_EVENT_TYPE.CREATE), "ack-2"),
+        ]
+    )
+
+    assert len(coalesced) == 1
+    assert coalesced[0][0].event_type == FN_EVENT_TYPE.CREATE
+    assert coalesced[0][1] == ["ack-1", "ack-2"]
+
+
+def test_keeps_the_newest_carried_snapshot():
+    newer = TriggerMessage(
+        product_id="1",
+        event_type=FN_EVENT_TYPE.UPDATE,
+        update_time=datetime(2024, 1, 2, tzinfo=timezone.utc),
+        snapshot={"title": "newer"},
+    )
+    older = TriggerMessage(
+        product_id="1",
+        event_type=FN_EVENT_TYPE.UPDATE,
+        update_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        snapshot={"title": "older"},
+    )
+
+    coalesced = coalesce_bulk_messages([(newer, "ack-1"), (older, "ack-2")])
+
+    assert coalesced[0][0].snapshot == {"title": "newer"}
+    assert coalesced[0][1] == ["ack-1", "ack-2"]
+
+
+def test_reads_the_product_when_a_version_has_no_snapshot():
+    carried = TriggerMessage(
+        product_id="1", event_type=FN_EVENT_TYPE.UPDATE, snapshot={"title": "1"}
+    )
+
+    coalesced = coalesce_bulk_messages(
+        [(carried, "ack-1"), (create_message("1", FN_EVENT_TYPE.UPDATE), "ack-2")]
+    )
+
+    assert coalesced[0][0].snapshot is None
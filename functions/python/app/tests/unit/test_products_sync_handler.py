@@ -0,0 +1,54 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from app.handlers import products_sync
+from app.handlers.products_sync import products_sync_handler
+from app.services.pubsub import set_pubsub_clients
+from app.services.throttling import Debouncer
+from app.tests.benchmarks.backends import (
+    InMemoryPublisherClient,
+    InMemoryPubsub,
+)
+
+
+class FailingTriggerPublisherClient(InMemoryPublisherClient):
+    def publish(self, topic: str, data: bytes, ordering_key: str = "", **attributes):
+        if topic.endswith(products_sync.TRIGGER_TOPIC_NAME):
+            raise RuntimeError("trigger publish failed")
+        return super().publish(topic, data, ordering_key, **attributes)
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    monkeypatch.setenv("PRODUCT_CHANGE_FILTER_ENABLED", "false")
+    publisher = FailingTriggerPublisherClient(InMemoryPubsub())
+    set_pubsub_clients(publisher)
+    monkeypatch.setattr(
+        products_sync,
+        "_trigger_debouncer",
+        Debouncer(products_sync.publish_trigger_message, window_sec=60),
+    )
+    yield publisher
+    publisher.stop()
+    set_pubsub_clients()
+
+
+def test_failed_trigger_publish_is_logged_as_an_error(publisher, caplog):
+    snapshot = SimpleNamespace(
+        to_dict=lambda: {"id": "1", "title": "Product 1"}, update_time=None
+    )
+    event = SimpleNamespace(
+        id="event-1", data=SimpleNamespace(before=None, after=snapshot)
+    )
+
+    with caplog.at_level(logging.INFO, logger=products_sync.__name__):
+        products_sync_handler(event)
+
+    messages = [(record.levelno, record.getMessage()) for record in caplog.records]
+    assert (
+        logging.ERROR,
+        "Error publishing to trigger topic: trigger publish failed event.id=event-1",
+    ) in messages
+    assert not any("Debounced" in message for _, message in messages)
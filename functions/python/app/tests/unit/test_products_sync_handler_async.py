@@ -0,0 +1,125 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from google.api_core.exceptions import DeadlineExceeded
+
+from app.handlers import products_sync_async
+from app.handlers.products_sync import BULK_TOPIC_NAME
+from app.handlers.products_sync_async import (
+    products_sync_bulk_handler_async,
+    pull_bulk_batch_async,
+)
+from app.metrics import get_metrics_snapshot, reset_metrics, set_gauge
+from app.models.product import (
+    FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+)
+from app.services import pubsub_async
+from app.services.firestore import FN_EVENT_TYPE
+from app.services.product import firestore_async as product_firestore_async
+from app.services.product.bulk_messages import TriggerMessage, encode_bulk_message
+from app.services.product.sync_lag import SYNC_STALENESS_GAUGE
+from app.services.pubsub import PROJECT_ID, get_subscription_path, get_topic_path
+from app.services.pubsub_async import AsyncAckManager
+from app.tests.benchmarks.backends import (
+    InMemoryAsyncFirestoreClient,
+    InMemoryFirestoreClient,
+    InMemoryPubsub,
+    InMemorySubscriberAsyncClient,
+    InMemorySubscriberClient,
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    reset_metrics()
+    yield
+    reset_metrics()
+
+
+def test_empty_subscription_is_not_a_pull_error(monkeypatch):
+    async def pull_messages_async(subscription_path, max_messages):
+        raise DeadlineExceeded("No messages")
+
+    monkeypatch.setattr(products_sync_async, "pull_messages_async", pull_messages_async)
+    set_gauge(SYNC_STALENESS_GAUGE, 30)
+
+    pulled = asyncio.run(pull_bulk_batch_async(AsyncAckManager("sub", 60), 10))
+
+    assert pulled == ([], [], 0)
+    snapshot = get_metrics_snapshot()
+    assert snapshot["stages"]["pull"]["errors"] == 0
+    assert snapshot["gauges"][SYNC_STALENESS_GAUGE] == {"": 0.0}
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    monkeypatch.setenv("CONTENT_HASH_ENABLED", "false")
+    firestore = InMemoryFirestoreClient()
+    pubsub = InMemoryPubsub()
+    topic_path = get_topic_path(PROJECT_ID, BULK_TOPIC_NAME)
+    subscription_path = get_subscription_path(PROJECT_ID, f"{BULK_TOPIC_NAME}-sub")
+    pubsub.topics.add(topic_path)
+    InMemorySubscriberClient(pubsub).create_subscription(
+        {"name": subscription_path, "topic": topic_path, "ack_deadline_seconds": 120}
+    )
+
+    monkeypatch.setattr(
+        products_sync_async, "get_or_create_subscription", lambda *_: subscription_path
+    )
+    monkeypatch.setattr(
+        product_firestore_async,
+        "get_firestore_async_client",
+        lambda: InMemoryAsyncFirestoreClient(firestore),
+    )
+    monkeypatch.setattr(
+        pubsub_async,
+        "get_pubsub_subscriber_async_client",
+        lambda: InMemorySubscriberAsyncClient(pubsub),
+    )
+
+    def publish(product_id: str, event_type: FN_EVENT_TYPE) -> None:
+        data, attributes = encode_bulk_message(
+            TriggerMessage(product_id=product_id, event_type=event_type)
+        )
+        pubsub.publish(topic_path, data, product_id, attributes)
+
+    return SimpleNamespace(
+        firestore=firestore,
+        pubsub=pubsub,
+        subscription_path=subscription_path,
+        publish=publish,
+    )
+
+
+def test_bulk_handler_syncs_and_acks_every_message(backends):
+    for product_id in ["1", "2"]:
+        backends.firestore.write_without_rpc(
+            FIRESTORE_PRODUCTS_COLLECTION_NAME,
+            product_id,
+            {"id": product_id, "title": f"Product {product_id}"},
+        )
+        backends.publish(product_id, FN_EVENT_TYPE.UPDATE)
+    # No title
+    backends.firestore.write_without_rpc(
+        FIRESTORE_PRODUCTS_COLLECTION_NAME, "3", {"id": "3"}
+    )
+    backends.publish("3", FN_EVENT_TYPE.UPDATE)
+    backends.firestore.write_without_rpc(
+        OTHER_PRODUCT_MODEL_COLLECTION_NAME, "4", {"id": "4"}
+    )
+    backends.publish("4", FN_EVENT_TYPE.DELETE)
+
+    asyncio.run(products_sync_bulk_handler_async(None))
+
+    written = backends.firestore.collection(OTHER_PRODUCT_MODEL_COLLECTION_NAME)
+    assert written.document("1").get().exists
+    assert written.document("2").get().exists
+    assert not written.document("3").get().exists
+    assert not written.document("4").get().exists
+    # The invalid product is acked with the rest instead of being redelivered
+    assert backends.pubsub.backlog(backends.subscription_path) == 0
+    snapshot = get_metrics_snapshot()
+    assert snapshot["histograms"]["batch_size"]["write"]["max"] == 2
+    assert snapshot["stages"]["delete"]["items"] == 1
@@ -0,0 +1,64 @@
+import threading
+
+from app.handlers import products_sync
+from app.handlers.products_sync import (
+    TriggerMessage,
+    shard_bulk_messages,
+    sync_bulk_messages_in_shards,
+)
+from app.services.firestore import FN_EVENT_TYPE
+
+
+def create_bulk_message(product_id: str, event_type=FN_EVENT_TYPE.UPDATE):
+    return (
+        TriggerMessage(product_id=product_id, event_type=event_type),
+        [f"ack-{product_id}"],
+    )
+
+
+def test_shards_are_stable_per_product():
+    messages = [create_bulk_message(str(i)) for i in range(100)]
+
+    shards = shard_bulk_messages(messages, 4)
+
+    assert sum(len(shard) for shard in shards) == 100
+    assert all(len(shard) > 0 for shard in shards)
+    for shard_index, shard in enumerate(shards):
+        for message in shard:
+            assert message in shard_bulk_messages([message], 4)[shard_index]
+
+
+def test_syncs_shards_in_parallel_and_reports_every_message(monkeypatch):
+    monkeypatch.setenv("BULK_SHARDS", "4")
+    monkeypatch.setattr(products_sync, "_bulk_shard_executor", None)
+    threads = set()
+
+    def sync_bulk_messages(upsert_messages, delete_messages):
+        threads.add(threading.current_thread().name)
+        # Fail one product to check it is reported as failed
+        return [
+            ack_id
+            for message, ack_ids in upsert_messages + delete_messages
+            if message.product_id != "0"
+            for ack_id in ack_ids
+        ]
+
+    monkeypatch.setattr(products_sync, "sync_bulk_messages", sync_bulk_messages)
+
+    done, failed = [], []
+    lock = threading.Lock()
+
+    def on_synced(done_ack_ids, failed_ack_ids):
+        with lock:
+            done.extend(done_ack_ids)
+            failed.extend(failed_ack_ids)
+
+    sync_bulk_messages_in_shards(
+        [create_bulk_message(str(i)) for i in range(50)],
+        [create_bulk_message(str(i), FN_EVENT_TYPE.DELETE) for i in range(50, 60)],
+        on_synced,
+    )
+
+    assert failed == ["ack-0"]
+    assert sorted(done) == sorted(f"ack-{i}" for i in range(1, 60))
+    assert all(name.startswith("bulk-shard") for name in threads)
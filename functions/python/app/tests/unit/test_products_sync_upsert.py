@@ -0,0 +1,47 @@
+import pytest
+
+from app.handlers.products_sync import TriggerMessage, upsert_other_product_models
+from app.models.product import (
+    FIRESTORE_PRODUCTS_COLLECTION_NAME,
+    OTHER_PRODUCT_MODEL_COLLECTION_NAME,
+)
+from app.services.firestore import FN_EVENT_TYPE, set_firestore_client
+from app.tests.benchmarks.backends import InMemoryFirestoreClient
+
+
+@pytest.fixture
+def firestore_client():
+    client = InMemoryFirestoreClient()
+    set_firestore_client(client)
+    yield client
+    set_firestore_client(None)
+
+
+def test_invalid_product_does_not_fail_the_batch(firestore_client, monkeypatch):
+    monkeypatch.setenv("CONTENT_HASH_ENABLED", "false")
+    for product_id in ["1", "2"]:
+        firestore_client.write_without_rpc(
+            FIRESTORE_PRODUCTS_COLLECTION_NAME,
+            product_id,
+            {"id": product_id, "title": f"Product {product_id}"},
+        )
+    # No title
+    firestore_client.write_without_rpc(
+        FIRESTORE_PRODUCTS_COLLECTION_NAME, "3", {"id": "3"}
+    )
+
+    ack_ids = upsert_other_product_models(
+        [
+            (
+                TriggerMessage(product_id=product_id, event_type=FN_EVENT_TYPE.UPDATE),
+                [f"ack-{product_id}"],
+            )
+            for product_id in ["1", "2", "3"]
+        ]
+    )
+
+    # The invalid product is acked like a transform error instead of nacking everything
+    assert sorted(ack_ids) == ["ack-1", "ack-2", "ack-3"]
+    written = firestore_client.collection(OTHER_PRODUCT_MODEL_COLLECTION_NAME)
+    assert written.document("1").get().exists
+    assert not written.document("3").get().exists
@@ -0,0 +1,102 @@
+import pytest
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+from google.cloud import pubsub_v1
+
+from app.services import pubsub
+from app.services.pubsub import (
+    get_or_create_topic,
+    get_pubsub_pool_stats,
+    get_pubsub_publisher_client,
+    get_pubsub_subscriber_client,
+    invalidate_provisioned_path_on_not_found,
+    set_pubsub_clients,
+)
+
+
+class FakePublisherClient:
+    topic_path = staticmethod(pubsub_v1.PublisherClient.topic_path)
+
+    def __init__(self, batch_settings=None, publisher_options=None):
+        self.enable_message_ordering = publisher_options.enable_message_ordering
+        self.get_topic_requests = []
+
+    def get_topic(self, request):
+        self.get_topic_requests.append(request["topic"])
+
+    def stop(self):
+        pass
+
+
+class FakeSubscriberClient:
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_clients(monkeypatch):
+    monkeypatch.setattr(pubsub.pubsub_v1, "PublisherClient", FakePublisherClient)
+    monkeypatch.setattr(pubsub.pubsub_v1, "SubscriberClient", FakeSubscriberClient)
+    set_pubsub_clients()
+    yield
+    set_pubsub_clients()
+
+
+def test_publisher_pool_hit_and_miss(fake_clients):
+    stats = get_pubsub_pool_stats()
+
+    publisher = get_pubsub_publisher_client()
+    assert get_pubsub_publisher_client() is publisher
+    ordered_publisher = get_pubsub_publisher_client(True)
+
+    # One publisher per ordering mode
+    assert not publisher.enable_message_ordering
+    assert ordered_publisher.enable_message_ordering
+    new_stats = get_pubsub_pool_stats()
+    assert new_stats["hits"] - stats["hits"] == 1
+    assert new_stats["misses"] - stats["misses"] == 2
+    assert new_stats["publishers"] == 2
+
+
+def test_subscriber_pool_hit_and_miss(fake_clients):
+    stats = get_pubsub_pool_stats()
+
+    subscriber = get_pubsub_subscriber_client()
+    assert get_pubsub_subscriber_client() is subscriber
+
+    new_stats = get_pubsub_pool_stats()
+    assert new_stats["hits"] - stats["hits"] == 1
+    assert new_stats["misses"] - stats["misses"] == 1
+    assert new_stats["subscribers"] == 1
+
+
+def test_provisioned_topic_is_checked_once(fake_clients):
+    publisher = get_pubsub_publisher_client()
+
+    topic_path = get_or_create_topic(publisher, "topic")
+    get_or_create_topic(publisher, "topic")
+
+    assert publisher.get_topic_requests == [topic_path]
+
+
+def test_provisioned_topic_expires_after_ttl(fake_clients, monkeypatch):
+    monkeypatch.setenv("PUBSUB_PROVISIONING_TTL_SEC", "-1")
+    publisher = get_pubsub_publisher_client()
+
+    get_or_create_topic(publisher, "topic")
+    get_or_create_topic(publisher, "topic")
+
+    assert len(publisher.get_topic_requests) == 2
+
+
+def test_not_found_invalidates_provisioned_topic(fake_clients):
+    publisher = get_pubsub_publisher_client()
+    topic_path = get_or_create_topic(publisher, "topic")
+
+    # Other errors don't mean the topic is gone
+    invalidate_provisioned_path_on_not_found(topic_path, ServiceUnavailable("down"))
+    get_or_create_topic(publisher, "topic")
+    assert len(publisher.get_topic_requests) == 1
+
+    invalidate_provisioned_path_on_not_found(topic_path, NotFound("deleted"))
+    get_or_create_topic(publisher, "topic")
+    assert len(publisher.get_topic_requests) == 2
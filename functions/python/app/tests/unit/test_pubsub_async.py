@@ -0,0 +1,87 @@
+import asyncio
+
+from app.services import pubsub_async
+from app.services.pubsub_async import AsyncAckManager
+
+
+class FakeSubscriber:
+    def __init__(self):
+        self.requests = []
+        # Set to block the next lease extension until released
+        self.extension_started: asyncio.Event | None = None
+        self.release_extension: asyncio.Event | None = None
+
+    async def acknowledge(self, request):
+        self.requests.append(("acknowledge", request))
+
+    async def modify_ack_deadline(self, request):
+        if (
+            self.extension_started is not None
+            and request["ack_deadline_seconds"] == 60
+        ):
+            self.extension_started.set()
+            await self.release_extension.wait()
+        self.requests.append(("modify_ack_deadline", request))
+
+
+def test_async_ack_manager_batches_acks_and_nacks(monkeypatch):
+    subscriber = FakeSubscriber()
+    monkeypatch.setattr(
+        pubsub_async, "get_pubsub_subscriber_async_client", lambda: subscriber
+    )
+
+    async def ack_and_nack():
+        async with AsyncAckManager("sub", 60, nack_delay_seconds=5) as ack_manager:
+            ack_ids = [f"ack-{i}" for i in range(1500)]
+            ack_manager.track(ack_ids)
+            ack_manager.ack(ack_ids[:1200])
+            ack_manager.nack(ack_ids[1200:])
+        return ack_manager
+
+    ack_manager = asyncio.run(ack_and_nack())
+
+    assert ack_manager.stats == {"acked": 1200, "nacked": 300, "extended": 0, "rpcs": 3}
+    assert sorted(
+        (method, len(request["ack_ids"]), request.get("ack_deadline_seconds"))
+        for method, request in subscriber.requests
+    ) == [
+        ("acknowledge", 200, None),
+        ("acknowledge", 1000, None),
+        ("modify_ack_deadline", 300, 5),
+    ]
+
+
+def test_async_nack_is_sent_after_a_concurrent_extension(monkeypatch):
+    subscriber = FakeSubscriber()
+    monkeypatch.setattr(
+        pubsub_async, "get_pubsub_subscriber_async_client", lambda: subscriber
+    )
+
+    async def nack_while_extending():
+        subscriber.extension_started = asyncio.Event()
+        subscriber.release_extension = asyncio.Event()
+        ack_manager = AsyncAckManager("sub", 60, nack_delay_seconds=5)
+        ack_manager.track(["a", "b"])
+        ack_manager.ack(["b"])
+
+        extension = asyncio.create_task(ack_manager.extend_leases())
+        await subscriber.extension_started.wait()
+
+        # Nacked while the extension RPC is in flight
+        ack_manager.nack(["a"])
+        flush = asyncio.create_task(ack_manager.flush())
+        await asyncio.sleep(0)
+        subscriber.release_extension.set()
+        await asyncio.gather(extension, flush)
+
+        # Nacked ids are not extended again
+        assert await ack_manager.extend_leases() == 0
+
+    asyncio.run(nack_while_extending())
+
+    # The nack's short deadline is the last one Pub/Sub sees
+    assert [
+        request["ack_deadline_seconds"]
+        for method, request in subscriber.requests
+        if method == "modify_ack_deadline"
+    ] == [60, 5]
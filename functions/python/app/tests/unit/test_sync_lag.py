@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app.handlers import products_sync
+from app.handlers.products_sync import (
+    coalesce_bulk_messages,
+    sync_bulk_messages_in_shards,
+)
+from app.metrics import get_metrics_snapshot, reset_metrics
+from app.services.firestore import FN_EVENT_TYPE
+from app.services.product.bulk_messages import (
+    TriggerMessage,
+    decode_bulk_messages,
+    encode_bulk_message,
+)
+from app.services.product.sync_lag import (
+    LAG_SEGMENT,
+    SYNC_LAG_METRIC,
+    SYNC_STALENESS_GAUGE,
+    get_message_lags,
+    record_synced_lag,
+)
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    reset_metrics()
+    yield
+    reset_metrics()
+
+
+def create_message(product_id: str, write_offset_sec: float, **kwargs) -> TriggerMessage:
+    return TriggerMessage(
+        product_id=product_id,
+        event_type=FN_EVENT_TYPE.UPDATE,
+        event_time=T0 + timedelta(seconds=write_offset_sec),
+        publish_time=T0 + timedelta(seconds=write_offset_sec + 1),
+        received_time=T0 + timedelta(seconds=10),
+        **kwargs,
+    )
+
+
+def test_decodes_event_publish_and_received_time():
+    data, attributes = encode_bulk_message(
+        TriggerMessage(product_id="p1", event_type=FN_EVENT_TYPE.UPDATE, event_time=T0)
+    )
+    publish_time = T0 + timedelta(seconds=1)
+    received_time = T0 + timedelta(seconds=2)
+
+    decoded, _ = decode_bulk_messages(
+        [
+            (
+                SimpleNamespace(data=data, attributes=attributes, publish_time=publish_time),
+                "ack",
+            )
+        ],
+        received_time,
+    )
+
+    message = decoded[0][0]
+    assert message.event_time == T0
+    assert message.publish_time == publish_time
+    assert message.received_time == received_time
+
+
+def test_message_lags_per_segment():
+    lags = get_message_lags(create_message("p1", 0), T0 + timedelta(seconds=12))
+
+    assert lags == {
+        LAG_SEGMENT.WRITE_TO_PUBLISH: 1,
+        LAG_SEGMENT.PUBLISH_TO_PULL: 9,
+        LAG_SEGMENT.PULL_TO_COMMIT: 2,
+        LAG_SEGMENT.WRITE_TO_COMMIT: 12,
+    }
+
+
+def test_delete_without_event_time_has_no_write_segments():
+    message = TriggerMessage(
+        product_id="p1",
+        event_type=FN_EVENT_TYPE.DELETE,
+        update_time=T0,
+        received_time=T0,
+    )
+
+    assert set(get_message_lags(message, T0)) == {LAG_SEGMENT.PULL_TO_COMMIT}
+
+
+def test_records_only_committed_messages():
+    lag_sec = record_synced_lag(
+        [
+            (create_message("p1", 0), ["a", "b"]),
+            (create_message("p2", 5), ["c"]),
+            (create_message("p3", -100), ["d"]),
+        ],
+        {"a", "b", "c"},
+    )
+
+    write_to_commit = get_metrics_snapshot()["histograms"][SYNC_LAG_METRIC][
+        "write_to_commit"
+    ]
+    assert write_to_commit["count"] == 2
+    # p1 was written first, its lag is the worst of the batch
+    assert lag_sec == write_to_commit["max"]
+
+
+def test_coalesced_writes_are_measured_from_the_oldest_one():
+    first = create_message("p1", 0)
+    second = create_message("p1", 5)
+
+    [(message, ack_ids)] = coalesce_bulk_messages([(first, "a"), (second, "b")])
+
+    assert ack_ids == ["a", "b"]
+    assert message.publish_time == second.publish_time
+    lags = get_message_lags(message, T0 + timedelta(seconds=12))
+    assert lags[LAG_SEGMENT.WRITE_TO_COMMIT] == 12
+    assert lags[LAG_SEGMENT.WRITE_TO_PUBLISH] == 1
+
+
+def test_staleness_is_the_worst_lag_across_shards(monkeypatch):
+    monkeypatch.setenv("BULK_SHARDS", "4")
+    monkeypatch.setattr(products_sync, "_bulk_shard_executor", None)
+    monkeypatch.setattr(
+        products_sync,
+        "sync_bulk_messages",
+        lambda upserts, deletes: [
+            ack_id for _, ack_ids in upserts + deletes for ack_id in ack_ids
+        ],
+    )
+    now = datetime.now(timezone.utc)
+    messages = [
+        (
+            TriggerMessage(
+                product_id=str(i),
+                event_type=FN_EVENT_TYPE.UPDATE,
+                event_time=now - timedelta(seconds=i),
+            ),
+            [f"ack-{i}"],
+        )
+        for i in range(40)
+    ]
+
+    sync_bulk_messages_in_shards(messages, [], lambda done, failed: None)
+
+    staleness_sec = get_metrics_snapshot()["gauges"][SYNC_STALENESS_GAUGE][""]
+    assert 39 <= staleness_sec < 40
@@ -0,0 +1,274 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services.throttling import (
+    AdaptiveBatchSize,
+    Debouncer,
+    HeldLease,
+    TokenBucketRateLimiter,
+)
+
+
+def create_batch_size(initial_size=40):
+    return AdaptiveBatchSize(
+        initial_size=initial_size,
+        min_size=10,
+        max_size=1000,
+        target_latency_sec=5,
+    )
+
+
+def test_grows_when_full_batches_are_fast():
+    batch_size = create_batch_size()
+
+    assert batch_size.record(40, 1) == 80
+    assert batch_size.record(80, 1) == 160
+
+
+def test_does_not_grow_on_partial_batches():
+    batch_size = create_batch_size()
+
+    assert batch_size.record(12, 0.5) == 40
+
+
+def test_shrinks_when_batches_are_slow():
+    batch_size = create_batch_size()
+
+    assert batch_size.record(40, 7) == 28
+    assert batch_size.record(28, 60) == 14
+    assert batch_size.record(14, 60) == 10
+
+
+def test_rate_limiter_backs_off_and_recovers():
+    limiter = TokenBucketRateLimiter(
+        rate_per_sec=100, burst=100, min_rate_per_sec=10, decrease_cooldown_sec=0
+    )
+
+    limiter.on_throttled()
+    assert limiter.current_rate == 50
+    limiter.on_throttled()
+    limiter.on_throttled()
+    limiter.on_throttled()
+    assert limiter.current_rate == 10
+
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.current_rate == 100
+
+
+def test_rate_limiter_serves_the_burst_without_waiting():
+    limiter = TokenBucketRateLimiter(rate_per_sec=1, burst=50)
+
+    assert limiter.acquire(50) == 0
+    assert limiter.acquire(1) > 0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, duration_sec: float) -> None:
+        self.sleeps.append(duration_sec)
+        self.now += duration_sec
+
+
+def test_debouncer_runs_leading_and_trailing_call_inside_the_caller():
+    clock = FakeClock()
+    calls = []
+    debouncer = Debouncer(
+        lambda: calls.append(clock.now) or len(calls),
+        window_sec=1,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+    assert debouncer.trigger() == 1
+    clock.now = 0.25
+    # Waits out the window and runs the trailing call before returning
+    assert debouncer.trigger() == 2
+    assert clock.sleeps == [0.75]
+    assert calls == [0, 1]
+    assert debouncer.stats == {"runs": 2, "debounced": 1}
+
+
+def test_debouncer_runs_one_trailing_call_for_a_burst():
+    clock = FakeClock()
+    calls = []
+    sleeping = threading.Event()
+    wake_up = threading.Event()
+
+    def sleep(duration_sec: float) -> None:
+        sleeping.set()
+        wake_up.wait()
+
+    debouncer = Debouncer(
+        lambda: calls.append(1) or len(calls), window_sec=1, clock=clock, sleep=sleep
+    )
+    debouncer.trigger()
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(debouncer.trigger()))
+    waiter.start()
+    assert sleeping.wait(timeout=5)
+
+    # The rest of the burst is covered by the waiting call and returns right away
+    assert [debouncer.trigger() for _ in range(4)] == [None] * 4
+    clock.now = 1
+    wake_up.set()
+    waiter.join()
+
+    assert results == [2]
+    assert debouncer.stats == {"runs": 2, "debounced": 5}
+
+
+def test_debouncer_flush_runs_the_pending_call():
+    clock = FakeClock()
+    calls = []
+    sleeping = threading.Event()
+    wake_up = threading.Event()
+
+    def sleep(duration_sec: float) -> None:
+        sleeping.set()
+        wake_up.wait()
+
+    debouncer = Debouncer(
+        lambda: calls.append(1), window_sec=60, clock=clock, sleep=sleep
+    )
+    debouncer.trigger()
+
+    # Shutting down while a debounced call waits for the end of the window
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(debouncer.trigger()))
+    waiter.start()
+    assert sleeping.wait(timeout=5)
+    debouncer.flush()
+    wake_up.set()
+    waiter.join()
+
+    assert len(calls) == 2
+    assert results == [None]
+
+
+class FakeLease:
+    """A lease shared with another instance, which took it at acquired_at."""
+
+    def __init__(self, clock: FakeClock, window_sec: float, acquired_at: float):
+        self.clock = clock
+        self.window_sec = window_sec
+        self.acquired_at = acquired_at
+
+    def __call__(self) -> HeldLease | None:
+        now = self.clock()
+        expires_at = self.acquired_at + self.window_sec
+        if now < expires_at:
+            return HeldLease(
+                remaining_sec=expires_at - now, age_sec=now - self.acquired_at
+            )
+
+        self.acquired_at = now
+        return None
+
+
+def test_debouncer_drops_trailing_call_covered_by_another_lease_holder():
+    clock = FakeClock()
+    calls = []
+    lease = FakeLease(clock, window_sec=0.1, acquired_at=0)
+
+    def acquire_lease():
+        # Another instance takes the lease again right when it expires
+        held_lease = lease()
+        if held_lease is None:
+            lease.acquired_at = clock()
+            return HeldLease(remaining_sec=0.1, age_sec=0)
+        return held_lease
+
+    debouncer = Debouncer(
+        lambda: calls.append(1),
+        window_sec=0,
+        acquire_lease=acquire_lease,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+    assert debouncer.trigger() is None
+    assert clock.sleeps == [0.1]
+    assert calls == []
+
+
+def test_debouncer_retries_a_trailing_call_denied_by_an_older_lease():
+    clock = FakeClock()
+    calls = []
+    # Another instance ran the action at 0.35, before our write at 0.9
+    lease = FakeLease(clock, window_sec=1, acquired_at=0.35)
+    debouncer = Debouncer(
+        lambda: calls.append(clock.now) or len(calls),
+        window_sec=1,
+        acquire_lease=lease,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+    clock.now = 0.9
+    assert debouncer.trigger() == 1
+    # The trailing run follows our write once the holder's lease expires
+    assert calls[0] >= 1.35
+    assert lease.acquired_at == calls[0]
+
+
+def test_debouncer_retries_a_trailing_call_denied_after_our_run():
+    clock = FakeClock()
+    calls = []
+    lease = FakeLease(clock, window_sec=1, acquired_at=-10)
+
+    def sleep(duration_sec: float) -> None:
+        if not clock.sleeps:
+            # Another instance, whose clock is behind ours, took the lease while
+            # we waited, at 0.35 by our clock
+            lease.acquired_at = 0.35
+        clock.sleep(duration_sec)
+
+    debouncer = Debouncer(
+        lambda: calls.append(clock.now) or len(calls),
+        window_sec=1,
+        acquire_lease=lease,
+        clock=clock,
+        sleep=sleep,
+    )
+
+    assert debouncer.trigger() == 1
+    clock.now = 0.9
+    # Its run came before our write, so the trailing run waits for its lease
+    assert debouncer.trigger() == 2
+    assert calls == [0, 1.35]
+
+
+def test_debouncer_raises_when_the_action_fails():
+    clock = FakeClock()
+
+    def fail():
+        raise RuntimeError("publish failed")
+
+    debouncer = Debouncer(fail, window_sec=1, clock=clock, sleep=clock.sleep)
+
+    # Failures are not mistaken for a debounced call, on either edge
+    with pytest.raises(RuntimeError):
+        debouncer.trigger()
+    with pytest.raises(RuntimeError):
+        debouncer.trigger()
+    assert debouncer.stats == {"runs": 2, "debounced": 1}
+
+
+def test_rate_limiter_acquire_async_waits_out_the_debt():
+    limiter = TokenBucketRateLimiter(rate_per_sec=100, burst=1)
+
+    async def acquire_twice():
+        await limiter.acquire_async()
+        return await limiter.acquire_async(5)
+
+    assert 0.03 < asyncio.run(acquire_twice()) <= 0.06
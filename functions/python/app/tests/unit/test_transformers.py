@@ -0,0 +1,68 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore import GeoPoint
+
+from app.models.product import FirestoreProduct
+from app.services.product.transformers import (
+    get_another_model_from_product,
+    get_another_models_from_products,
+)
+
+
+def test_matches_json_round_trip():
+    products = [
+        FirestoreProduct(id="1", title="Product 1"),
+        FirestoreProduct(
+            id="2",
+            title="Product 2",
+            createdAt=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            updatedAt=DatetimeWithNanoseconds(
+                2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc
+            ),
+        ),
+        FirestoreProduct(
+            id="3",
+            title="Product 3",
+            createdAt=datetime(2024, 1, 1, 12, tzinfo=timezone(timedelta(hours=2))),
+            updatedAt={
+                "date": date(2024, 1, 1),
+                "prices": (Decimal("1.50"), 2, None),
+                "raw": b"abc",
+                "nested": [{"at": datetime(2024, 1, 1, 0, 0, 1)}],
+            },
+        ),
+    ]
+
+    for product in products:
+        assert get_another_model_from_product(product) == json.loads(
+            product.model_dump_json()
+        )
+
+
+def test_converts_firestore_types():
+    product = FirestoreProduct(
+        id="1", title="Product 1", updatedAt=GeoPoint(52.52, 13.405)
+    )
+
+    assert get_another_model_from_product(product)["updatedAt"] == {
+        "latitude": 52.52,
+        "longitude": 13.405,
+    }
+
+
+def test_batch_reports_errors_per_product():
+    class Unserializable:
+        pass
+
+    documents, errors = get_another_models_from_products(
+        {
+            "1": FirestoreProduct(id="1", title="Product 1"),
+            "2": FirestoreProduct(id="2", title="Product 2", updatedAt=Unserializable()),
+        }
+    )
+
+    assert list(documents) == ["1"]
+    assert list(errors) == ["2"]
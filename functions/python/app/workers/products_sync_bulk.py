@@ -0,0 +1,270 @@
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber.message import Message
+
+from app.handlers.products_sync import (
+    BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS,
+    BULK_TOPIC_NAME,
+    get_bulk_nack_delay,
+    split_bulk_messages,
+    sync_bulk_messages_in_shards,
+)
+from app.logging import setup_logging
+from app.metrics import (
+    PIPELINE_STAGE,
+    maybe_log_metrics,
+    record_batch_size,
+    record_stage,
+)
+from app.services.product.bulk_messages import decode_bulk_messages
+from app.services.pubsub import (
+    get_or_create_subscription,
+    get_pubsub_subscriber_client,
+    shutdown_pubsub_clients,
+)
+
+_logger = logging.getLogger(__name__)
+
+###################################################################################
+########################### STREAMING PULL WORKER #################################
+###################################################################################
+# Long running alternative to the products_sync_bulk function. It keeps a
+# StreamingPull open on the bulk subscription, so it needs neither the trigger
+# topic nor a subscription lookup per batch. The client library extends the
+# leases of outstanding messages and flow control caps how many are in memory.
+#
+# Run it as a Cloud Run worker or locally against the emulator with:
+#   python -m app.workers.products_sync_bulk
+###################################################################################
+
+
+def get_worker_flow_control() -> pubsub_v1.types.FlowControl:
+    return pubsub_v1.types.FlowControl(
+        max_messages=int(
+            os.environ.get("BULK_WORKER_MAX_OUTSTANDING_MESSAGES", "1000")
+        ),
+        max_bytes=int(
+            os.environ.get("BULK_WORKER_MAX_OUTSTANDING_BYTES", str(100 * 1024 * 1024))
+        ),
+        max_lease_duration=int(
+            os.environ.get("BULK_WORKER_MAX_LEASE_DURATION_SEC", "600")
+        ),
+    )
+
+
+def get_worker_batch_size() -> int:
+    return int(os.environ.get("BULK_WORKER_BATCH_SIZE", "500"))
+
+
+def get_worker_batch_wait() -> float:
+    # How long a partial batch waits for more messages before it is synced
+    return float(os.environ.get("BULK_WORKER_BATCH_WAIT_SEC", "0.5"))
+
+
+class DelayedNacks:
+    """
+    Holds failed messages for BULK_NACK_DELAY_SEC before nacking them.
+
+    A plain nack() redelivers right away, so a product that keeps failing would
+    spin on the stream. The library keeps extending the leases of held messages,
+    and with ordering it holds back the product's next messages as well.
+    """
+
+    def __init__(self, delay_sec: float, clock=time.monotonic):
+        self.delay_sec = delay_sec
+        self._clock = clock
+        self._messages: list[tuple[float, Message]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._messages)
+
+    def add(self, messages: list[Message]) -> None:
+        if self.delay_sec <= 0:
+            for message in messages:
+                message.nack()
+            return
+
+        due_at = self._clock() + self.delay_sec
+        with self._lock:
+            self._messages.extend((due_at, message) for message in messages)
+
+    def nack_due(self) -> int:
+        now = self._clock()
+        with self._lock:
+            due = [message for due_at, message in self._messages if due_at <= now]
+            self._messages = [
+                (due_at, message) for due_at, message in self._messages if due_at > now
+            ]
+
+        for message in due:
+            message.nack()
+        return len(due)
+
+    def nack_all(self) -> int:
+        with self._lock:
+            messages, self._messages = self._messages, []
+
+        for _, message in messages:
+            message.nack()
+        return len(messages)
+
+
+def sync_streamed_messages(
+    messages: list[Message], delayed_nacks: DelayedNacks | None = None
+) -> None:
+    """
+    Sync a batch of streamed messages, ack the done ones and nack the rest.
+
+    Args:
+        delayed_nacks: Holds the failed messages for a while, they are nacked right
+            away without it
+    """
+
+    messages_by_ack_id = {message.ack_id: message for message in messages}
+    record_batch_size("pull", len(messages))
+    start_decoding_time = time.monotonic()
+    parsed, poison_ack_ids = decode_bulk_messages(
+        [(message, message.ack_id) for message in messages],
+        datetime.now(timezone.utc),
+    )
+    record_stage(
+        PIPELINE_STAGE.DECODE,
+        time.monotonic() - start_decoding_time,
+        len(messages),
+        errors=len(poison_ack_ids),
+    )
+    for ack_id in poison_ack_ids:
+        messages_by_ack_id[ack_id].ack()
+
+    acked, nacked = len(poison_ack_ids), 0
+    counts_lock = threading.Lock()
+
+    def on_synced(done_ack_ids: list[str], failed_ack_ids: list[str]) -> None:
+        nonlocal acked, nacked
+        for ack_id in done_ack_ids:
+            messages_by_ack_id[ack_id].ack()
+        failed_messages = [messages_by_ack_id[ack_id] for ack_id in failed_ack_ids]
+        if delayed_nacks is not None:
+            delayed_nacks.add(failed_messages)
+        else:
+            for message in failed_messages:
+                message.nack()
+        with counts_lock:
+            acked += len(done_ack_ids)
+            nacked += len(failed_ack_ids)
+
+    upsert_messages, delete_messages = split_bulk_messages(parsed)
+    sync_bulk_messages_in_shards(upsert_messages, delete_messages, on_synced)
+
+    _logger.info(f"Synced streamed batch. acked={acked} nacked={nacked}")
+    maybe_log_metrics("Products sync bulk worker metrics")
+
+
+def _collect_batch(
+    messages: queue.Queue, batch_size: int, batch_wait_sec: float
+) -> list[Message]:
+    try:
+        batch = [messages.get(timeout=1)]
+    except queue.Empty:
+        return []
+
+    deadline = time.monotonic() + batch_wait_sec
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(messages.get(timeout=remaining))
+        except queue.Empty:
+            break
+
+    return batch
+
+
+def _drain_queue(messages: queue.Queue) -> list[Message]:
+    batch = []
+    while True:
+        try:
+            batch.append(messages.get_nowait())
+        except queue.Empty:
+            return batch
+
+
+def run_products_sync_bulk_worker() -> None:
+    # Logs go to stdout like the functions in main.py, the Cloud Logging client
+    # would need credentials even against the emulators
+    setup_logging(name="products_sync_bulk_worker", disable_logging_client=True)
+
+    subscriber = get_pubsub_subscriber_client()
+    subscription_path = get_or_create_subscription(
+        BULK_TOPIC_NAME, True, BULK_SUBSCRIPTION_ACK_DEADLINE_SECONDS
+    )
+
+    # Messages are handed over from the library's callback threads and synced in
+    # batches on this thread. With ordering enabled the library holds back the next
+    # message of a product until the previous one is acked or nacked.
+    received: queue.Queue = queue.Queue()
+    stop_event = threading.Event()
+
+    def callback(message: Message) -> None:
+        if stop_event.is_set():
+            message.nack()
+            return
+        received.put(message)
+
+    def stop(signum, _frame) -> None:
+        _logger.info(f"Received signal {signum}, stopping products_sync_bulk worker")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    streaming_pull_future = subscriber.subscribe(
+        subscription_path,
+        callback=callback,
+        flow_control=get_worker_flow_control(),
+        await_callbacks_on_shutdown=True,
+    )
+    _logger.info(f"Listening for messages on {subscription_path}")
+
+    batch_size, batch_wait_sec = get_worker_batch_size(), get_worker_batch_wait()
+    delayed_nacks = DelayedNacks(get_bulk_nack_delay())
+    try:
+        while not stop_event.is_set() and not streaming_pull_future.done():
+            batch = _collect_batch(received, batch_size, batch_wait_sec)
+            if batch:
+                sync_streamed_messages(batch, delayed_nacks)
+            delayed_nacks.nack_due()
+    finally:
+        # Acks only go through while the stream is open, so sync what is already
+        # buffered before cancelling it. Held messages are released right away.
+        remaining = _drain_queue(received)
+        if remaining:
+            sync_streamed_messages(remaining, delayed_nacks)
+        delayed_nacks.nack_all()
+
+        stream_failed = streaming_pull_future.done() and not stop_event.is_set()
+        streaming_pull_future.cancel()
+        try:
+            streaming_pull_future.result(timeout=30)
+        except Exception as e:
+            if stream_failed:
+                # Exit with an error so the platform restarts the worker
+                _logger.error(f"StreamingPull failed: {e}")
+                raise
+            _logger.info(f"StreamingPull stopped: {e}")
+        finally:
+            shutdown_pubsub_clients()
+
+
+if __name__ == "__main__":
+    run_products_sync_bulk_worker()
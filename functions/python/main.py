@@ -10,11 +10,20 @@ from app.handlers.products_sync import (
     products_sync_bulk_handler,
     products_sync_handler,
 )
+from app.handlers.products_sync_async import (
+    is_products_sync_async_enabled,
+    run_products_sync_bulk_handler_async,
+    run_products_sync_handler_async,
+)
 from app.services.firebase_admin import get_admin_app
 from app.logging import setup_logging
 
 logger = logging.getLogger(__name__)
 
+# PRODUCTS_SYNC_ASYNC=true runs the asyncio variants of both handlers
+if is_products_sync_async_enabled():
+    products_sync_handler = run_products_sync_handler_async  # noqa: F811
+    products_sync_bulk_handler = run_products_sync_bulk_handler_async  # noqa: F811
 
 
 # Triggers on firestore_products_collection_name document created and updated
@@ -42,9 +51,13 @@ def products_sync(
 
 
 # Triggered by pubsub subscription, pulls messages from the bulk topic and processes them
-# TODO: Make sure to optimize this to not overburden the sync
-# We need to make it update in bulk, but not more than x bulk messages a second
-# That means we should time how long does it take for this fn to run and then adjust the max instances and concurrency accordingly
+# Drains the subscription until it is empty or BULK_DRAIN_TIME_BUDGET_SEC runs out,
+# adjusting the pull size to the measured batch latency (BULK_BATCH_TARGET_LATENCY_SEC)
+# Writes are capped per instance by OTHER_PRODUCT_MODEL_WRITE_OPS_PER_SEC/_BURST and
+# backed off when Firestore returns RESOURCE_EXHAUSTED or ABORTED, so max_instances
+# can be raised as long as instances x rate stays within what the target can take
+# Inside a batch products are sharded by id over BULK_SHARDS threads, with reads and
+# writes capped by BULK_READ_CONCURRENCY / BULK_WRITE_CONCURRENCY
 @pubsub_fn.on_message_published(
     topic="trigger-products",  # This should be config.trigger_topic_name but the damn emulator wont work with this or .value
     region="europe-west4",